@@ -62,7 +62,10 @@ const MusicRecommendations = ({ emotion, emotionColor, analysisId, onClose }) =>
     const controller = new AbortController();
     controllerRef.current = controller;
 
-    const response = await musicService.getRecommendations(emotion, 20, { signal: controller.signal });
+    const response = await musicService.getRecommendations(emotion, 20, {
+      signal: controller.signal,
+      analysisId,
+    });
 
     // Si la petición fue cancelada, no actualizar estado (evita carreras)
     if (response.cancelled) {
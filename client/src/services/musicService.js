@@ -14,7 +14,7 @@ const musicService = {
    * Obtiene recomendaciones musicales basadas en la emoción
    * @param {string} emotion
    * @param {number} limit
-   * @param {object} options - Opciones adicionales (p. ej. { signal })
+   * @param {object} options - Opciones adicionales (p. ej. { signal, cursor, analysisId, refresh })
    */
   getRecommendations: async (emotion, limit = 20, options = {}) => {
     try {
@@ -22,6 +22,19 @@ const musicService = {
         params: { limit },
       };
 
+      // Con el cursor de la respuesta anterior se obtienen más canciones del mismo pool
+      if (options.cursor) {
+        config.params.cursor = options.cursor;
+      }
+
+      // Las recomendaciones de un análisis se guardan y se reutilizan al reabrirlo
+      if (options.analysisId) {
+        config.params.analysis_id = options.analysisId;
+      }
+      if (options.refresh) {
+        config.params.refresh = true;
+      }
+
       // Pasar signal si fue provisto (para poder cancelar la petición)
       if (options.signal) {
         config.signal = options.signal;
@@ -39,6 +52,11 @@ const musicService = {
         return { success: false, cancelled: true };
       }
 
+      // Cursor expirado: el caller debe pedir recomendaciones nuevas
+      if (error.response?.status === 410) {
+        return { success: false, expired: true };
+      }
+
       console.error('Error al obtener recomendaciones:', error);
       
       const errorMessage = error.response?.data?.detail 
@@ -153,4 +153,101 @@ COMMENT ON COLUMN users.spotify_connected IS 'Indica si el usuario tiene conecta
 
 -- Comentarios
 COMMENT ON TABLE saved_playlists IS 'Playlists guardadas por los usuarios';
-COMMENT ON VIEW user_history IS 'Vista consolidada del historial de análisis y playlists del usuario';
\ No newline at end of file
+COMMENT ON VIEW user_history IS 'Vista consolidada del historial de análisis y playlists del usuario';
+-- Caché persistente de géneros por artista (enriquecimiento de recomendaciones)
+CREATE TABLE IF NOT EXISTS artist_genres (
+    artist_id VARCHAR(64) PRIMARY KEY,
+    genres JSONB NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Canciones recomendadas recientemente por usuario (filtros Bloom rotativos)
+CREATE TABLE IF NOT EXISTS user_recent_tracks (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    bloom_data BYTEA NOT NULL,
+    rotated_at DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Mercado (país) del perfil de Spotify para búsquedas y cachés por mercado
+ALTER TABLE users ADD COLUMN IF NOT EXISTS spotify_country VARCHAR(2);
+
+-- Perfil de gustos por usuario (contadores incrementales de playlists guardadas)
+CREATE TABLE IF NOT EXISTS user_taste_profiles (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    artists JSONB NOT NULL DEFAULT '{}'::jsonb,
+    genres JSONB NOT NULL DEFAULT '{}'::jsonb,
+    track_count INTEGER NOT NULL DEFAULT 0,
+    popularity_sum BIGINT NOT NULL DEFAULT 0,
+    year_sum BIGINT NOT NULL DEFAULT 0,
+    year_count INTEGER NOT NULL DEFAULT 0,
+    backfilled_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE user_taste_profiles ADD COLUMN IF NOT EXISTS backfilled_at TIMESTAMP WITH TIME ZONE;
+
+-- Biblioteca de Spotify importada por usuario (canciones guardadas)
+CREATE TABLE IF NOT EXISTS user_libraries (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    tracks JSONB,
+    total INTEGER NOT NULL DEFAULT 0,
+    last_added_at VARCHAR(32),
+    status VARCHAR(20) NOT NULL DEFAULT 'idle',
+    error TEXT,
+    synced_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Mix diario opcional (generado en lote por app/cli/generate_daily_mixes.py)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS daily_mix_enabled BOOLEAN DEFAULT FALSE;
+
+CREATE TABLE IF NOT EXISTS daily_mixes (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    mix_date DATE NOT NULL,
+    emotion VARCHAR(50) NOT NULL,
+    market VARCHAR(2) NOT NULL,
+    tracks JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_daily_mixes_user_date UNIQUE (user_id, mix_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_daily_mixes_user_id ON daily_mixes(user_id);
+
+-- Creación de playlists en Spotify en segundo plano (202 + consulta de estado)
+CREATE TABLE IF NOT EXISTS playlist_jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    name VARCHAR(100) NOT NULL,
+    description VARCHAR(300),
+    public BOOLEAN DEFAULT FALSE,
+    track_ids JSONB NOT NULL,
+    tracks_added INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    spotify_playlist_id VARCHAR(255),
+    playlist_url VARCHAR(500),
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_playlist_jobs_user_id ON playlist_jobs(user_id);
+
+-- Claves Idempotency-Key de los endpoints que crean playlists en Spotify
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    endpoint VARCHAR(100) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'in_progress',
+    response JSONB,
+    status_code INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, endpoint, key)
+);
+
+ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS status_code INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys(created_at);
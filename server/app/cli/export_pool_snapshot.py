@@ -0,0 +1,78 @@
+"""
+Exporta los pools de candidatos por (emoción, mercado) a un snapshot columnar
+que los workers mapean en memoria al arrancar (ver SPOTIFY_POOL_SNAPSHOT).
+
+Uso (desde server/):
+    python -m app.cli.export_pool_snapshot --out ./pools
+    python -m app.cli.export_pool_snapshot --out ./pools --markets US,MX --emotions happy,sad
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.controllers.music_controller import MusicController, PRELOAD_TOP_MARKETS
+from app.services.pool_snapshot import export_snapshot
+from app.services.spotify_scheduler import spotify_scheduler, BACKGROUND
+from app.services.spotify_service import spotify_service
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+logger = logging.getLogger("export_pool_snapshot")
+
+
+def _csv(value: str):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Exporta snapshots de pools de candidatos")
+    parser.add_argument('--out', required=True, help="Directorio base de snapshots")
+    parser.add_argument('--markets', type=_csv, help="Mercados separados por coma (por defecto, los principales)")
+    parser.add_argument('--emotions', type=_csv, help="Emociones separadas por coma (por defecto, todas)")
+    parser.add_argument('--budget', type=float, default=30.0, help="Segundos máximos por pool")
+    args = parser.parse_args(argv)
+
+    markets = [m.upper() for m in args.markets] if args.markets else MusicController.get_top_markets(
+        max(PRELOAD_TOP_MARKETS, 1)
+    )
+    emotions = [e.upper() for e in args.emotions] if args.emotions else list(spotify_service.EMOTION_DESCRIPTORS.keys())
+    unknown = [e for e in emotions if e not in spotify_service.EMOTION_DESCRIPTORS]
+    if unknown:
+        parser.error(f"Emociones desconocidas: {', '.join(unknown)}")
+
+    pools = {}
+    started = time.monotonic()
+    # Es un trabajo por lotes: no debe quitarle cupo a las peticiones interactivas
+    with spotify_scheduler.lane(BACKGROUND):
+        for market in markets:
+            for emotion in emotions:
+                try:
+                    tracks, complete = spotify_service.build_candidate_pool(
+                        emotion=emotion,
+                        markets=[market],
+                        deadline=time.monotonic() + args.budget
+                    )
+                except Exception as e:
+                    logger.warning(f"❌ {emotion}/{market}: {e}")
+                    continue
+                logger.info(f"🎵 {emotion}/{market}: {len(tracks)} tracks{'' if complete else ' (incompleto)'}")
+                if tracks:
+                    pools[(emotion, market)] = tracks
+
+    if not pools:
+        logger.error("No se obtuvo ningún pool; no se escribe snapshot")
+        return 1
+
+    os.makedirs(args.out, exist_ok=True)
+    path = export_snapshot(pools, args.out)
+    logger.info(f"✅ Snapshot listo en {path} ({time.monotonic() - started:.1f}s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+Genera los mixes diarios de los usuarios que los activaron (pensado para cron,
+fuera de las horas pico).
+
+Uso (desde server/):
+    python -m app.cli.generate_daily_mixes
+    python -m app.cli.generate_daily_mixes --workers 8 --chunk-size 500 --rate 10
+"""
+import argparse
+import json
+import logging
+import sys
+from datetime import date
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.controllers.music_controller import DEFAULT_MARKET
+from app.services.daily_mix import daily_mix_service
+from app.services.spotify_scheduler import spotify_scheduler
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+logger = logging.getLogger("generate_daily_mixes")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Genera los mixes diarios por emoción")
+    parser.add_argument('--date', type=date.fromisoformat, help="Fecha del mix (AAAA-MM-DD, por defecto hoy en UTC)")
+    parser.add_argument('--chunk-size', type=int, default=daily_mix_service.chunk_size, help="Usuarios por tramo")
+    parser.add_argument('--workers', type=int, default=daily_mix_service.max_workers, help="Hilos por grupo")
+    parser.add_argument('--size', type=int, default=daily_mix_service.mix_size, help="Canciones por mix")
+    parser.add_argument('--rate', type=float, help="Peticiones por segundo a Spotify (por defecto SPOTIFY_RATE_LIMIT)")
+    parser.add_argument('--budget', type=float, default=daily_mix_service.pool_budget, help="Segundos máximos por pool")
+    args = parser.parse_args(argv)
+
+    daily_mix_service.chunk_size = args.chunk_size
+    daily_mix_service.max_workers = args.workers
+    daily_mix_service.mix_size = args.size
+    daily_mix_service.pool_budget = args.budget
+    if args.rate is not None:
+        spotify_scheduler.set_rate(args.rate)
+
+    report = daily_mix_service.run(mix_date=args.date, default_market=DEFAULT_MARKET)
+    logger.info(
+        f"✅ {report['mixes']} mixes para {report['users']} usuarios en {report['elapsed_seconds']}s "
+        f"({report['users_per_minute']} usuarios/min, {report['calls_per_user']} llamadas a Spotify por usuario)"
+    )
+    print(json.dumps(report, indent=2))
+    return 0 if report['errors'] == 0 or report['mixes'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,68 +1,452 @@
 from fastapi import HTTPException, status
 from sqlalchemy.orm import Session
 from app.services.spotify_service import spotify_service
+from app.services.spotify_async import async_spotify_service
+from app.services.spotify_http import spotify_user_session, session_metrics
 from app.services.spotify_user_service import spotify_user_service
-from app.schemas.music_schemas import MusicRecommendationsResponse
+from app.services.history_service import HistoryService
+from app.services.emotion_config import emotion_config
+from app.services.library_sync import library_sync_service
+from app.services.playlist_jobs import playlist_job_service
+from app.services.daily_mix import daily_mix_service
+from app.schemas.music_schemas import MusicRecommendationsResponse, LibrarySyncStatus, DailyMixResponse, DailyMixSettings, PlaylistJobStatus
+from app.schemas.history_schemas import ExtendPlaylistRequest, ExtendPlaylistResponse, SavedPlaylistResponse
 from app.models.user import User
+from app.config.database import SessionLocal
+from sqlalchemy import func, desc
+from starlette.concurrency import run_in_threadpool
+from typing import Optional, List
+import os
+import re
 import logging
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MARKET = os.getenv("SPOTIFY_DEFAULT_MARKET", "US")
+PRELOAD_TOP_MARKETS = int(os.getenv("SPOTIFY_PRELOAD_TOP_MARKETS", "3"))
+_LOCALE_REGION = re.compile(r"^[a-zA-Z]{2,3}[-_]([a-zA-Z]{2})$")
+
 class MusicController:
+
+    @staticmethod
+    def resolve_market(user: User, accept_language: Optional[str], db: Session) -> str:
+        """
+        Determina el mercado de Spotify del usuario.
+
+        Orden: país guardado del perfil de Spotify, país del perfil (se guarda
+        en el usuario), región del header Accept-Language y mercado por defecto.
+        """
+        if user.spotify_country:
+            return user.spotify_country
+
+        if user.spotify_connected:
+            try:
+                profile = spotify_user_service.get_user_spotify_profile(user, db)
+                country = profile.get("country")
+                if country:
+                    user.spotify_country = country
+                    db.commit()
+                    return country
+            except Exception as e:
+                logger.warning(f"No se pudo obtener el país de Spotify de {user.username}: {e}")
+
+        for tag in (accept_language or "").split(","):
+            match = _LOCALE_REGION.match(tag.split(";")[0].strip())
+            if match:
+                return match.group(1).upper()
+
+        return DEFAULT_MARKET
+
+    @staticmethod
+    def get_top_markets(limit: int) -> List[str]:
+        """Mercados con más usuarios conectados (o el mercado por defecto)."""
+        db = SessionLocal()
+        try:
+            rows = db.query(User.spotify_country, func.count(User.id).label('count')).filter(
+                User.spotify_country.isnot(None)
+            ).group_by(User.spotify_country).order_by(desc('count')).limit(limit).all()
+            markets = [country for country, _ in rows]
+        except Exception as e:
+            logger.warning(f"No se pudieron calcular los mercados principales: {e}")
+            markets = []
+        finally:
+            db.close()
+        return markets or [DEFAULT_MARKET]
+
+    @staticmethod
+    def preload_top_markets() -> None:
+        """Precarga los pools de candidatos de los mercados principales."""
+        if PRELOAD_TOP_MARKETS <= 0:
+            return
+        markets = MusicController.get_top_markets(PRELOAD_TOP_MARKETS)
+        spotify_service.preload_pools(markets)
     
     @staticmethod
-    def get_recommendations(emotion: str, limit: int = 20) -> MusicRecommendationsResponse:
+    def get_recommendations(
+        emotion: str,
+        limit: int = 20,
+        user_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        analysis_id: Optional[str] = None,
+        refresh: bool = False,
+        db: Optional[Session] = None,
+        market: Optional[str] = None
+    ) -> MusicRecommendationsResponse:
         """
         Obtiene recomendaciones musicales basadas en la emoción
         
         Args:
             emotion: Emoción detectada
             limit: Número de canciones a recomendar
+            user_id: ID del usuario (dueño del cursor)
+            cursor: Cursor de una respuesta anterior para obtener más canciones
+            analysis_id: Análisis asociado; sus recomendaciones se guardan y reutilizan
+            refresh: Forzar nuevas recomendaciones aunque haya guardadas
+            db: Sesión de base de datos (necesaria con analysis_id)
+            market: Mercado de Spotify del usuario (ver resolve_market)
             
         Returns:
             MusicRecommendationsResponse con las recomendaciones
         """
         try:
-            # Validar emoción
-            valid_emotions = ['HAPPY', 'SAD', 'ANGRY', 'CALM', 'SURPRISED', 'FEAR', 'DISGUSTED', 'CONFUSED']
-            if emotion.upper() not in valid_emotions:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Emoción inválida. Debe ser una de: {', '.join(valid_emotions)}"
+            emotion = MusicController._validate_recommendation_request(emotion, limit)
+
+            # Reutilizar las recomendaciones guardadas del análisis
+            use_analysis = bool(analysis_id and db is not None and not cursor)
+            if use_analysis:
+                HistoryService.get_user_analysis(analysis_id, user_id, db)
+                if not refresh:
+                    stored = MusicController._stored_response(
+                        HistoryService.get_stored_recommendations(analysis_id, emotion, db), emotion, limit, analysis_id
+                    )
+                    if stored:
+                        return stored
+
+            # Obtener recomendaciones (página siguiente si hay cursor)
+            if cursor:
+                result = MusicController._check_page(
+                    spotify_service.get_more_recommendations(cursor, limit, user_id=user_id, emotion=emotion)
+                )
+            else:
+                # Canciones de la biblioteca importada del usuario que encajan con la emoción
+                genres = emotion_config.current().descriptors[emotion]['genres']
+                result = spotify_service.get_recommendations(
+                    emotion,
+                    limit,
+                    user_id=user_id,
+                    market=market,
+                    extra_candidates=library_sync_service.matching(user_id, genres, limit * 2)
                 )
+
+            MusicController._check_result(result)
+            # Un resultado parcial (presupuesto agotado) no se guarda: se repetiría como completo
+            if use_analysis and result.get('complete', True):
+                HistoryService.store_recommendations(analysis_id, result, db)
+
+            return MusicController._recommendations_response(result, emotion)
             
-            # Validar límite
-            if limit < 1 or limit > 100:
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error en get_recommendations: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error al obtener recomendaciones: {str(e)}"
+            )
+
+    @staticmethod
+    async def get_recommendations_async(
+        emotion: str,
+        limit: int = 20,
+        user_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        analysis_id: Optional[str] = None,
+        refresh: bool = False,
+        db: Optional[Session] = None,
+        market: Optional[str] = None
+    ) -> MusicRecommendationsResponse:
+        """
+        Versión asíncrona de get_recommendations (mismos argumentos y respuesta).
+
+        La recolección en Spotify corre en el event loop (async_spotify_service)
+        y sólo los accesos a base de datos pasan por el threadpool.
+        """
+        try:
+            emotion = MusicController._validate_recommendation_request(emotion, limit)
+
+            use_analysis = bool(analysis_id and db is not None and not cursor)
+            if use_analysis:
+                await run_in_threadpool(HistoryService.get_user_analysis, analysis_id, user_id, db)
+                if not refresh:
+                    stored = MusicController._stored_response(
+                        await run_in_threadpool(HistoryService.get_stored_recommendations, analysis_id, emotion, db),
+                        emotion, limit, analysis_id
+                    )
+                    if stored:
+                        return stored
+
+            if cursor:
+                result = MusicController._check_page(await run_in_threadpool(
+                    spotify_service.get_more_recommendations, cursor, limit, user_id, emotion
+                ))
+            else:
+                genres = emotion_config.current().descriptors[emotion]['genres']
+                extra = await run_in_threadpool(library_sync_service.matching, user_id, genres, limit * 2)
+                result = await async_spotify_service.get_recommendations(
+                    emotion,
+                    limit,
+                    user_id=user_id,
+                    market=market,
+                    extra_candidates=extra
+                )
+
+            MusicController._check_result(result)
+            if use_analysis and result.get('complete', True):
+                await run_in_threadpool(HistoryService.store_recommendations, analysis_id, result, db)
+
+            return MusicController._recommendations_response(result, emotion)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error en get_recommendations_async: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error al obtener recomendaciones: {str(e)}"
+            )
+
+    # ============ PASOS COMUNES (versiones sync y async) ============
+
+    @staticmethod
+    def _validate_recommendation_request(emotion: str, limit: int) -> str:
+        """Valida emoción y límite; retorna la emoción en mayúsculas."""
+        valid_emotions = emotion_config.emotions()
+        if emotion.upper() not in valid_emotions:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Emoción inválida. Debe ser una de: {', '.join(valid_emotions)}"
+            )
+
+        if limit < 1 or limit > 100:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El límite debe estar entre 1 y 100"
+            )
+        return emotion.upper()
+
+    @staticmethod
+    def _stored_response(
+        stored: Optional[dict],
+        emotion: str,
+        limit: int,
+        analysis_id: str
+    ) -> Optional[MusicRecommendationsResponse]:
+        """Respuesta con las recomendaciones guardadas del análisis, si alcanzan para `limit`."""
+        if not stored or stored['total'] < limit:
+            return None
+        stored['tracks'] = stored['tracks'][:limit]
+        stored['total'] = len(stored['tracks'])
+        logger.info(f"♻️  Recomendaciones servidas desde el análisis {analysis_id}")
+        return MusicController._recommendations_response(stored, emotion)
+
+    @staticmethod
+    def _check_page(result: Optional[dict]) -> dict:
+        if result is None:
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="El cursor expiró o no es válido. Solicita nuevas recomendaciones"
+            )
+        return result
+
+    @staticmethod
+    def _check_result(result: dict):
+        if not result['success']:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=result.get('error', 'Error al obtener recomendaciones')
+            )
+
+    @staticmethod
+    def _recommendations_response(result: dict, emotion: str) -> MusicRecommendationsResponse:
+        # Agregar descripción de playlist
+        result['playlist_description'] = spotify_service.create_playlist_description(emotion)
+        return MusicRecommendationsResponse(**result)
+
+    @staticmethod
+    def get_metrics() -> dict:
+        """
+        Métricas del cliente de Spotify (hedging, latencias, etc.)
+
+        Returns:
+            Dict con las métricas actuales del proceso
+        """
+        metrics = spotify_service.get_metrics()
+        metrics['async_client'] = async_spotify_service.get_metrics()
+        metrics['user_http_pool'] = session_metrics(spotify_user_session)
+        metrics['token_refresh'] = spotify_user_service.token_stats()
+        metrics['user_playlists_cache'] = spotify_user_service.playlist_cache_stats()
+        metrics['user_lookup_cache'] = spotify_user_service.lookup_cache_stats()
+        return {
+            "success": True,
+            "metrics": metrics
+        }
+
+    @staticmethod
+    def start_library_sync(user: User, full: bool = False) -> LibrarySyncStatus:
+        """
+        Encola la importación de las canciones guardadas del usuario en Spotify.
+
+        Args:
+            user: Usuario actual
+            full: Reimportar todo en lugar de sólo lo guardado desde la última sincronización
+
+        Returns:
+            LibrarySyncStatus con el estado tras encolar
+        """
+        if not user.spotify_connected:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Debes conectar tu cuenta de Spotify para importar tu biblioteca"
+            )
+
+        if not library_sync_service.start(str(user.id), full=full):
+            logger.info(f"📚 Sincronización ya en curso para {user.username}")
+
+        return LibrarySyncStatus(**library_sync_service.status(str(user.id)))
+
+    @staticmethod
+    def get_library_status(user: User) -> LibrarySyncStatus:
+        """Estado de la última importación de la biblioteca del usuario."""
+        return LibrarySyncStatus(**library_sync_service.status(str(user.id)))
+
+    @staticmethod
+    def get_daily_mix(user: User, db: Session) -> DailyMixResponse:
+        """
+        Mix diario del usuario (generado en lote por app/cli/generate_daily_mixes.py).
+
+        Returns:
+            DailyMixResponse con el mix de hoy
+        """
+        mix = daily_mix_service.get_mix(str(user.id), db)
+        if mix is None:
+            detail = (
+                "Tu mix de hoy todavía no está listo"
+                if user.daily_mix_enabled else
+                "Activa el mix diario para recibirlo"
+            )
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+        return DailyMixResponse(**mix)
+
+    @staticmethod
+    def update_daily_mix_settings(user: User, settings: DailyMixSettings, db: Session) -> DailyMixSettings:
+        """Activa o desactiva el mix diario del usuario."""
+        try:
+            return DailyMixSettings(enabled=daily_mix_service.set_enabled(user, settings.enabled, db))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error actualizando el mix diario de {user.username}: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error al actualizar la preferencia del mix diario"
+            )
+
+    @staticmethod
+    def extend_saved_playlist(
+        user: User,
+        playlist_id: str,
+        request: ExtendPlaylistRequest,
+        db: Session,
+        market: Optional[str] = None
+    ) -> ExtendPlaylistResponse:
+        """
+        Amplía una playlist guardada con canciones del pool en caché de su emoción.
+
+        Args:
+            user: Usuario actual
+            playlist_id: ID de la playlist guardada
+            request: Cantidad de canciones y playlist de Spotify opcional
+            db: Sesión de base de datos
+            market: Mercado de Spotify del usuario (ver resolve_market)
+
+        Returns:
+            ExtendPlaylistResponse con la playlist actualizada y las canciones agregadas
+        """
+        try:
+            playlist = HistoryService.get_playlist_by_id(playlist_id, str(user.id), db)
+            emotion = playlist.emotion.upper()
+            if emotion not in emotion_config.emotions():
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="El límite debe estar entre 1 y 100"
+                    detail=f"La emoción de la playlist ya no está disponible: {emotion}"
                 )
-            
-            # Obtener recomendaciones
-            result = spotify_service.get_recommendations(emotion.upper(), limit)
-            
-            if not result['success']:
+
+            if request.spotify_playlist_id:
+                if not user.spotify_connected:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Debes conectar tu cuenta de Spotify para modificar tus playlists"
+                    )
+                if not spotify_user_service.check_playlist_ownership(user, request.spotify_playlist_id, db):
+                    raise HTTPException(
+                        status_code=status.HTTP_403_FORBIDDEN,
+                        detail="La playlist de Spotify no te pertenece"
+                    )
+
+            genres = emotion_config.current().descriptors[emotion]['genres']
+            result = spotify_service.extend_tracks(
+                emotion,
+                playlist.tracks or [],
+                limit=request.limit,
+                market=market,
+                user_id=str(user.id),
+                extra_candidates=library_sync_service.matching(str(user.id), genres, request.limit * 2)
+            )
+            new_tracks = result['tracks']
+            if not new_tracks:
                 raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=result.get('error', 'Error al obtener recomendaciones')
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="No hay más canciones disponibles para ampliar esta playlist"
                 )
-            
-            # Agregar descripción de playlist
-            result['playlist_description'] = spotify_service.create_playlist_description(emotion.upper())
-            
-            return MusicRecommendationsResponse(**result)
-            
+
+            # Primero en Spotify: si falla, la playlist guardada no cambia
+            spotify_result = None
+            if request.spotify_playlist_id:
+                spotify_result = spotify_user_service.add_tracks_to_playlist(
+                    user, request.spotify_playlist_id, [t['id'] for t in new_tracks], db
+                )
+
+            playlist = HistoryService.append_tracks(playlist, new_tracks, db)
+
+            return ExtendPlaylistResponse(
+                playlist=SavedPlaylistResponse(
+                    id=str(playlist.id),
+                    user_id=str(playlist.user_id),
+                    analysis_id=str(playlist.analysis_id) if playlist.analysis_id else None,
+                    playlist_name=playlist.playlist_name,
+                    emotion=playlist.emotion,
+                    description=playlist.description,
+                    tracks=playlist.tracks,
+                    music_params=playlist.music_params,
+                    is_favorite=playlist.is_favorite,
+                    created_at=playlist.created_at,
+                    updated_at=playlist.updated_at
+                ),
+                added_tracks=new_tracks,
+                from_cache=result['from_cache'],
+                spotify=spotify_result
+            )
+
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"Error en get_recommendations: {str(e)}")
+            logger.error(f"Error ampliando playlist {playlist_id}: {str(e)}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Error al obtener recomendaciones: {str(e)}"
+                detail=f"Error al ampliar la playlist: {str(e)}"
             )
 
     @staticmethod
-    def create_spotify_playlist(
+    async def create_spotify_playlist(
         user: User,
         name: str,
         description: str,
@@ -98,7 +482,7 @@ class MusicController:
                 )
 
             # Crear playlist en Spotify
-            playlist_data = spotify_user_service.create_playlist(
+            playlist_data = await spotify_user_service.create_playlist_async(
                 user=user,
                 name=name,
                 description=description,
@@ -125,14 +509,77 @@ class MusicController:
             )
 
     @staticmethod
-    def get_user_spotify_playlists(user: User, db: Session, limit: int = 50) -> dict:
+    def enqueue_spotify_playlist(
+        user: User,
+        name: str,
+        description: str,
+        track_ids: list,
+        public: bool,
+        db: Session
+    ) -> PlaylistJobStatus:
+        """
+        Encola la creación de una playlist en Spotify y responde sin esperarla.
+
+        Args:
+            user: Usuario actual
+            name: Nombre de la playlist
+            description: Descripción de la playlist
+            track_ids: Lista de IDs de canciones de Spotify
+            public: Si la playlist debe ser pública
+            db: Sesión de base de datos
+
+        Returns:
+            PlaylistJobStatus con el trabajo recién encolado
+        """
+        if not user.spotify_connected:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Debes conectar tu cuenta de Spotify para crear playlists"
+            )
+
+        if not track_ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Debes proporcionar al menos una canción para la playlist"
+            )
+
+        try:
+            job = playlist_job_service.enqueue(user, name, description, track_ids, public, db)
+            return PlaylistJobStatus(**playlist_job_service.to_status(job))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error encolando playlist en Spotify: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error al encolar la playlist: {str(e)}"
+            )
+
+    @staticmethod
+    def get_playlist_job(user: User, job_id: str, db: Session) -> PlaylistJobStatus:
+        """Estado y progreso de un trabajo de creación de playlist del usuario."""
+        job = playlist_job_service.get(job_id, str(user.id), db)
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Trabajo de playlist no encontrado"
+            )
+        return PlaylistJobStatus(**playlist_job_service.to_status(job))
+
+    @staticmethod
+    async def get_user_spotify_playlists(
+        user: User,
+        db: Session,
+        limit: Optional[int] = None,
+        offset: int = 0
+    ) -> dict:
         """
         Obtiene las playlists del usuario desde Spotify.
 
         Args:
             user: Usuario actual
             db: Sesión de base de datos
-            limit: Número máximo de playlists
+            limit: Número máximo de playlists (None = todas)
+            offset: Posición de la primera playlist
 
         Returns:
             Dict con las playlists del usuario
@@ -144,11 +591,12 @@ class MusicController:
                     detail="Debes conectar tu cuenta de Spotify"
                 )
 
-            playlists = spotify_user_service.get_user_playlists(user, db, limit)
+            playlists = await spotify_user_service.get_user_playlists_async(user, db)
+            end = None if limit is None else offset + limit
 
             return {
                 "success": True,
-                "playlists": playlists,
+                "playlists": playlists[offset:end],
                 "total": len(playlists)
             }
 
@@ -159,4 +607,52 @@ class MusicController:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Error al obtener playlists: {str(e)}"
+            )
+
+    @staticmethod
+    async def add_tracks_to_spotify_playlist(
+        user: User,
+        playlist_id: str,
+        track_ids: list,
+        db: Session
+    ) -> dict:
+        """
+        Agrega canciones a una playlist de Spotify del usuario.
+
+        Args:
+            user: Usuario actual
+            playlist_id: ID de la playlist en Spotify
+            track_ids: Lista de IDs de canciones de Spotify
+            db: Sesión de base de datos
+
+        Returns:
+            Dict con el número de canciones agregadas
+        """
+        try:
+            if not user.spotify_connected:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Debes conectar tu cuenta de Spotify"
+                )
+
+            if not await spotify_user_service.check_playlist_ownership_async(user, playlist_id, db):
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Solo puedes agregar canciones a tus propias playlists de Spotify"
+                )
+
+            result = await spotify_user_service.add_tracks_to_playlist_async(user, playlist_id, track_ids, db)
+
+            return {
+                **result,
+                "message": f"{result['tracks_added']} canciones agregadas a tu playlist de Spotify"
+            }
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error agregando canciones a playlist de Spotify: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error al agregar canciones: {str(e)}"
             )
\ No newline at end of file
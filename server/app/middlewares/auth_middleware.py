@@ -1,4 +1,7 @@
-from fastapi import Depends, HTTPException, status
+import os
+import hmac
+from typing import Optional
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from app.config.database import get_db
@@ -65,4 +68,23 @@ def get_current_active_user(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Usuario inactivo"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+def require_metrics_token(
+    x_metrics_token: Optional[str] = Header(None)
+) -> None:
+    """
+    Middleware para rutas internas (métricas): exige el header X-Metrics-Token
+    igual a METRICS_TOKEN. Sin METRICS_TOKEN configurado la ruta no existe (404)
+    """
+    expected = os.getenv('METRICS_TOKEN')
+    if not expected:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not Found"
+        )
+    if not x_metrics_token or not hmac.compare_digest(x_metrics_token, expected):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Token de métricas inválido"
+        )
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from app.config.database import Base
+
+class ArtistGenre(Base):
+    __tablename__ = "artist_genres"
+
+    # Caché persistente artista -> géneros (los géneros sólo vienen en /artists)
+    artist_id = Column(String(64), primary_key=True)
+    genres = Column(JSONB, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ArtistGenre(artist_id='{self.artist_id}', genres={len(self.genres or [])})>"
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Date, DateTime, ForeignKey, String, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.config.database import Base
+import uuid
+
+class DailyMix(Base):
+    __tablename__ = "daily_mixes"
+    __table_args__ = (UniqueConstraint('user_id', 'mix_date', name='uq_daily_mixes_user_date'),)
+
+    # Mix diario generado en lote (ver app/cli/generate_daily_mixes.py)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    mix_date = Column(Date, nullable=False)
+    emotion = Column(String(50), nullable=False)  # emoción dominante de los análisis recientes
+    market = Column(String(2), nullable=False)
+    tracks = Column(JSONB, nullable=False)  # filas empaquetadas (ver pack_tracks)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<DailyMix(user_id='{self.user_id}', date='{self.mix_date}', emotion='{self.emotion}')>"
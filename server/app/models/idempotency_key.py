@@ -0,0 +1,21 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.config.database import Base
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Resultado guardado por cabecera Idempotency-Key (ver app/services/idempotency.py)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    endpoint = Column(String(100), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # sha256 del cuerpo de la petición
+    status = Column(String(20), nullable=False, default='in_progress')  # in_progress | done
+    response = Column(JSONB, nullable=True)
+    status_code = Column(Integer, nullable=True)  # sólo si se guardó un error (se repite en los duplicados)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<IdempotencyKey(user_id='{self.user_id}', endpoint='{self.endpoint}', status='{self.status}')>"
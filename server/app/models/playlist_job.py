@@ -0,0 +1,27 @@
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.config.database import Base
+import uuid
+
+class PlaylistJob(Base):
+    __tablename__ = "playlist_jobs"
+
+    # Creación de playlist en Spotify en segundo plano (ver app/services/playlist_jobs.py)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default='queued')  # queued | running | done | error
+    name = Column(String(100), nullable=False)
+    description = Column(String(300), nullable=True)
+    public = Column(Boolean, default=False)
+    track_ids = Column(JSONB, nullable=False)
+    tracks_added = Column(Integer, nullable=False, default=0)  # progreso; los reintentos siguen desde aquí
+    attempts = Column(Integer, nullable=False, default=0)  # reintentos por 429 / errores transitorios
+    spotify_playlist_id = Column(String(255), nullable=True)
+    playlist_url = Column(String(500), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<PlaylistJob(id='{self.id}', status='{self.status}', added={self.tracks_added}/{len(self.track_ids or [])})>"
@@ -35,6 +35,10 @@ class User(Base):
     spotify_token_expires_at = Column(DateTime(timezone=True), nullable=True)
     spotify_connected = Column(Boolean, default=False)
     spotify_connected_at = Column(DateTime(timezone=True), nullable=True)
+    spotify_country = Column(String(2), nullable=True)  # Mercado del perfil de Spotify
+
+    # Mix diario generado en lote a partir de los análisis recientes
+    daily_mix_enabled = Column(Boolean, default=False)
 
     def __repr__(self):
         return f"<User(username='{self.username}', email='{self.email}', spotify_connected={self.spotify_connected})>"
\ No newline at end of file
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.config.database import Base
+
+class UserLibrary(Base):
+    __tablename__ = "user_libraries"
+
+    # Índice local de las canciones guardadas del usuario en Spotify (/me/tracks)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    tracks = Column(JSONB, nullable=True)  # filas empaquetadas (ver pack_tracks), más recientes primero
+    total = Column(Integer, nullable=False, default=0)
+    last_added_at = Column(String(32), nullable=True)  # marcador de sincronización (added_at más reciente)
+    status = Column(String(20), nullable=False, default='idle')  # idle | running | done | error
+    error = Column(Text, nullable=True)
+    synced_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<UserLibrary(user_id='{self.user_id}', total={self.total}, status='{self.status}')>"
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, DateTime, ForeignKey, LargeBinary, Float
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.config.database import Base
+
+class UserRecentTracks(Base):
+    __tablename__ = "user_recent_tracks"
+
+    # Filtros Bloom rotativos con las canciones recomendadas recientemente
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    bloom_data = Column(LargeBinary, nullable=False)
+    rotated_at = Column(Float, nullable=False)  # epoch de la generación actual
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<UserRecentTracks(user_id='{self.user_id}', bytes={len(self.bloom_data or b'')})>"
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, BigInteger
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.config.database import Base
+
+class UserTasteProfile(Base):
+    __tablename__ = "user_taste_profiles"
+
+    # Contadores acumulados de las playlists guardadas (se ajustan al guardar/eliminar)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    artists = Column(JSONB, nullable=False, default=dict)  # artista (ID o "name:<nombre>") -> apariciones
+    genres = Column(JSONB, nullable=False, default=dict)   # género -> apariciones
+    track_count = Column(Integer, nullable=False, default=0)
+    popularity_sum = Column(BigInteger, nullable=False, default=0)
+    year_sum = Column(BigInteger, nullable=False, default=0)
+    year_count = Column(Integer, nullable=False, default=0)
+    # Cuándo se reconstruyó con todas las playlists guardadas; NULL = falta el backfill
+    backfilled_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<UserTasteProfile(user_id='{self.user_id}', tracks={self.track_count})>"
@@ -1,14 +1,17 @@
-from fastapi import APIRouter, Depends, Query, status
+from fastapi import APIRouter, Depends, Query, status, Header
 from sqlalchemy.orm import Session
 from app.config.database import get_db
 from app.models.emotion_analysis import SavedPlaylist
 from app.middlewares.auth_middleware import get_current_active_user
 from app.models.user import User
 from app.services.history_service import HistoryService
+from app.controllers.music_controller import MusicController
 from app.schemas.history_schemas import (
     SavePlaylistRequest,
     UpdatePlaylistRequest,
     SavedPlaylistResponse,
+    ExtendPlaylistRequest,
+    ExtendPlaylistResponse,
     HistoryResponse,
     HistoryStatsResponse,
     HistoryItemResponse,
@@ -303,6 +306,38 @@ def update_playlist(
         updated_at=playlist.updated_at
     )
 
+@router.post(
+    "/playlists/{playlist_id}/extend",
+    response_model=ExtendPlaylistResponse,
+    summary="Ampliar playlist",
+    description="Agrega canciones nuevas de la misma emoción a una playlist guardada"
+)
+def extend_playlist(
+    playlist_id: str,
+    extend_data: ExtendPlaylistRequest,
+    accept_language: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Amplía una playlist guardada con "más canciones como estas".
+
+    - **limit**: Canciones a agregar (1-50, default: 20)
+    - **spotify_playlist_id**: Opcional. Playlist de Spotify del usuario donde
+      también se agregan (requiere cuenta de Spotify conectada)
+
+    Las canciones salen del pool de candidatos en caché de la emoción y del
+    mercado del usuario, sin repetir las que ya tiene la playlist y priorizando
+    sus artistas y géneros. Sólo se busca en Spotify si el pool no está en caché.
+    """
+    return MusicController.extend_saved_playlist(
+        user=current_user,
+        playlist_id=playlist_id,
+        request=extend_data,
+        db=db,
+        market=MusicController.resolve_market(current_user, accept_language, db)
+    )
+
 @router.delete(
     "/playlists/{playlist_id}",
     response_model=MessageResponse,
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, Query, status, Body
+from fastapi import APIRouter, Depends, Query, status, Body, Header, Response
 from sqlalchemy.orm import Session
 from app.config.database import get_db
 from app.controllers.music_controller import MusicController
-from app.schemas.music_schemas import MusicRecommendationsResponse
-from app.middlewares.auth_middleware import get_current_active_user
+from app.schemas.music_schemas import MusicRecommendationsResponse, LibrarySyncStatus, DailyMixResponse, DailyMixSettings, PlaylistJobStatus
+from app.middlewares.auth_middleware import get_current_active_user, require_metrics_token
+from app.services.idempotency import idempotency_service
 from app.models.user import User
 from pydantic import BaseModel, Field
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from uuid import UUID
 
 router = APIRouter(
     prefix="/api/music",
@@ -20,6 +23,10 @@ class CreateSpotifyPlaylistRequest(BaseModel):
     track_ids: List[str] = Field(..., min_items=1, description="IDs de las canciones de Spotify")
     public: bool = Field(default=False, description="Si la playlist debe ser pública")
 
+# Schema para agregar canciones a una playlist de Spotify
+class AddSpotifyTracksRequest(BaseModel):
+    track_ids: List[str] = Field(..., min_items=1, description="IDs de las canciones de Spotify")
+
 @router.get(
     "/recommendations/{emotion}",
     response_model=MusicRecommendationsResponse,
@@ -27,16 +34,35 @@ class CreateSpotifyPlaylistRequest(BaseModel):
     summary="Obtener recomendaciones musicales",
     description="Obtiene recomendaciones de canciones de Spotify basadas en la emoción detectada"
 )
-def get_music_recommendations(
+async def get_music_recommendations(
     emotion: str,
     limit: int = Query(20, ge=1, le=100, description="Número de canciones a recomendar"),
-    current_user: User = Depends(get_current_active_user)
+    cursor: Optional[str] = Query(None, description="Cursor de la respuesta anterior para obtener más canciones"),
+    analysis_id: Optional[UUID] = Query(None, description="ID del análisis; reutiliza sus recomendaciones guardadas"),
+    refresh: bool = Query(False, description="Generar recomendaciones nuevas aunque el análisis tenga guardadas"),
+    accept_language: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
 ):
     """
     Obtiene recomendaciones musicales personalizadas:
     
     - **emotion**: Emoción detectada (HAPPY, SAD, ANGRY, CALM, SURPRISED, FEAR, DISGUSTED, CONFUSED)
     - **limit**: Número de canciones (1-100, default: 20)
+    - **cursor**: Opcional. Con el `cursor` de una respuesta anterior se sirven más
+      canciones del mismo pool de candidatos, sin repetir y sin nuevas búsquedas.
+      Si expiró se responde 410 y hay que pedir recomendaciones nuevas. El pool vive
+      en el worker que sirvió la primera página: con varios workers hace falta
+      afinidad de sesión, o las páginas siguientes también responden 410.
+    - **analysis_id**: Opcional. Las recomendaciones se guardan para ese análisis y se
+      reutilizan en pedidos posteriores (p. ej. al reabrirlo desde el historial).
+    - **refresh**: Fuerza a generar recomendaciones nuevas para el análisis.
+
+    El mercado de las búsquedas sale del país del perfil de Spotify del usuario
+    o, si no lo hay, de la región del header `Accept-Language`.
+
+    Las llamadas a Spotify son asíncronas (HTTP/2 compartido), así que una
+    recomendación en curso no ocupa un hilo del servidor mientras espera.
     
     Las recomendaciones se basan en:
     - **Valence**: Nivel de positividad musical
@@ -51,7 +77,118 @@ def get_music_recommendations(
     - Preview de audio (si disponible)
     - Imagen del álbum
     """
-    return MusicController.get_recommendations(emotion, limit)
+    market = await run_in_threadpool(MusicController.resolve_market, current_user, accept_language, db)
+    return await MusicController.get_recommendations_async(
+        emotion,
+        limit,
+        user_id=str(current_user.id),
+        cursor=cursor,
+        analysis_id=str(analysis_id) if analysis_id else None,
+        refresh=refresh,
+        db=db,
+        market=market
+    )
+
+@router.get(
+    "/metrics",
+    status_code=status.HTTP_200_OK,
+    summary="Métricas del cliente de Spotify",
+    description="Expone contadores internos del cliente de Spotify (hedging y tasas de acierto)",
+    include_in_schema=False,
+    dependencies=[Depends(require_metrics_token)]
+)
+def get_music_metrics():
+    """
+    Obtiene métricas del proceso actual (ruta interna):
+
+    - Requiere el header **X-Metrics-Token** igual a METRICS_TOKEN; sin esa variable responde 404
+    - **hedging**: llamadas, duplicados enviados, duplicados ganadores y p90 por tipo de llamada
+    """
+    return MusicController.get_metrics()
+
+@router.post(
+    "/library/sync",
+    response_model=LibrarySyncStatus,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Importar biblioteca de Spotify",
+    description="Encola la importación de las canciones guardadas del usuario en Spotify"
+)
+def sync_spotify_library(
+    full: bool = Query(False, description="Reimportar toda la biblioteca"),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Importa en segundo plano las canciones guardadas del usuario en Spotify.
+
+    Requiere tener una cuenta de Spotify vinculada.
+
+    - **full**: Reimporta todo (por defecto sólo lo guardado desde la última sincronización)
+
+    Las canciones importadas se suman a los candidatos de las recomendaciones
+    sin llamadas extra a Spotify. El progreso se consulta en `/library/status`.
+    """
+    return MusicController.start_library_sync(current_user, full)
+
+@router.get(
+    "/library/status",
+    response_model=LibrarySyncStatus,
+    status_code=status.HTTP_200_OK,
+    summary="Estado de la biblioteca importada",
+    description="Obtiene el estado de la última importación de la biblioteca de Spotify"
+)
+def get_spotify_library_status(
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Obtiene el estado de la importación de la biblioteca:
+
+    - **status**: idle, running, done o error
+    - **total**: Canciones en el índice local
+    - **last_synced_at**: Fecha de la última sincronización completada
+    """
+    return MusicController.get_library_status(current_user)
+
+@router.get(
+    "/daily-mix",
+    response_model=DailyMixResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Obtener mix diario",
+    description="Obtiene el mix del día generado a partir de los análisis recientes"
+)
+def get_daily_mix(
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Obtiene el mix diario del usuario:
+
+    - **emotion**: Emoción dominante de los análisis de los últimos días
+    - **market**: Mercado usado para las canciones
+    - **tracks**: Canciones del mix
+
+    Los mixes se generan en lote fuera de las horas pico; si el de hoy todavía
+    no existe (o el mix diario no está activado) se responde 404.
+    """
+    return MusicController.get_daily_mix(current_user, db)
+
+@router.put(
+    "/daily-mix/settings",
+    response_model=DailyMixSettings,
+    status_code=status.HTTP_200_OK,
+    summary="Activar mix diario",
+    description="Activa o desactiva la generación del mix diario"
+)
+def update_daily_mix_settings(
+    settings: DailyMixSettings,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Activa o desactiva el mix diario:
+
+    - **enabled**: Si se genera un mix cada día a partir de tus análisis recientes
+    """
+    return MusicController.update_daily_mix_settings(current_user, settings, db)
 
 @router.post(
     "/spotify/create-playlist",
@@ -59,8 +196,10 @@ def get_music_recommendations(
     summary="Crear playlist en Spotify",
     description="Crea una playlist en la cuenta de Spotify del usuario con las canciones seleccionadas"
 )
-def create_spotify_playlist(
+async def create_spotify_playlist(
     playlist_data: CreateSpotifyPlaylistRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, description="Clave para reintentar sin crear la playlist dos veces"),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -74,16 +213,91 @@ def create_spotify_playlist(
     - **track_ids**: Lista de IDs de canciones de Spotify
     - **public**: Si la playlist debe ser pública (default: false)
 
+    Con la cabecera **Idempotency-Key**, un reintento con la misma clave recibe
+    la respuesta original (cabecera `Idempotent-Replayed: true`) en lugar de crear
+    otra playlist; si la original sigue en curso, espera a que termine.
+
     Retorna información de la playlist creada incluyendo el enlace de Spotify.
     """
-    return MusicController.create_spotify_playlist(
-        user=current_user,
-        name=playlist_data.name,
-        description=playlist_data.description,
-        track_ids=playlist_data.track_ids,
-        public=playlist_data.public,
-        db=db
+    body, replayed = await idempotency_service.run_async(
+        db, current_user.id, "create-playlist", idempotency_key, playlist_data,
+        lambda: MusicController.create_spotify_playlist(
+            user=current_user,
+            name=playlist_data.name,
+            description=playlist_data.description,
+            track_ids=playlist_data.track_ids,
+            public=playlist_data.public,
+            db=db
+        )
     )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return body
+
+@router.post(
+    "/spotify/playlist-jobs",
+    response_model=PlaylistJobStatus,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Encolar playlist en Spotify",
+    description="Encola la creación de una playlist en la cuenta de Spotify del usuario y responde de inmediato"
+)
+def enqueue_spotify_playlist(
+    playlist_data: CreateSpotifyPlaylistRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, description="Clave para reintentar sin encolar la playlist dos veces"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Igual que `/spotify/create-playlist`, pero en segundo plano.
+
+    Recibe los mismos campos (**name**, **description**, **track_ids**, **public**)
+    y responde 202 con el **job_id**. El trabajo reintenta los lotes que fallan por
+    límite de peticiones (429) o errores transitorios de Spotify.
+
+    Con la cabecera **Idempotency-Key**, un reintento con la misma clave devuelve
+    el trabajo ya encolado.
+
+    El progreso y el enlace final se consultan en `/spotify/playlist-jobs/{job_id}`
+    (cabecera `Location`).
+    """
+    job, replayed = idempotency_service.run(
+        db, current_user.id, "playlist-jobs", idempotency_key, playlist_data,
+        lambda: MusicController.enqueue_spotify_playlist(
+            user=current_user,
+            name=playlist_data.name,
+            description=playlist_data.description,
+            track_ids=playlist_data.track_ids,
+            public=playlist_data.public,
+            db=db
+        )
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    response.headers["Location"] = f"{router.prefix}/spotify/playlist-jobs/{job['job_id']}"
+    return job
+
+@router.get(
+    "/spotify/playlist-jobs/{job_id}",
+    response_model=PlaylistJobStatus,
+    status_code=status.HTTP_200_OK,
+    summary="Estado de una playlist encolada",
+    description="Obtiene el progreso de un trabajo de creación de playlist en Spotify"
+)
+def get_spotify_playlist_job(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Obtiene el estado del trabajo:
+
+    - **status**: queued, running, done o error
+    - **tracks_added** / **tracks_total**: Progreso de las canciones agregadas
+    - **attempts**: Reintentos realizados (429 o errores transitorios)
+    - **playlist_url**: Enlace de Spotify de la playlist creada
+    """
+    return MusicController.get_playlist_job(current_user, job_id, db)
 
 @router.get(
     "/spotify/playlists",
@@ -91,8 +305,9 @@ def create_spotify_playlist(
     summary="Obtener playlists de Spotify",
     description="Obtiene las playlists del usuario desde su cuenta de Spotify"
 )
-def get_spotify_playlists(
-    limit: int = Query(50, ge=1, le=50, description="Número máximo de playlists"),
+async def get_spotify_playlists(
+    limit: Optional[int] = Query(None, ge=1, description="Número máximo de playlists (por defecto todas)"),
+    offset: int = Query(0, ge=0, description="Posición de la primera playlist"),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -101,7 +316,11 @@ def get_spotify_playlists(
 
     Requiere tener una cuenta de Spotify vinculada.
 
-    - **limit**: Número máximo de playlists a obtener (1-50, default: 50)
+    - **limit**: Número máximo de playlists a devolver (default: todas)
+    - **offset**: Posición de la primera playlist (default: 0)
+
+    La lista completa se cachea por usuario y se revalida con Spotify cada
+    pocos minutos; **total** es el número total de playlists.
 
     Retorna lista de playlists con:
     - ID y nombre de la playlist
@@ -109,5 +328,35 @@ def get_spotify_playlists(
     - URL de Spotify
     - Número de canciones
     - Imágenes
+    - snapshot_id (versión de la playlist)
+    """
+    return await MusicController.get_user_spotify_playlists(current_user, db, limit, offset)
+
+@router.post(
+    "/spotify/playlists/{playlist_id}/tracks",
+    status_code=status.HTTP_200_OK,
+    summary="Agregar canciones a una playlist de Spotify",
+    description="Agrega canciones a una playlist existente de la cuenta de Spotify del usuario"
+)
+async def add_tracks_to_spotify_playlist(
+    playlist_id: str,
+    tracks_data: AddSpotifyTracksRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Agrega canciones al final de una playlist de Spotify.
+
+    Requiere:
+    - Tener una cuenta de Spotify vinculada
+    - Ser el dueño de la playlist
+    - **track_ids**: Lista de IDs de canciones de Spotify
+
+    Retorna el número de canciones agregadas.
     """
-    return MusicController.get_user_spotify_playlists(current_user, db, limit)
\ No newline at end of file
+    return await MusicController.add_tracks_to_spotify_playlist(
+        user=current_user,
+        playlist_id=playlist_id,
+        track_ids=tracks_data.track_ids,
+        db=db
+    )
\ No newline at end of file
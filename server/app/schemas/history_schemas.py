@@ -62,6 +62,20 @@ class SavedPlaylistResponse(BaseModel):
         from_attributes = True
 
 
+class ExtendPlaylistRequest(BaseModel):
+    """Request para ampliar una playlist guardada"""
+    limit: int = Field(20, ge=1, le=50)
+    spotify_playlist_id: Optional[str] = Field(
+        None, description="Playlist de Spotify del usuario a la que también se agregan"
+    )
+
+class ExtendPlaylistResponse(BaseModel):
+    """Respuesta de playlist ampliada"""
+    playlist: SavedPlaylistResponse
+    added_tracks: List[Dict[str, Any]]
+    from_cache: bool
+    spotify: Optional[Dict[str, Any]] = None
+
 # ============ SCHEMAS PARA HISTORIAL ============
 
 class HistoryItemResponse(BaseModel):
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional, Dict
+from datetime import date, datetime
 
 class TrackResponse(BaseModel):
     """Información de una canción"""
@@ -12,6 +13,9 @@ class TrackResponse(BaseModel):
     external_url: str
     duration_ms: int
     popularity: int
+    artist_ids: List[str] = []
+    genres: List[str] = []
+    release_year: Optional[int] = None
 
 class MusicParamsInfo(BaseModel):
     """Parámetros musicales utilizados"""
@@ -26,6 +30,9 @@ class MusicRecommendationsResponse(BaseModel):
     emotion: str
     tracks: List[TrackResponse]
     total: int
+    complete: bool = True  # False si se agotó el presupuesto y los resultados son parciales
+    cursor: Optional[str] = None  # Para pedir más canciones del mismo pool
+    stored: bool = False  # True si se sirvieron las recomendaciones guardadas del análisis
     genres_used: List[str]
     music_params: MusicParamsInfo
     playlist_description: Optional[str] = None
@@ -33,4 +40,38 @@ class MusicRecommendationsResponse(BaseModel):
 class MusicRecommendationRequest(BaseModel):
     """Request para obtener recomendaciones"""
     emotion: str
-    limit: Optional[int] = 20
\ No newline at end of file
+    limit: Optional[int] = 20
+
+class LibrarySyncStatus(BaseModel):
+    """Estado de la importación de la biblioteca de Spotify del usuario"""
+    status: str  # idle | running | done | error
+    total: int
+    last_synced_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+class PlaylistJobStatus(BaseModel):
+    """Estado de un trabajo de creación de playlist en Spotify"""
+    job_id: str
+    status: str  # queued | running | done | error
+    name: str
+    tracks_total: int
+    tracks_added: int
+    attempts: int
+    playlist_id: Optional[str] = None
+    playlist_url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class DailyMixResponse(BaseModel):
+    """Mix diario generado en lote para el usuario"""
+    date: date
+    emotion: str
+    market: str
+    tracks: List[TrackResponse]
+    total: int
+    created_at: Optional[datetime] = None
+
+class DailyMixSettings(BaseModel):
+    """Preferencia del mix diario"""
+    enabled: bool
@@ -0,0 +1,100 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+
+from app.config.database import SessionLocal
+from app.models.artist_genre import ArtistGenre
+
+logger = logging.getLogger("artist_genre_cache")
+
+
+class ArtistGenreCache:
+    """
+    Caché artista -> géneros en dos niveles: LRU en memoria y tabla `artist_genres`.
+    Los géneros de un artista cambian muy poco, así que no expiran.
+    """
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, artist_id: str, genres: List[str]):
+        self._memory[artist_id] = genres
+        self._memory.move_to_end(artist_id)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, artist_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Busca géneros en memoria y, para los que falten, en base de datos.
+
+        Returns:
+            Dict artist_id -> géneros sólo para los artistas conocidos
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for artist_id in artist_ids:
+                if artist_id in self._memory:
+                    self._memory.move_to_end(artist_id)
+                    found[artist_id] = self._memory[artist_id]
+                else:
+                    missing.append(artist_id)
+
+        if not missing:
+            return found
+
+        db = SessionLocal()
+        try:
+            rows = db.query(ArtistGenre.artist_id, ArtistGenre.genres).filter(
+                ArtistGenre.artist_id.in_(missing)
+            ).all()
+        except Exception as e:
+            logger.warning(f"No se pudo leer artist_genres: {e}")
+            rows = []
+        finally:
+            db.close()
+
+        with self._lock:
+            for artist_id, genres in rows:
+                genres = genres or []
+                self._remember(artist_id, genres)
+                found[artist_id] = genres
+
+        return found
+
+    def put_many(self, mapping: Dict[str, List[str]]):
+        """Guarda géneros en memoria y hace upsert en base de datos."""
+        if not mapping:
+            return
+
+        with self._lock:
+            for artist_id, genres in mapping.items():
+                self._remember(artist_id, genres)
+
+        db = SessionLocal()
+        try:
+            stmt = insert(ArtistGenre).values([
+                {'artist_id': artist_id, 'genres': genres}
+                for artist_id, genres in mapping.items()
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ArtistGenre.artist_id],
+                set_={'genres': stmt.excluded.genres, 'updated_at': func.now()}
+            )
+            db.execute(stmt)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudo persistir artist_genres: {e}")
+        finally:
+            db.close()
+
+
+# Instancia global
+artist_genre_cache = ArtistGenreCache()
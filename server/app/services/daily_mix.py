@@ -0,0 +1,271 @@
+import os
+import time
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.config.database import SessionLocal
+from app.models.daily_mix import DailyMix
+from app.models.emotion_analysis import EmotionAnalysis
+from app.models.user import User
+from app.services.emotion_config import emotion_config
+from app.services.library_sync import library_sync_service
+from app.services.recent_tracks_filter import recent_tracks_registry
+from app.services.spotify_scheduler import spotify_scheduler, BACKGROUND
+from app.services.spotify_service import spotify_service
+from app.services.taste_profile import taste_profile_store
+from app.utils.track_rows import pack_tracks, unpack_tracks
+
+logger = logging.getLogger("daily_mix")
+
+
+def _spotify_calls() -> int:
+    """Peticiones a Spotify admitidas por el scheduler en este proceso."""
+    return sum(lane['granted'] for lane in spotify_scheduler.stats()['lanes'].values())
+
+
+class DailyMixService:
+    """
+    Mixes diarios para los usuarios que los activaron.
+
+    El lote recorre los usuarios por tramos (`chunk_size`, paginando por ID),
+    los agrupa por (emoción dominante, mercado) y obtiene el pool de candidatos
+    una sola vez por grupo; la elección por usuario (perfil de gustos, canciones
+    recientes, biblioteca) no llama a Spotify y corre en `max_workers` hilos.
+    Todo va por el carril background del scheduler, que acota concurrencia y
+    tasa y cede ante las peticiones interactivas.
+    """
+
+    def __init__(
+        self,
+        mix_size: int = 30,
+        lookback_days: int = 7,
+        chunk_size: int = 200,
+        max_workers: int = 4,
+        pool_budget: float = 15.0,
+        retention_days: int = 7
+    ):
+        self.mix_size = mix_size
+        self.lookback_days = lookback_days
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.pool_budget = pool_budget
+        self.retention_days = retention_days
+
+    # ============ LECTURA Y PREFERENCIAS ============
+
+    @staticmethod
+    def today() -> date:
+        return datetime.now(timezone.utc).date()
+
+    def set_enabled(self, user: User, enabled: bool, db: Session) -> bool:
+        user.daily_mix_enabled = enabled
+        db.commit()
+        logger.info(f"🗓️  Mix diario {'activado' if enabled else 'desactivado'} para {user.username}")
+        return enabled
+
+    def get_mix(self, user_id: str, db: Session, mix_date: Optional[date] = None) -> Optional[Dict[str, Any]]:
+        """Mix del día (hoy por defecto) o None si todavía no se generó."""
+        mix = db.query(DailyMix).filter(
+            DailyMix.user_id == user_id,
+            DailyMix.mix_date == (mix_date or self.today())
+        ).first()
+        if not mix:
+            return None
+        tracks = unpack_tracks(mix.tracks)
+        return {
+            'date': mix.mix_date,
+            'emotion': mix.emotion,
+            'market': mix.market,
+            'tracks': tracks,
+            'total': len(tracks),
+            'created_at': mix.created_at
+        }
+
+    # ============ GENERACIÓN EN LOTE ============
+
+    def _iter_chunks(self, db: Session, default_market: str) -> Iterator[List[Tuple[str, str]]]:
+        """Tramos de (user_id, mercado) de usuarios activos con el mix activado."""
+        last_id = None
+        while True:
+            query = db.query(User.id, User.spotify_country).filter(
+                User.is_active.is_(True),
+                User.daily_mix_enabled.is_(True)
+            )
+            if last_id is not None:
+                query = query.filter(User.id > last_id)
+            rows = query.order_by(User.id).limit(self.chunk_size).all()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [(str(user_id), country or default_market) for user_id, country in rows]
+
+    def _dominant_emotions(self, user_ids: List[str], since: datetime, db: Session) -> Dict[str, str]:
+        """Emoción más frecuente de cada usuario desde `since` (empate: la más reciente)."""
+        rows = db.query(
+            EmotionAnalysis.user_id,
+            EmotionAnalysis.dominant_emotion,
+            func.count(EmotionAnalysis.id),
+            func.max(EmotionAnalysis.created_at)
+        ).filter(
+            EmotionAnalysis.user_id.in_(user_ids),
+            EmotionAnalysis.created_at >= since
+        ).group_by(EmotionAnalysis.user_id, EmotionAnalysis.dominant_emotion).all()
+
+        best: Dict[str, Tuple[int, datetime, str]] = {}
+        for user_id, emotion, count, last_at in rows:
+            key = str(user_id)
+            if key not in best or (count, last_at) > best[key][:2]:
+                best[key] = (count, last_at, emotion.upper())
+        return {user_id: entry[2] for user_id, entry in best.items()}
+
+    def _mix_for_user(self, user_id: str, emotion: str, candidates: List[Dict]) -> List[Dict]:
+        genres = emotion_config.current().descriptors[emotion]['genres']
+        extra = library_sync_service.matching(user_id, genres, self.mix_size)
+        if extra:
+            known = {t['id'] for t in candidates}
+            candidates = candidates + [t for t in extra if t['id'] not in known]
+        return spotify_service.select_tracks(
+            candidates,
+            self.mix_size,
+            user_id=user_id,
+            taste=taste_profile_store.get(user_id)
+        )
+
+    def _store(self, rows: List[Dict], db: Session):
+        stmt = insert(DailyMix).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailyMix.user_id, DailyMix.mix_date],
+            set_={
+                'emotion': stmt.excluded.emotion,
+                'market': stmt.excluded.market,
+                'tracks': stmt.excluded.tracks,
+                'created_at': func.now()
+            }
+        )
+        db.execute(stmt)
+        db.commit()
+
+    def run(self, mix_date: Optional[date] = None, default_market: str = 'US') -> Dict[str, Any]:
+        """
+        Genera (o regenera) los mixes del día para todos los usuarios activados.
+
+        Returns:
+            Reporte con usuarios procesados, grupos, pools y throughput
+        """
+        mix_date = mix_date or self.today()
+        since = datetime.now(timezone.utc) - timedelta(days=self.lookback_days)
+        valid = set(emotion_config.emotions())
+        report = {
+            'date': mix_date.isoformat(),
+            'users': 0,
+            'mixes': 0,
+            'skipped': 0,
+            'errors': 0,
+            'groups': 0,
+            'pools_built': 0,
+            'pools_cached': 0
+        }
+        started = time.monotonic()
+        calls_before = _spotify_calls()
+
+        db = SessionLocal()
+        workers = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="daily-mix")
+        try:
+            with spotify_scheduler.lane(BACKGROUND):
+                for chunk in self._iter_chunks(db, default_market):
+                    report['users'] += len(chunk)
+                    emotions = self._dominant_emotions([user_id for user_id, _ in chunk], since, db)
+
+                    groups: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+                    for user_id, market in chunk:
+                        emotion = emotions.get(user_id)
+                        if emotion in valid:
+                            groups[(emotion, market)].append(user_id)
+                        else:
+                            report['skipped'] += 1
+
+                    rows = []
+                    for (emotion, market), user_ids in groups.items():
+                        spotify_scheduler.yield_to_interactive()
+                        report['groups'] += 1
+                        try:
+                            candidates, from_cache = spotify_service.get_shared_pool(
+                                emotion, market, budget_seconds=self.pool_budget
+                            )
+                        except Exception as e:
+                            logger.warning(f"❌ Sin pool para {emotion}/{market}: {e}")
+                            report['errors'] += len(user_ids)
+                            continue
+                        report['pools_cached' if from_cache else 'pools_built'] += 1
+
+                        futures = {
+                            user_id: workers.submit(spotify_scheduler.bind(
+                                partial(self._mix_for_user, user_id, emotion, candidates)
+                            ))
+                            for user_id in user_ids
+                        }
+                        for user_id, future in futures.items():
+                            try:
+                                tracks = future.result()
+                            except Exception as e:
+                                logger.warning(f"❌ Mix de {user_id}: {e}")
+                                report['errors'] += 1
+                                continue
+                            if not tracks:
+                                report['skipped'] += 1
+                                continue
+                            rows.append({
+                                'user_id': user_id,
+                                'mix_date': mix_date,
+                                'emotion': emotion,
+                                'market': market,
+                                'tracks': pack_tracks(tracks)
+                            })
+
+                    if rows:
+                        self._store(rows, db)
+                        report['mixes'] += len(rows)
+                    logger.info(f"🗓️  Tramo de {len(chunk)} usuarios: {len(rows)} mixes en {len(groups)} grupos")
+
+            self._prune(mix_date, db)
+        finally:
+            workers.shutdown(wait=True)
+            db.close()
+            recent_tracks_registry.flush()
+
+        elapsed = time.monotonic() - started
+        calls = _spotify_calls() - calls_before
+        report['elapsed_seconds'] = round(elapsed, 1)
+        report['spotify_calls'] = calls
+        report['users_per_minute'] = round(report['users'] / elapsed * 60, 1) if elapsed else 0.0
+        report['calls_per_user'] = round(calls / report['mixes'], 2) if report['mixes'] else 0.0
+        return report
+
+    def _prune(self, mix_date: date, db: Session) -> int:
+        """Elimina los mixes más viejos que `retention_days`."""
+        try:
+            deleted = db.query(DailyMix).filter(
+                DailyMix.mix_date < mix_date - timedelta(days=self.retention_days)
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudieron purgar mixes viejos: {e}")
+            return 0
+
+
+# Instancia global
+daily_mix_service = DailyMixService(
+    mix_size=int(os.getenv('DAILY_MIX_SIZE', '30')),
+    lookback_days=int(os.getenv('DAILY_MIX_LOOKBACK_DAYS', '7')),
+    max_workers=int(os.getenv('DAILY_MIX_WORKERS', '4'))
+)
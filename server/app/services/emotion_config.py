@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger("emotion_config")
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config', 'emotions.json')
+
+
+def _interleave_pairs(genres: List[str], moods: List[str]) -> List[str]:
+    """Combina género × mood alternando géneros para que cualquier prefijo sea variado."""
+    queries = []
+    for offset in range(len(moods)):
+        for index, genre in enumerate(genres):
+            queries.append(f"{genre} {moods[(index + offset) % len(moods)]}")
+    return queries
+
+
+class QueryPlan:
+    """
+    Consultas precompiladas de una emoción: búsquedas género + mood, búsquedas
+    de playlists y artistas semilla. Los IDs de artista resueltos se guardan en
+    el plan, así que sólo se buscan una vez por versión de la configuración.
+    """
+
+    def __init__(self, emotion: str, genres: List[str], moods: List[str], artists: List[str]):
+        self.emotion = emotion
+        self.genres = list(genres)
+        self.search_queries = _interleave_pairs(self.genres, list(moods)) if moods else list(self.genres)
+        self.playlist_queries = [f"{emotion.lower()} vibes"] + [f"best {genre}" for genre in self.genres[:3]]
+        self.artist_seeds = list(artists)
+        self.artist_ids: Dict[str, Optional[str]] = {}
+        self.fingerprint = hashlib.blake2b(
+            json.dumps([self.search_queries, self.playlist_queries, self.artist_seeds]).encode('utf-8'),
+            digest_size=8
+        ).hexdigest()
+
+
+class _ConfigState:
+    """Versión inmutable de la configuración cargada."""
+
+    def __init__(self, data: Dict):
+        emotions = data.get('emotions') or {}
+        if not emotions:
+            raise ValueError("La configuración no define emociones")
+
+        self.default_markets: List[str] = [m.upper() for m in data.get('default_markets') or ['US']]
+        self.descriptors: Dict[str, Dict] = {}
+        self.filters: Dict[str, Dict] = {}
+        self.descriptions: Dict[str, str] = {}
+        self.plans: Dict[str, QueryPlan] = {}
+
+        for name, entry in emotions.items():
+            emotion = name.upper()
+            descriptor = {
+                'moods': list(entry.get('moods') or []),
+                'genres': list(entry.get('genres') or []),
+                'artists': list(entry.get('artists') or [])
+            }
+            if not descriptor['genres']:
+                raise ValueError(f"La emoción {emotion} no tiene géneros")
+            filters = dict(entry.get('filters') or {})
+            if 'tempo_range' in filters:
+                filters['tempo_range'] = tuple(filters['tempo_range'])
+
+            self.descriptors[emotion] = descriptor
+            self.filters[emotion] = filters
+            if entry.get('description'):
+                self.descriptions[emotion] = entry['description']
+            self.plans[emotion] = QueryPlan(emotion, **descriptor)
+
+
+class EmotionConfig:
+    """
+    Descriptores, filtros de audio y mercados por emoción leídos de un JSON.
+
+    El archivo se revisa como mucho cada `check_interval` segundos (por mtime) y
+    se recarga en caliente; si el JSON es inválido se conserva la versión anterior.
+    Tras cada recarga se notifica a los listeners qué emociones cambiaron su plan
+    de consultas (las únicas cuyos pools de candidatos dejan de ser válidos).
+    """
+
+    def __init__(self, path: str, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Set[str]], None]] = []
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self._state = self._read()
+
+    def _read(self) -> _ConfigState:
+        self._mtime = os.path.getmtime(self.path)
+        with open(self.path, encoding='utf-8') as f:
+            return _ConfigState(json.load(f))
+
+    def add_listener(self, callback: Callable[[Set[str]], None]):
+        """Registra `callback(emociones_cambiadas)` para después de cada recarga."""
+        self._listeners.append(callback)
+
+    def current(self) -> _ConfigState:
+        """Configuración vigente (recargando si el archivo cambió)."""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self.reload()
+        return self._state
+
+    def reload(self, force: bool = False) -> Set[str]:
+        """
+        Recarga el archivo si cambió su mtime (o si `force`).
+
+        Returns:
+            Emociones cuyo plan de consultas cambió (incluye altas y bajas)
+        """
+        with self._lock:
+            try:
+                if not force and os.path.getmtime(self.path) == self._mtime:
+                    return set()
+                state = self._read()
+            except Exception as e:
+                logger.error(f"❌ Configuración de emociones inválida, se mantiene la anterior: {e}")
+                return set()
+
+            previous = self._state
+            changed = {
+                emotion for emotion in set(previous.plans) | set(state.plans)
+                if emotion not in previous.plans or emotion not in state.plans
+                or previous.plans[emotion].fingerprint != state.plans[emotion].fingerprint
+            }
+            # Los planes sin cambios conservan los artistas ya resueltos
+            for emotion, plan in state.plans.items():
+                if emotion not in changed:
+                    plan.artist_ids = previous.plans[emotion].artist_ids
+            self._state = state
+            self.reloads += 1
+
+        logger.info(f"🔄 Configuración de emociones recargada (planes cambiados: {sorted(changed) or 'ninguno'})")
+        for callback in self._listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                logger.warning(f"Listener de configuración falló: {e}")
+        return changed
+
+    def emotions(self) -> List[str]:
+        return list(self.current().descriptors.keys())
+
+    def stats(self) -> Dict:
+        state = self._state
+        return {
+            'path': self.path,
+            'reloads': self.reloads,
+            'emotions': len(state.plans),
+            'plans': {emotion: plan.fingerprint for emotion, plan in state.plans.items()}
+        }
+
+
+# Instancia global
+emotion_config = EmotionConfig(
+    path=os.getenv('EMOTION_CONFIG_PATH', DEFAULT_CONFIG_PATH),
+    check_interval=float(os.getenv('EMOTION_CONFIG_CHECK_INTERVAL', '5'))
+)
@@ -1,19 +1,31 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, func
-from app.models.emotion_analysis import EmotionAnalysis, SavedPlaylist
+from app.models.emotion_analysis import EmotionAnalysis, SavedPlaylist, MusicRecommendation
 from app.schemas.history_schemas import (
     EmotionAnalysisCreate,
     SavePlaylistRequest,
     UpdatePlaylistRequest,
     HistoryFilters
 )
+from app.utils.track_rows import pack_tracks, unpack_tracks
+from app.services.taste_profile import taste_profile_store
 from fastapi import HTTPException, status
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
+import os
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Días que se conservan las recomendaciones guardadas por análisis
+RECOMMENDATION_RETENTION_DAYS = int(os.getenv("MUSIC_RECOMMENDATION_RETENTION_DAYS", "90"))
+# Segundos mínimos entre purgas de recomendaciones viejas
+RECOMMENDATION_PRUNE_INTERVAL = 3600
+
 class HistoryService:
+
+    _last_recommendation_prune = 0.0
     
     # ============ ANÁLISIS DE EMOCIONES ============
     
@@ -135,8 +147,10 @@ class HistoryService:
             )
             
             db.add(new_playlist)
+            HistoryService._update_taste_profile(user_id, playlist_data.tracks, db, sign=1)
             db.commit()
             db.refresh(new_playlist)
+            taste_profile_store.invalidate(user_id)
             
             logger.info(f"Playlist guardada: {new_playlist.id} para usuario {user_id}")
             return new_playlist
@@ -263,9 +277,13 @@ class HistoryService:
         """Elimina una playlist"""
         try:
             playlist = HistoryService.get_playlist_by_id(playlist_id, user_id, db)
+            tracks = playlist.tracks or []
             
+            # Primero la baja: el savepoint del perfil la envía con flush (ver apply)
             db.delete(playlist)
+            HistoryService._update_taste_profile(user_id, tracks, db, sign=-1)
             db.commit()
+            taste_profile_store.invalidate(user_id)
             
             logger.info(f"Playlist eliminada: {playlist_id}")
             
@@ -279,6 +297,150 @@ class HistoryService:
                 detail="Error al eliminar la playlist"
             )
     
+    @staticmethod
+    def append_tracks(
+        playlist: SavedPlaylist,
+        tracks: List[Dict[str, Any]],
+        db: Session
+    ) -> SavedPlaylist:
+        """Agrega canciones al final de una playlist guardada (y a su perfil de gustos)"""
+        try:
+            # Reasignar la lista para que SQLAlchemy detecte el cambio en JSONB
+            playlist.tracks = list(playlist.tracks or []) + list(tracks)
+            HistoryService._update_taste_profile(str(playlist.user_id), tracks, db, sign=1)
+            db.commit()
+            db.refresh(playlist)
+            taste_profile_store.invalidate(str(playlist.user_id))
+
+            logger.info(f"Playlist ampliada: {playlist.id} (+{len(tracks)} canciones)")
+            return playlist
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error al ampliar playlist: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error al ampliar la playlist"
+            )
+
+    @staticmethod
+    def _update_taste_profile(user_id: str, tracks: List[Dict[str, Any]], db: Session, sign: int) -> None:
+        """Ajusta el perfil de gustos en un savepoint: si falla, la playlist se guarda igual."""
+        try:
+            with db.begin_nested():
+                taste_profile_store.apply(user_id, tracks, db, sign=sign)
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar el perfil de gustos de {user_id}: {e}")
+
+    # ============ RECOMENDACIONES POR ANÁLISIS ============
+
+    @staticmethod
+    def get_user_analysis(analysis_id: str, user_id: str, db: Session) -> EmotionAnalysis:
+        """Obtiene un análisis del usuario o lanza 404"""
+        analysis = db.query(EmotionAnalysis).filter(
+            EmotionAnalysis.id == analysis_id,
+            EmotionAnalysis.user_id == user_id
+        ).first()
+
+        if not analysis:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Análisis no encontrado"
+            )
+
+        return analysis
+
+    @staticmethod
+    def get_stored_recommendations(
+        analysis_id: str,
+        emotion: str,
+        db: Session
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Obtiene las recomendaciones guardadas para un análisis.
+
+        Returns:
+            Dict con el formato de get_recommendations o None si no hay
+            recomendaciones guardadas para esa emoción
+        """
+        try:
+            stored = db.query(MusicRecommendation).filter(
+                MusicRecommendation.analysis_id == analysis_id
+            ).order_by(desc(MusicRecommendation.created_at)).first()
+        except Exception as e:
+            logger.error(f"Error al leer recomendaciones guardadas: {str(e)}")
+            return None
+
+        if not stored or not stored.tracks or stored.tracks.get('emotion') != emotion:
+            return None
+
+        tracks = unpack_tracks(stored.tracks)
+        return {
+            'success': True,
+            'emotion': emotion,
+            'tracks': tracks,
+            'total': len(tracks),
+            'complete': True,
+            'stored': True,
+            'genres_used': stored.tracks.get('genres_used', []),
+            'music_params': stored.tracks.get('music_params')
+        }
+
+    @staticmethod
+    def store_recommendations(
+        analysis_id: str,
+        result: Dict[str, Any],
+        db: Session
+    ) -> None:
+        """
+        Guarda (reemplazando las anteriores) las recomendaciones de un análisis.
+        Los fallos se registran pero no interrumpen la respuesta.
+        """
+        try:
+            data = pack_tracks(result['tracks'])
+            data['emotion'] = result['emotion']
+            data['genres_used'] = result.get('genres_used', [])
+            data['music_params'] = result.get('music_params')
+
+            db.query(MusicRecommendation).filter(
+                MusicRecommendation.analysis_id == analysis_id
+            ).delete(synchronize_session=False)
+            db.add(MusicRecommendation(analysis_id=analysis_id, tracks=data))
+            db.commit()
+
+            logger.info(f"Recomendaciones guardadas para análisis {analysis_id}")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error al guardar recomendaciones: {str(e)}")
+            return
+
+        HistoryService.prune_recommendations(db)
+
+    @staticmethod
+    def prune_recommendations(db: Session, force: bool = False) -> int:
+        """
+        Elimina recomendaciones más viejas que la retención configurada.
+        Se ejecuta como mucho una vez por RECOMMENDATION_PRUNE_INTERVAL.
+        """
+        now = time.monotonic()
+        if not force and now - HistoryService._last_recommendation_prune < RECOMMENDATION_PRUNE_INTERVAL:
+            return 0
+        HistoryService._last_recommendation_prune = now
+
+        cutoff = datetime.now(timezone.utc) - timedelta(days=RECOMMENDATION_RETENTION_DAYS)
+        try:
+            deleted = db.query(MusicRecommendation).filter(
+                MusicRecommendation.created_at < cutoff
+            ).delete(synchronize_session=False)
+            db.commit()
+            if deleted:
+                logger.info(f"Recomendaciones purgadas: {deleted}")
+            return deleted
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error al purgar recomendaciones: {str(e)}")
+            return 0
+
     # ============ ESTADÍSTICAS ============
     
     @staticmethod
@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.config.database import SessionLocal
+from app.models.idempotency_key import IdempotencyKey
+
+logger = logging.getLogger("idempotency")
+
+
+class _Attempt:
+    """Ejecución en curso de una petición con Idempotency-Key."""
+
+    def __init__(self, service: "IdempotencyService", user_id, endpoint: str, key: str):
+        self.service = service
+        self.user_id = user_id
+        self.endpoint = endpoint
+        self.key = key
+        self.side_effects = False
+        self.last_beat = time.monotonic()
+
+    def beat_due(self) -> bool:
+        return time.monotonic() - self.last_beat >= self.service.lease_seconds / 4
+
+    def beat(self):
+        self.last_beat = time.monotonic()
+        self.service._heartbeat(self.user_id, self.endpoint, self.key)
+
+
+# El objeto es mutable: lo que marca el handler (incluso desde el threadpool,
+# que copia el contexto) lo ve run()/run_async()
+_current_attempt: ContextVar[Optional[_Attempt]] = ContextVar('idempotency_attempt', default=None)
+
+
+def record_progress():
+    """
+    Lo llama quien modifica algo fuera de la base de datos (p. ej. crea una
+    playlist en Spotify): desde ahí la clave ya no se libera si el handler
+    falla, y el lease se renueva para que un duplicado no la reclame.
+    """
+    attempt = _current_attempt.get()
+    if attempt:
+        attempt.side_effects = True
+        if attempt.beat_due():
+            attempt.beat()
+
+
+async def arecord_progress():
+    """Versión asíncrona de record_progress() (el UPDATE del lease va al threadpool)."""
+    attempt = _current_attempt.get()
+    if attempt:
+        attempt.side_effects = True
+        if attempt.beat_due():
+            await run_in_threadpool(attempt.beat)
+
+
+class IdempotencyService:
+    """
+    Soporte de la cabecera `Idempotency-Key` para endpoints que crean recursos
+    en Spotify.
+
+    - La primera petición con una clave la reclama en `idempotency_keys`
+      (INSERT ... ON CONFLICT DO NOTHING, válido entre workers y nodos),
+      ejecuta el handler y guarda su respuesta.
+    - Un duplicado recibe la respuesta guardada; si la original sigue en curso,
+      espera (hasta `wait_seconds`) a que termine en lugar de repetirla.
+    - Reusar la clave con otro cuerpo responde 422. Si el handler falla antes
+      de modificar nada en Spotify (ver record_progress) la clave se libera
+      para que el cliente pueda reintentar; si falla después, se guarda el
+      error y los duplicados lo reciben en lugar de repetir la operación.
+    - Las claves vencen a las `ttl_hours`. El handler renueva el lease con cada
+      avance; una clave sin avances en `lease_seconds` (worker caído) puede
+      volver a reclamarse.
+    """
+
+    MAX_KEY_LENGTH = 255
+
+    def __init__(
+        self,
+        ttl_hours: int = 24,
+        lease_seconds: int = 120,
+        wait_seconds: float = 30.0,
+        poll_interval: float = 0.25
+    ):
+        self.ttl_hours = ttl_hours
+        self.lease_seconds = lease_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def _hash(payload: Any) -> str:
+        body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+    def _filter(self, user_id, endpoint: str, key: str):
+        return (
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.endpoint == endpoint,
+            IdempotencyKey.key == key
+        )
+
+    # ============ RECLAMAR Y GUARDAR ============
+
+    def _claim(self, db: Session, user_id, endpoint: str, key: str, request_hash: str) -> Optional[IdempotencyKey]:
+        """
+        Reclama la clave para esta petición.
+
+        Returns:
+            None si esta petición debe ejecutar el handler; si no, la fila existente
+        """
+        stmt = insert(IdempotencyKey).values(
+            user_id=user_id,
+            endpoint=endpoint,
+            key=key,
+            request_hash=request_hash,
+            status='in_progress'
+        ).on_conflict_do_nothing(
+            index_elements=[IdempotencyKey.user_id, IdempotencyKey.endpoint, IdempotencyKey.key]
+        ).returning(IdempotencyKey.key)
+        claimed = db.execute(stmt).first() is not None
+        db.commit()
+        if claimed:
+            return None
+
+        row = db.query(IdempotencyKey).filter(*self._filter(user_id, endpoint, key)).populate_existing().first()
+        if row is None:
+            # Se liberó entre el INSERT y la lectura
+            return self._claim(db, user_id, endpoint, key, request_hash)
+
+        now = datetime.now(timezone.utc)
+        expired = row.status == 'done' and row.created_at < now - timedelta(hours=self.ttl_hours)
+        abandoned = row.status == 'in_progress' and row.updated_at < now - timedelta(seconds=self.lease_seconds)
+        if expired or abandoned:
+            # Sólo uno de los que compiten la recupera (la fila no debe haber cambiado)
+            taken = db.query(IdempotencyKey).filter(
+                *self._filter(user_id, endpoint, key),
+                IdempotencyKey.updated_at == row.updated_at
+            ).update({
+                'request_hash': request_hash,
+                'status': 'in_progress',
+                'response': None,
+                'status_code': None,
+                'created_at': now
+            }, synchronize_session=False)
+            db.commit()
+            if taken:
+                return None
+            return self._claim(db, user_id, endpoint, key, request_hash)
+
+        if row.request_hash != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="La clave Idempotency-Key ya se usó con otra petición"
+            )
+        return row
+
+    def _complete(self, db: Session, user_id, endpoint: str, key: str, body: Any, status_code: Optional[int] = None):
+        db.query(IdempotencyKey).filter(*self._filter(user_id, endpoint, key)).update(
+            {'status': 'done', 'response': body, 'status_code': status_code}, synchronize_session=False
+        )
+        db.commit()
+
+    def _heartbeat(self, user_id, endpoint: str, key: str):
+        # Sesión propia: no debe mezclarse con la transacción del handler
+        db = SessionLocal()
+        try:
+            db.query(IdempotencyKey).filter(
+                *self._filter(user_id, endpoint, key),
+                IdempotencyKey.status == 'in_progress'
+            ).update({'updated_at': datetime.now(timezone.utc)}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudo renovar la clave de idempotencia {key}: {e}")
+        finally:
+            db.close()
+
+    def _fail(self, db: Session, attempt: _Attempt, error: BaseException):
+        """Libera la clave si no hubo cambios en Spotify; si los hubo, guarda el error."""
+        if not attempt.side_effects:
+            self._release(db, attempt.user_id, attempt.endpoint, attempt.key)
+            return
+        if isinstance(error, HTTPException):
+            status_code, detail = error.status_code, error.detail
+        else:
+            status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+            detail = "La petición original se interrumpió después de modificar tu cuenta de Spotify"
+        try:
+            db.rollback()
+            self._complete(db, attempt.user_id, attempt.endpoint, attempt.key, {'detail': detail}, status_code)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudo guardar el error de la clave de idempotencia {attempt.key}: {e}")
+
+    @staticmethod
+    def _replay(row: IdempotencyKey) -> Tuple[Any, bool]:
+        if row.status_code and row.status_code >= 400:
+            raise HTTPException(status_code=row.status_code, detail=(row.response or {}).get('detail'))
+        return row.response, True
+
+    def _release(self, db: Session, user_id, endpoint: str, key: str):
+        try:
+            db.rollback()
+            db.query(IdempotencyKey).filter(
+                *self._filter(user_id, endpoint, key),
+                IdempotencyKey.status == 'in_progress'
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudo liberar la clave de idempotencia {key}: {e}")
+
+    def _validate_key(self, key: str):
+        if len(key) > self.MAX_KEY_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Idempotency-Key no puede superar {self.MAX_KEY_LENGTH} caracteres"
+            )
+
+    def _still_running(self, key: str):
+        logger.info(f"⏳ Petición con Idempotency-Key {key} todavía en curso")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Una petición con la misma Idempotency-Key todavía está en curso; reintenta en unos segundos"
+        )
+
+    # ============ EJECUCIÓN ============
+
+    def run(
+        self,
+        db: Session,
+        user_id,
+        endpoint: str,
+        key: Optional[str],
+        payload: Any,
+        handler: Callable[[], Any]
+    ) -> Tuple[Any, bool]:
+        """
+        Ejecuta `handler` una sola vez por (usuario, endpoint, clave).
+
+        Returns:
+            (respuesta serializable, True si es una respuesta guardada)
+        """
+        if not key:
+            return jsonable_encoder(handler()), False
+        self._validate_key(key)
+        request_hash = self._hash(payload)
+
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            row = self._claim(db, user_id, endpoint, key, request_hash)
+            if row is None:
+                break
+            if row.status == 'done':
+                return self._replay(row)
+            if time.monotonic() >= deadline:
+                self._still_running(key)
+            time.sleep(self.poll_interval)
+
+        attempt = _Attempt(self, user_id, endpoint, key)
+        token = _current_attempt.set(attempt)
+        try:
+            body = jsonable_encoder(handler())
+        except BaseException as e:
+            self._fail(db, attempt, e)
+            raise
+        finally:
+            _current_attempt.reset(token)
+        self._complete(db, user_id, endpoint, key, body)
+        return body, False
+
+    async def run_async(
+        self,
+        db: Session,
+        user_id,
+        endpoint: str,
+        key: Optional[str],
+        payload: Any,
+        handler: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Versión asíncrona de run(): la base de datos va al threadpool y la espera no bloquea el event loop."""
+        if not key:
+            return jsonable_encoder(await handler()), False
+        self._validate_key(key)
+        request_hash = self._hash(payload)
+
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            row = await run_in_threadpool(self._claim, db, user_id, endpoint, key, request_hash)
+            if row is None:
+                break
+            if row.status == 'done':
+                return self._replay(row)
+            if time.monotonic() >= deadline:
+                self._still_running(key)
+            await asyncio.sleep(self.poll_interval)
+
+        attempt = _Attempt(self, user_id, endpoint, key)
+        token = _current_attempt.set(attempt)
+        try:
+            body = jsonable_encoder(await handler())
+        except BaseException as e:
+            await run_in_threadpool(self._fail, db, attempt, e)
+            raise
+        finally:
+            _current_attempt.reset(token)
+        await run_in_threadpool(self._complete, db, user_id, endpoint, key, body)
+        return body, False
+
+    def prune(self) -> int:
+        """Elimina las claves vencidas."""
+        db = SessionLocal()
+        try:
+            deleted = db.query(IdempotencyKey).filter(
+                IdempotencyKey.created_at < datetime.now(timezone.utc) - timedelta(hours=self.ttl_hours)
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudieron purgar claves de idempotencia: {e}")
+            return 0
+        finally:
+            db.close()
+
+
+# Instancia global
+idempotency_service = IdempotencyService(
+    ttl_hours=int(os.getenv('IDEMPOTENCY_TTL_HOURS', '24')),
+    wait_seconds=float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
+)
@@ -0,0 +1,336 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config.database import SessionLocal
+from app.models.user import User
+from app.models.user_library import UserLibrary
+from app.services.spotify_scheduler import spotify_scheduler, BACKGROUND
+from app.services.spotify_service import spotify_service
+from app.services.spotify_user_service import spotify_user_service
+from app.utils.track_rows import pack_tracks, unpack_tracks
+
+logger = logging.getLogger("library_sync")
+
+# Columnas de cada canción del índice local
+LIBRARY_FIELDS = [
+    'id', 'name', 'artist_ids', 'artists', 'album', 'release_date', 'album_image',
+    'preview_url', 'external_url', 'duration_ms', 'popularity', 'genres', 'added_at'
+]
+
+
+def _to_row(track: Dict, added_at: str) -> Dict:
+    album = track.get('album') or {}
+    images = album.get('images') or []
+    artists = track.get('artists') or []
+    return {
+        'id': track.get('id'),
+        'name': track.get('name'),
+        'artist_ids': [a.get('id') for a in artists],
+        'artists': [a.get('name') for a in artists],
+        'album': album.get('name'),
+        'release_date': album.get('release_date'),
+        'album_image': images[0].get('url') if images else None,
+        'preview_url': track.get('preview_url'),
+        'external_url': (track.get('external_urls') or {}).get('spotify', ''),
+        'duration_ms': track.get('duration_ms', 0),
+        'popularity': track.get('popularity', 0),
+        'genres': track.get('_genres', []),
+        'added_at': added_at
+    }
+
+
+def _to_candidate(row: Dict) -> Dict:
+    """Fila del índice -> track reducido como los de los pools de candidatos."""
+    return {
+        'id': row['id'],
+        'name': row.get('name'),
+        'artists': [
+            {'id': artist_id, 'name': name}
+            for artist_id, name in zip(row.get('artist_ids') or [], row.get('artists') or [])
+        ],
+        'album': {
+            'name': row.get('album'),
+            'release_date': row.get('release_date'),
+            'images': [{'url': row['album_image']}] if row.get('album_image') else []
+        },
+        'preview_url': row.get('preview_url'),
+        'external_urls': {'spotify': row.get('external_url') or ''},
+        'duration_ms': row.get('duration_ms') or 0,
+        'popularity': row.get('popularity') or 0,
+        '_genres': row.get('genres') or []
+    }
+
+
+class LibrarySyncService:
+    """
+    Importa las canciones guardadas del usuario (/me/tracks) a `user_libraries`.
+
+    - Las páginas se piden en paralelo (`page_workers`) por el carril background
+      del scheduler, así que respetan el presupuesto de la cuota de Spotify.
+    - La re-sincronización es incremental: /me/tracks viene ordenado por fecha
+      de guardado, y se deja de paginar al llegar al marcador `last_added_at`.
+      Por eso sólo agrega: una canción que el usuario quitó de sus guardadas
+      sigue en el índice hasta una sincronización completa (`full=True`).
+    - Cada página reintenta hasta `max_attempts` veces ante 429 (respetando
+      Retry-After, acotado a `max_backoff`), 5xx o error de red.
+    - Las recomendaciones leen el índice local (con caché en memoria), sin
+      llamadas a Spotify durante la petición.
+    """
+
+    PAGE_SIZE = 50
+
+    def __init__(
+        self,
+        max_tracks: int = 2000,
+        page_workers: int = 4,
+        max_jobs: int = 2,
+        ttl_seconds: int = 300,
+        max_users: int = 2000,
+        max_attempts: int = 3,
+        max_backoff: float = 10.0
+    ):
+        self.max_tracks = max_tracks
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.page_workers = page_workers
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._jobs = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="library-sync")
+        self._pages = ThreadPoolExecutor(max_workers=page_workers, thread_name_prefix="library-page")
+        self._running: Set[str] = set()
+        self._cache: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ============ SINCRONIZACIÓN ============
+
+    def start(self, user_id: str, full: bool = False) -> bool:
+        """
+        Encola la sincronización del usuario.
+
+        Returns:
+            False si ya había una en curso para ese usuario
+        """
+        user_id = str(user_id)
+        with self._lock:
+            if user_id in self._running:
+                return False
+            self._running.add(user_id)
+
+        self._set_status(user_id, 'running')
+        self._jobs.submit(self._run, user_id, full)
+        return True
+
+    def _set_status(self, user_id: str, status: str, error: Optional[str] = None):
+        db = SessionLocal()
+        try:
+            stmt = insert(UserLibrary).values(user_id=user_id, status=status, error=error, total=0)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[UserLibrary.user_id],
+                set_={'status': status, 'error': error}
+            )
+            db.execute(stmt)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudo actualizar el estado de la biblioteca de {user_id}: {e}")
+        finally:
+            db.close()
+
+    def _fetch_page(self, headers: Dict, offset: int) -> Dict:
+        """Una página de /me/tracks; 429, 5xx y errores de red se reintentan con espera."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = spotify_user_service._request(
+                    "GET",
+                    f"{spotify_user_service.SPOTIFY_API_URL}/me/tracks",
+                    headers=headers,
+                    params={"limit": self.PAGE_SIZE, "offset": offset}
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_attempts:
+                    raise
+                delay = min(2 ** attempt, self.max_backoff)
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()
+                if attempt == self.max_attempts:
+                    response.raise_for_status()
+                delay = min(2 ** attempt, self.max_backoff)
+                if response.status_code == 429:
+                    try:
+                        delay = min(float(response.headers.get('Retry-After', 1)), self.max_backoff)
+                    except ValueError:
+                        pass
+
+            delay += random.uniform(0, 0.5)
+            logger.info(f"🔁 /me/tracks offset {offset}: reintento {attempt} en {delay:.1f}s")
+            time.sleep(delay)
+
+    def _fetch_new_items(self, headers: Dict, marker: Optional[str]) -> List[Dict]:
+        """
+        Items de /me/tracks más nuevos que `marker` (todos si es None), en orden.
+        Pide la primera página y luego tandas de `page_workers` páginas en paralelo.
+        """
+        first = self._fetch_page(headers, 0)
+        total = min(first.get('total', 0), self.max_tracks)
+        pages = [first]
+        offsets = list(range(self.PAGE_SIZE, total, self.PAGE_SIZE))
+
+        def reached_marker(page: Dict) -> bool:
+            return marker is not None and any(
+                (item.get('added_at') or '') < marker for item in page.get('items', [])
+            )
+
+        while offsets and pages[-1].get('items') and not reached_marker(pages[-1]):
+            wave, offsets = offsets[:self.page_workers], offsets[self.page_workers:]
+            spotify_scheduler.yield_to_interactive()
+            # bind() fija el carril de este hilo en los hilos que piden las páginas
+            futures = [
+                self._pages.submit(spotify_scheduler.bind(lambda offset=offset: self._fetch_page(headers, offset)))
+                for offset in wave
+            ]
+            pages.extend(future.result() for future in futures)
+
+        items = []
+        for page in pages:
+            for item in page.get('items', []):
+                if marker is not None and (item.get('added_at') or '') < marker:
+                    return items
+                if item.get('track') and item['track'].get('id'):
+                    items.append(item)
+        return items
+
+    def _run(self, user_id: str, full: bool):
+        started = time.monotonic()
+        db = SessionLocal()
+        try:
+            with spotify_scheduler.lane(BACKGROUND):
+                user = db.query(User).filter(User.id == user_id).first()
+                if not user:
+                    raise ValueError("Usuario no encontrado")
+                library = db.query(UserLibrary).filter(UserLibrary.user_id == user_id).first()
+                if library is None:
+                    library = UserLibrary(user_id=user_id, total=0)
+                    db.add(library)
+                marker = None if full else library.last_added_at
+
+                headers = {"Authorization": f"Bearer {spotify_user_service._ensure_valid_token(user, db)}"}
+                items = self._fetch_new_items(headers, marker)
+
+                tracks = [item['track'] for item in items]
+                spotify_service.enrich_artist_genres(tracks)
+                new_rows = [_to_row(item['track'], item.get('added_at')) for item in items]
+
+            existing = [] if full else unpack_tracks(library.tracks)
+            seen = set()
+            rows = []
+            for row in new_rows + existing:
+                if row.get('id') and row['id'] not in seen:
+                    seen.add(row['id'])
+                    rows.append(row)
+            rows = rows[:self.max_tracks]
+
+            library.tracks = pack_tracks(rows, fields=LIBRARY_FIELDS)
+            library.total = len(rows)
+            if new_rows:
+                library.last_added_at = new_rows[0]['added_at']
+            elif full:
+                library.last_added_at = None
+            library.status = 'done'
+            library.error = None
+            library.synced_at = datetime.now(timezone.utc)
+            db.commit()
+
+            with self._lock:
+                self._cache.pop(user_id, None)
+            logger.info(
+                f"📚 Biblioteca de {user_id}: {len(new_rows)} nuevas, {len(rows)} en total "
+                f"({time.monotonic() - started:.1f}s)"
+            )
+        except Exception as e:
+            db.rollback()
+            detail = getattr(e, 'detail', None) or str(e)
+            logger.error(f"❌ Error sincronizando biblioteca de {user_id}: {detail}")
+            self._set_status(user_id, 'error', str(detail)[:500])
+        finally:
+            db.close()
+            with self._lock:
+                self._running.discard(user_id)
+
+    def status(self, user_id: str) -> Dict:
+        """Estado de la última sincronización del usuario."""
+        db = SessionLocal()
+        try:
+            library = db.query(UserLibrary).filter(UserLibrary.user_id == str(user_id)).first()
+        finally:
+            db.close()
+        if not library:
+            return {'status': 'idle', 'total': 0, 'last_synced_at': None, 'error': None}
+        return {
+            'status': library.status,
+            'total': library.total,
+            'last_synced_at': library.synced_at,
+            'error': library.error
+        }
+
+    # ============ LECTURA PARA RECOMENDACIONES ============
+
+    def library_tracks(self, user_id: Optional[str]) -> List[Dict]:
+        """Canciones del índice local como tracks reducidos (caché `ttl_seconds`)."""
+        if not user_id:
+            return []
+        key = str(user_id)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return entry[1]
+
+        db = SessionLocal()
+        try:
+            data = db.query(UserLibrary.tracks).filter(UserLibrary.user_id == key).scalar()
+            tracks = [_to_candidate(row) for row in unpack_tracks(data) if row.get('id')]
+        except Exception as e:
+            logger.warning(f"No se pudo leer user_libraries: {e}")
+            return []
+        finally:
+            db.close()
+
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl_seconds, tracks)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_users:
+                self._cache.popitem(last=False)
+        return tracks
+
+    def matching(self, user_id: Optional[str], genres: List[str], limit: int) -> List[Dict]:
+        """
+        Hasta `limit` canciones de la biblioteca cuyos géneros encajan con `genres`
+        (p. ej. "pop" encaja con "dance pop"). Muestra aleatoria para variar.
+        """
+        wanted = [genre.lower() for genre in genres]
+        matches = [
+            track for track in self.library_tracks(user_id)
+            if any(w in genre for genre in track['_genres'] for w in wanted)
+        ]
+        if len(matches) > limit:
+            matches = random.sample(matches, limit)
+        return matches
+
+
+# Instancia global
+library_sync_service = LibrarySyncService(
+    max_tracks=int(os.getenv('SPOTIFY_LIBRARY_MAX_TRACKS', '2000')),
+    page_workers=int(os.getenv('SPOTIFY_LIBRARY_PAGE_WORKERS', '4'))
+)
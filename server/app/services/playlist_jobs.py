@@ -0,0 +1,355 @@
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+import requests
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.config.database import SessionLocal
+from app.models.playlist_job import PlaylistJob
+from app.models.user import User
+from app.services.spotify_scheduler import spotify_scheduler, BACKGROUND
+from app.services.idempotency import record_progress
+from app.services.spotify_user_service import spotify_user_service
+
+logger = logging.getLogger("playlist_jobs")
+
+
+class RetryableSpotifyError(Exception):
+    """429, 5xx o error de red: el paso se puede repetir tras esperar `delay` segundos."""
+
+    def __init__(self, message: str, delay: Optional[float] = None):
+        super().__init__(message)
+        self.delay = delay
+
+
+class PlaylistJobService:
+    """
+    Creación de playlists en Spotify fuera de la petición HTTP.
+
+    - El endpoint valida, guarda el trabajo en `playlist_jobs` y responde 202;
+      `max_jobs` hilos lo ejecutan por el carril background del scheduler.
+    - Cada paso (crear la playlist, cada lote de 100 canciones) se reintenta:
+      un 429 espera lo que pide Retry-After y los 5xx / errores de red usan
+      backoff exponencial, hasta `max_attempts` reintentos por trabajo.
+    - El progreso (`tracks_added`, ID de la playlist) se guarda tras cada paso,
+      así que un reintento o un trabajo retomado tras reiniciar el servidor
+      continúa donde quedó en lugar de duplicar canciones. Tras un fallo ambiguo
+      al crear, se busca la playlist en /me/playlists antes de volver a crearla.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(
+        self,
+        max_jobs: int = 4,
+        max_attempts: int = 8,
+        max_backoff: float = 30.0,
+        stale_seconds: int = 300
+    ):
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.stale_seconds = stale_seconds
+        self._jobs = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="playlist-job")
+        self._running: Set[str] = set()
+        # Trabajos cuyo POST de creación falló de forma ambigua
+        self._uncertain: Set[str] = set()
+        self._lock = threading.Lock()
+
+    # ============ ENCOLAR Y CONSULTAR ============
+
+    def enqueue(
+        self,
+        user: User,
+        name: str,
+        description: str,
+        track_ids: List[str],
+        public: bool,
+        db: Session
+    ) -> PlaylistJob:
+        job = PlaylistJob(
+            user_id=user.id,
+            status='queued',
+            name=name,
+            description=description,
+            public=public,
+            track_ids=list(track_ids)
+        )
+        db.add(job)
+        db.commit()
+        record_progress()
+        db.refresh(job)
+
+        self._submit(str(job.id))
+        logger.info(f"🎶 Trabajo de playlist {job.id} encolado para {user.username} ({len(track_ids)} canciones)")
+        return job
+
+    def get(self, job_id: str, user_id: str, db: Session) -> Optional[PlaylistJob]:
+        try:
+            return db.query(PlaylistJob).filter(
+                PlaylistJob.id == job_id,
+                PlaylistJob.user_id == user_id
+            ).first()
+        except Exception:
+            # ID con formato inválido
+            db.rollback()
+            return None
+
+    def resume_pending(self) -> int:
+        """
+        Retoma los trabajos que quedaron en cola o a medias (p. ej. tras reiniciar
+        el servidor). Los 'running' sólo se retoman si llevan `stale_seconds` sin
+        avanzar, para no pisar a otro worker que los esté ejecutando.
+        """
+        db = SessionLocal()
+        try:
+            job_ids = [str(job_id) for (job_id,) in db.query(PlaylistJob.id).filter(self._claimable()).all()]
+        finally:
+            db.close()
+        for job_id in job_ids:
+            self._submit(job_id)
+        if job_ids:
+            logger.info(f"🎶 {len(job_ids)} trabajos de playlist retomados")
+        return len(job_ids)
+
+    def _claimable(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.stale_seconds)
+        return or_(
+            PlaylistJob.status == 'queued',
+            (PlaylistJob.status == 'running') & (PlaylistJob.updated_at < cutoff)
+        )
+
+    def _submit(self, job_id: str):
+        with self._lock:
+            if job_id in self._running:
+                return
+            self._running.add(job_id)
+        self._jobs.submit(self._run, job_id)
+
+    # ============ EJECUCIÓN ============
+
+    def _call(self, method: str, url: str, headers: Dict, **kwargs) -> requests.Response:
+        """Una petición a Spotify; los fallos transitorios se convierten en RetryableSpotifyError."""
+        try:
+            response = spotify_user_service._request(method, url, headers=headers, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise RetryableSpotifyError(f"Error de red: {e}")
+
+        if response.status_code == 429:
+            raise RetryableSpotifyError(
+                "Límite de peticiones de Spotify (429)",
+                delay=float(response.headers.get('Retry-After', 1))
+            )
+        if response.status_code >= 500:
+            raise RetryableSpotifyError(f"Spotify respondió {response.status_code}")
+        if response.status_code >= 400:
+            raise ValueError(spotify_user_service._error_message(
+                response, f"Spotify respondió {response.status_code}"
+            ))
+        return response
+
+    def _backoff(self, job: PlaylistJob, error: RetryableSpotifyError, db: Session):
+        job.attempts += 1
+        job.error = str(error)
+        db.commit()
+        if job.attempts > self.max_attempts:
+            raise ValueError(f"Se agotaron los reintentos: {error}")
+
+        delay = error.delay if error.delay is not None else min(2 ** job.attempts, self.max_backoff)
+        delay = min(delay, self.max_backoff) + random.uniform(0, 0.5)
+        logger.info(f"🔁 Trabajo {job.id}: {error}; reintento {job.attempts} en {delay:.1f}s")
+        time.sleep(delay)
+
+    def _batch_landed(self, job: PlaylistJob, headers: Dict, batch_size: int) -> bool:
+        """
+        Tras un error de red en un POST de canciones no se sabe si Spotify lo
+        aplicó; la playlist es nueva, así que basta con comparar su total.
+        """
+        try:
+            response = self._call(
+                "GET",
+                f"{spotify_user_service.SPOTIFY_API_URL}/playlists/{job.spotify_playlist_id}",
+                headers,
+                params={"fields": "tracks.total"}
+            )
+            return response.json().get("tracks", {}).get("total", 0) >= job.tracks_added + batch_size
+        except Exception:
+            return False
+
+    @staticmethod
+    def _marker(job: PlaylistJob) -> str:
+        return f"anima-job:{job.id}"
+
+    def _description(self, job: PlaylistJob) -> str:
+        """
+        Descripción enviada a Spotify: la del usuario más la marca del trabajo,
+        recortada para que el total no pase de los 300 caracteres permitidos.
+        """
+        marker = self._marker(job)
+        text = (job.description or "").strip()
+        if not text:
+            return marker
+        return f"{text[:300 - len(marker) - 1]} {marker}"
+
+    def _find_created(self, job: PlaylistJob, user: User, headers: Dict) -> Optional[Dict]:
+        """
+        Tras un error de red o 5xx al crear no se sabe si Spotify creó la playlist.
+        /me/playlists lista primero las más recientes: si ahí hay una nuestra cuya
+        descripción lleva la marca de este trabajo, es la que se creó y se adopta
+        en lugar de crear otra. Otra playlist vacía con el mismo nombre no cuenta.
+        """
+        marker = self._marker(job)
+        response = self._call(
+            "GET",
+            f"{spotify_user_service.SPOTIFY_API_URL}/me/playlists",
+            headers,
+            params={"limit": 50}
+        )
+        for item in response.json().get("items", []):
+            if (
+                item
+                and marker in (item.get("description") or "")
+                and (item.get("owner") or {}).get("id") == user.spotify_id
+            ):
+                return item
+        return None
+
+    def _create(self, job: PlaylistJob, user: User, headers: Dict, db: Session):
+        job_id = str(job.id)
+        playlist_data = None
+        if job_id in self._uncertain:
+            # Un intento anterior falló sin saber si Spotify creó la playlist
+            playlist_data = self._find_created(job, user, headers)
+            if playlist_data is not None:
+                logger.info(f"🔎 Trabajo {job.id}: la playlist sí se había creado, se adopta")
+
+        if playlist_data is None:
+            try:
+                response = self._call(
+                    "POST",
+                    f"{spotify_user_service.SPOTIFY_API_URL}/users/{user.spotify_id}/playlists",
+                    headers,
+                    json={"name": job.name, "description": self._description(job), "public": bool(job.public)}
+                )
+            except RetryableSpotifyError as e:
+                # Un 429 no llegó a crear nada; un 5xx o error de red pudo hacerlo
+                if e.delay is None:
+                    with self._lock:
+                        self._uncertain.add(job_id)
+                raise
+            playlist_data = response.json()
+
+        with self._lock:
+            self._uncertain.discard(job_id)
+        job.spotify_playlist_id = playlist_data.get("id")
+        job.playlist_url = playlist_data.get("external_urls", {}).get("spotify")
+        db.commit()
+        spotify_user_service.remember_owner(job.spotify_playlist_id, user.spotify_id)
+        spotify_user_service.invalidate_playlists(user.id)
+        logger.info(f"✅ Trabajo {job.id}: playlist {job.spotify_playlist_id} creada")
+
+    def _add_next_batch(self, job: PlaylistJob, headers: Dict, db: Session):
+        uris = spotify_user_service._track_uris(job.track_ids)
+        batch = uris[job.tracks_added:job.tracks_added + self.BATCH_SIZE]
+        try:
+            self._call(
+                "POST",
+                f"{spotify_user_service.SPOTIFY_API_URL}/playlists/{job.spotify_playlist_id}/tracks",
+                headers,
+                json={"uris": batch}
+            )
+        except RetryableSpotifyError as e:
+            if e.delay is not None or not self._batch_landed(job, headers, len(batch)):
+                raise
+        job.tracks_added += len(batch)
+        db.commit()
+
+    def _run(self, job_id: str):
+        started = time.monotonic()
+        db = SessionLocal()
+        job = None
+        try:
+            previous = db.query(PlaylistJob.status).filter(PlaylistJob.id == job_id).scalar()
+            # Reclamar el trabajo (otro worker puede haberlo tomado primero)
+            claimed = db.query(PlaylistJob).filter(
+                PlaylistJob.id == job_id,
+                self._claimable()
+            ).update({'status': 'running'}, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return
+
+            job = db.query(PlaylistJob).filter(PlaylistJob.id == job_id).first()
+            if job.spotify_playlist_id is None and (previous == 'running' or job.attempts):
+                # Retomado tras una caída o un fallo: el POST de creación pudo haber llegado
+                with self._lock:
+                    self._uncertain.add(job_id)
+            user = db.query(User).filter(User.id == job.user_id).first()
+            if not user:
+                raise ValueError("Usuario no encontrado")
+
+            with spotify_scheduler.lane(BACKGROUND):
+                while job.spotify_playlist_id is None or job.tracks_added < len(job.track_ids):
+                    # El token se revisa en cada paso: las esperas pueden hacerlo caducar
+                    headers = {"Authorization": f"Bearer {spotify_user_service._ensure_valid_token(user, db)}"}
+                    try:
+                        if job.spotify_playlist_id is None:
+                            self._create(job, user, headers, db)
+                        else:
+                            self._add_next_batch(job, headers, db)
+                    except RetryableSpotifyError as e:
+                        self._backoff(job, e, db)
+
+            job.status = 'done'
+            job.error = None
+            db.commit()
+            spotify_user_service.invalidate_playlists(user.id)
+            logger.info(
+                f"✅ Trabajo {job.id}: {job.tracks_added} canciones en {job.spotify_playlist_id} "
+                f"({time.monotonic() - started:.1f}s, {job.attempts} reintentos)"
+            )
+        except Exception as e:
+            db.rollback()
+            detail = getattr(e, 'detail', None) or str(e)
+            logger.error(f"❌ Error en el trabajo de playlist {job_id}: {detail}")
+            try:
+                db.query(PlaylistJob).filter(PlaylistJob.id == job_id).update(
+                    {'status': 'error', 'error': str(detail)[:500]}, synchronize_session=False
+                )
+                db.commit()
+            except Exception:
+                db.rollback()
+        finally:
+            db.close()
+            with self._lock:
+                self._running.discard(job_id)
+                self._uncertain.discard(job_id)
+
+    @staticmethod
+    def to_status(job: PlaylistJob) -> Dict:
+        return {
+            'job_id': str(job.id),
+            'status': job.status,
+            'name': job.name,
+            'tracks_total': len(job.track_ids or []),
+            'tracks_added': job.tracks_added,
+            'attempts': job.attempts,
+            'playlist_id': job.spotify_playlist_id,
+            'playlist_url': job.playlist_url,
+            'error': job.error,
+            'created_at': job.created_at,
+            'updated_at': job.updated_at
+        }
+
+
+# Instancia global
+playlist_job_service = PlaylistJobService(
+    max_jobs=int(os.getenv('PLAYLIST_JOB_WORKERS', '4')),
+    max_attempts=int(os.getenv('PLAYLIST_JOB_MAX_ATTEMPTS', '8'))
+)
@@ -0,0 +1,220 @@
+import os
+import json
+import mmap
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("pool_snapshot")
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+CURRENT_LINK = "current"
+
+# Columnas de texto (índices a la tabla de strings; -1 = None)
+STRING_COLUMNS = [
+    'id', 'name', 'artist_ids', 'artist_names', 'album', 'release_date',
+    'image_url', 'preview_url', 'external_url', 'genres'
+]
+# Columnas numéricas (int32)
+NUMERIC_COLUMNS = ['popularity', 'duration_ms', 'year']
+
+# Separador para columnas que guardan listas
+LIST_SEP = '\x1f'
+
+
+def _year(release_date: Optional[str]) -> int:
+    year = (release_date or '').split('-')[0]
+    return int(year) if year.isdigit() else 0
+
+
+def _row_strings(track: Dict) -> List[Optional[str]]:
+    album = track.get('album') or {}
+    images = album.get('images') or []
+    artists = track.get('artists') or []
+    return [
+        track.get('id'),
+        track.get('name'),
+        LIST_SEP.join(a.get('id') or '' for a in artists) if artists else None,
+        LIST_SEP.join(a.get('name') or '' for a in artists) if artists else None,
+        album.get('name'),
+        album.get('release_date'),
+        images[0].get('url') if images else None,
+        track.get('preview_url'),
+        (track.get('external_urls') or {}).get('spotify'),
+        LIST_SEP.join(track.get('_genres') or []) or None
+    ]
+
+
+def export_snapshot(pools: Dict[Tuple[str, str], List[Dict]], out_dir: str) -> str:
+    """
+    Escribe los pools en formato columnar dentro de `out_dir/snapshot-<ts>/`
+    y apunta `out_dir/current` al nuevo snapshot de forma atómica.
+
+    Args:
+        pools: (emoción, mercado) -> tracks reducidos (ver slim_track)
+        out_dir: Directorio base de snapshots
+
+    Returns:
+        Ruta del snapshot creado
+    """
+    snapshot_dir = os.path.join(out_dir, f"snapshot-{int(time.time())}")
+    os.makedirs(snapshot_dir, exist_ok=False)
+
+    string_index: Dict[str, int] = {}
+    string_blobs: List[bytes] = []
+
+    def intern(value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        index = string_index.get(value)
+        if index is None:
+            index = len(string_blobs)
+            string_index[value] = index
+            string_blobs.append(value.encode('utf-8'))
+        return index
+
+    string_rows = []
+    numeric_rows = []
+    ranges = {}
+    for (emotion, market), tracks in sorted(pools.items()):
+        start = len(string_rows)
+        for track in tracks:
+            string_rows.append([intern(v) for v in _row_strings(track)])
+            numeric_rows.append([
+                track.get('popularity') or 0,
+                track.get('duration_ms') or 0,
+                _year((track.get('album') or {}).get('release_date'))
+            ])
+        ranges[f"{emotion}|{market}"] = [start, len(string_rows)]
+
+    offsets = np.zeros(len(string_blobs) + 1, dtype=np.int64)
+    if string_blobs:
+        offsets[1:] = np.cumsum([len(b) for b in string_blobs])
+
+    with open(os.path.join(snapshot_dir, "strings.bin"), 'wb') as f:
+        for blob in string_blobs:
+            f.write(blob)
+    np.save(os.path.join(snapshot_dir, "string_offsets.npy"), offsets)
+    np.save(
+        os.path.join(snapshot_dir, "string_cols.npy"),
+        np.array(string_rows, dtype=np.int32).reshape(-1, len(STRING_COLUMNS))
+    )
+    np.save(
+        os.path.join(snapshot_dir, "numeric_cols.npy"),
+        np.array(numeric_rows, dtype=np.int32).reshape(-1, len(NUMERIC_COLUMNS))
+    )
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'created_at': time.time(),
+        'string_columns': STRING_COLUMNS,
+        'numeric_columns': NUMERIC_COLUMNS,
+        'pools': ranges,
+        'tracks': len(string_rows),
+        'strings': len(string_blobs)
+    }
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+
+    # Reemplazo atómico del enlace "current"
+    tmp_link = os.path.join(out_dir, f".{CURRENT_LINK}.tmp")
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.basename(snapshot_dir), tmp_link)
+    os.replace(tmp_link, os.path.join(out_dir, CURRENT_LINK))
+
+    logger.info(f"💾 Snapshot con {len(string_rows)} tracks y {len(ranges)} pools en {snapshot_dir}")
+    return snapshot_dir
+
+
+class PoolSnapshot:
+    """
+    Snapshot de pools mapeado en memoria (solo lectura). Las páginas del
+    archivo (columnas y strings) se comparten entre todos los workers que lo
+    abren; los tracks que devuelve pool() se construyen en el heap de cada worker.
+    """
+
+    def __init__(self, path: str):
+        if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            path = os.path.join(path, CURRENT_LINK)
+        path = os.path.realpath(path)
+
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Versión de snapshot no soportada: {self.manifest.get('version')}")
+
+        self.path = path
+        self.created_at = self.manifest['created_at']
+        self._ranges = {
+            tuple(key.split('|', 1)): bounds
+            for key, bounds in self.manifest['pools'].items()
+        }
+        self._offsets = np.load(os.path.join(path, "string_offsets.npy"), mmap_mode='r')
+        self._string_cols = np.load(os.path.join(path, "string_cols.npy"), mmap_mode='r')
+        self._numeric_cols = np.load(os.path.join(path, "numeric_cols.npy"), mmap_mode='r')
+
+        strings_path = os.path.join(path, "strings.bin")
+        if os.path.getsize(strings_path):
+            with open(strings_path, 'rb') as f:
+                self._strings = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._strings = b''
+
+    def _string(self, index: int) -> Optional[str]:
+        if index < 0:
+            return None
+        return self._strings[int(self._offsets[index]):int(self._offsets[index + 1])].decode('utf-8')
+
+    def keys(self) -> List[Tuple[str, str]]:
+        return list(self._ranges.keys())
+
+    def pool_size(self, emotion: str, market: str) -> Optional[int]:
+        """Número de tracks del pool sin materializarlo (None si no está)."""
+        bounds = self._ranges.get((emotion, market))
+        return None if bounds is None else bounds[1] - bounds[0]
+
+    def pool(self, emotion: str, market: str) -> Optional[List[Dict]]:
+        """Materializa el pool (emoción, mercado) como tracks reducidos."""
+        bounds = self._ranges.get((emotion, market))
+        if bounds is None:
+            return None
+
+        start, end = bounds
+        # Las columnas del pool se leen de una vez y cada string distinto
+        # (artistas, álbumes, géneros repetidos) se decodifica una sola vez
+        string_rows = np.asarray(self._string_cols[start:end])
+        numeric_rows = np.asarray(self._numeric_cols[start:end]).tolist()
+        strings = {index: self._string(index) for index in np.unique(string_rows).tolist()}
+
+        tracks = []
+        for row, (popularity, duration_ms, _) in zip(string_rows.tolist(), numeric_rows):
+            (track_id, name, artist_ids, artist_names, album, release_date,
+             image_url, preview_url, external_url, genres) = [strings[i] for i in row]
+
+            ids = (artist_ids or '').split(LIST_SEP)
+            names = (artist_names or '').split(LIST_SEP)
+            track = {
+                'id': track_id,
+                'name': name,
+                'artists': [
+                    {'id': artist_id or None, 'name': artist_name}
+                    for artist_id, artist_name in zip(ids, names)
+                ] if artist_names is not None else [],
+                'album': {
+                    'name': album,
+                    'release_date': release_date,
+                    'images': [{'url': image_url}] if image_url else []
+                },
+                'preview_url': preview_url,
+                'external_urls': {'spotify': external_url or ''},
+                'duration_ms': duration_ms,
+                'popularity': popularity
+            }
+            if genres:
+                track['_genres'] = genres.split(LIST_SEP)
+            tracks.append(track)
+        return tracks
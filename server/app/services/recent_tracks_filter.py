@@ -0,0 +1,223 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+
+from app.config.database import SessionLocal
+from app.models.user_recent_tracks import UserRecentTracks
+
+logger = logging.getLogger("recent_tracks_filter")
+
+
+class RotatingBloomFilter:
+    """
+    Conjunto aproximado de IDs con olvido por tiempo.
+
+    Mantiene `generations` filtros Bloom de `bits` bits; los IDs nuevos van a la
+    generación actual y cada `period` segundos se descarta la más antigua.
+    Pertenencia y alta son O(k) independientemente de cuántos IDs haya.
+    """
+
+    def __init__(
+        self,
+        bits: int = 8192,
+        hashes: int = 4,
+        generations: int = 3,
+        period: float = 2 * 24 * 3600,
+        data: Optional[bytes] = None,
+        rotated_at: Optional[float] = None
+    ):
+        self.bits = bits
+        self.hashes = hashes
+        self.period = period
+        size = bits // 8
+        if data and len(data) == size * generations:
+            self._generations = [bytearray(data[i:i + size]) for i in range(0, len(data), size)]
+        else:
+            self._generations = [bytearray(size) for _ in range(generations)]
+        self.rotated_at = rotated_at if rotated_at is not None else time.time()
+
+    def _positions(self, item: str) -> List[int]:
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _rotate(self, now: float) -> bool:
+        """Descarta generaciones vencidas. Retorna True si hubo cambios."""
+        elapsed = int((now - self.rotated_at) // self.period)
+        if elapsed <= 0:
+            return False
+        size = self.bits // 8
+        for _ in range(min(elapsed, len(self._generations))):
+            self._generations.pop()
+            self._generations.insert(0, bytearray(size))
+        self.rotated_at += elapsed * self.period
+        return True
+
+    def add(self, item: str, now: Optional[float] = None):
+        self._rotate(now or time.time())
+        current = self._generations[0]
+        for pos in self._positions(item):
+            current[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        self._rotate(time.time())
+        positions = self._positions(item)
+        for generation in self._generations:
+            if all(generation[pos >> 3] & (1 << (pos & 7)) for pos in positions):
+                return True
+        return False
+
+    def to_bytes(self) -> bytes:
+        return b''.join(bytes(g) for g in self._generations)
+
+
+class RecentTracksRegistry:
+    """
+    Filtros de "recomendado recientemente" por usuario.
+
+    Los filtros viven en memoria (LRU acotado) y se persisten en
+    `user_recent_tracks` en segundo plano cada `flush_interval` segundos.
+    """
+
+    def __init__(self, max_users: int = 10000, flush_interval: float = 60.0):
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        self._filters: "OrderedDict[str, RotatingBloomFilter]" = OrderedDict()
+        self._dirty: Dict[str, RotatingBloomFilter] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def _load(self, user_id: str) -> RotatingBloomFilter:
+        db = SessionLocal()
+        try:
+            row = db.query(UserRecentTracks).filter(UserRecentTracks.user_id == user_id).first()
+            if row:
+                return RotatingBloomFilter(data=row.bloom_data, rotated_at=row.rotated_at)
+        except Exception as e:
+            logger.warning(f"No se pudo leer user_recent_tracks: {e}")
+        finally:
+            db.close()
+        return RotatingBloomFilter()
+
+    def _get(self, user_id: str) -> RotatingBloomFilter:
+        with self._lock:
+            bloom = self._filters.get(user_id) or self._dirty.get(user_id)
+            if bloom is not None:
+                self._filters[user_id] = bloom
+                self._filters.move_to_end(user_id)
+                return bloom
+
+        bloom = self._load(user_id)
+        with self._lock:
+            bloom = self._filters.setdefault(user_id, bloom)
+            self._filters.move_to_end(user_id)
+            while len(self._filters) > self.max_users:
+                # Los filtros desalojados con cambios siguen en _dirty hasta el flush
+                self._filters.popitem(last=False)
+        return bloom
+
+    def exclude_recent(self, user_id: Optional[str], tracks: List[Dict], min_keep: int) -> List[Dict]:
+        """
+        Quita los tracks recomendados recientemente al usuario.
+        Si quedan menos de `min_keep`, retorna la lista original.
+        """
+        if not user_id or not tracks:
+            return tracks
+
+        bloom = self._get(user_id)
+        with self._lock:
+            fresh = [t for t in tracks if t.get('id') not in bloom]
+
+        if len(fresh) < min_keep:
+            logger.info(f"♻️  Pocos tracks nuevos ({len(fresh)}), se permiten repetidos")
+            return tracks
+
+        logger.info(f"♻️  Excluidos {len(tracks) - len(fresh)} tracks recomendados recientemente")
+        return fresh
+
+    def record(self, user_id: Optional[str], track_ids: Iterable[str]):
+        """Registra los tracks servidos al usuario."""
+        if not user_id:
+            return
+
+        bloom = self._get(user_id)
+        now = time.time()
+        with self._lock:
+            for track_id in track_ids:
+                bloom.add(track_id, now)
+            self._dirty[user_id] = bloom
+
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="recent-tracks-flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Persiste los filtros modificados desde el último flush."""
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty = self._dirty
+            pending: List[Tuple[str, bytes, float]] = [
+                (user_id, bloom.to_bytes(), bloom.rotated_at)
+                for user_id, bloom in dirty.items()
+            ]
+            self._dirty = {}
+
+        db = SessionLocal()
+        try:
+            stmt = insert(UserRecentTracks).values([
+                {'user_id': user_id, 'bloom_data': data, 'rotated_at': rotated_at}
+                for user_id, data, rotated_at in pending
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[UserRecentTracks.user_id],
+                set_={
+                    'bloom_data': stmt.excluded.bloom_data,
+                    'rotated_at': stmt.excluded.rotated_at,
+                    'updated_at': func.now()
+                }
+            )
+            db.execute(stmt)
+            db.commit()
+            logger.info(f"💾 Filtros de recientes persistidos para {len(pending)} usuarios")
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudieron persistir filtros de recientes: {e}")
+            # Reintentar en el próximo flush
+            with self._lock:
+                for user_id, bloom in dirty.items():
+                    self._dirty.setdefault(user_id, bloom)
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'users_in_memory': len(self._filters),
+                'pending_flush': len(self._dirty)
+            }
+
+
+# Instancia global
+recent_tracks_registry = RecentTracksRegistry(
+    flush_interval=float(os.getenv('RECENT_TRACKS_FLUSH_INTERVAL', '60'))
+)
@@ -0,0 +1,267 @@
+import os
+import secrets
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger("recommendation_pool")
+
+
+class RecommendationPool:
+    """Candidatos de una recomendación ya servida, para pedir más páginas sin volver a Spotify."""
+
+    def __init__(
+        self,
+        user_id: Optional[str],
+        emotion: str,
+        tracks: List[Dict],
+        served_ids: Iterable[str],
+        extra: Dict[str, Any],
+        expires_at: float
+    ):
+        self.user_id = user_id
+        self.emotion = emotion
+        self.tracks = tracks
+        self.served_ids = set(served_ids)
+        self.extra = extra
+        self.expires_at = expires_at
+        self.lock = threading.Lock()
+
+    def remaining(self) -> List[Dict]:
+        return [t for t in self.tracks if t['id'] not in self.served_ids]
+
+
+class RecommendationPoolStore:
+    """
+    Pools de candidatos en memoria indexados por un cursor opaco, con TTL y
+    un máximo de pools (se descartan los menos usados).
+
+    Los pools viven en el proceso que atendió la primera página: con varios
+    workers o nodos las páginas siguientes deben llegar al mismo proceso
+    (afinidad de sesión en el balanceador). Si no, el cursor no se encuentra
+    y la API responde 410 como si hubiera expirado.
+    """
+
+    def __init__(self, ttl_seconds: int = 900, max_pools: int = 2000):
+        self.ttl_seconds = ttl_seconds
+        self.max_pools = max_pools
+        self._pools: "OrderedDict[str, RecommendationPool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purge_expired(self, now: float):
+        expired = [cursor for cursor, pool in self._pools.items() if pool.expires_at <= now]
+        for cursor in expired:
+            del self._pools[cursor]
+
+    def create(
+        self,
+        user_id: Optional[str],
+        emotion: str,
+        tracks: List[Dict],
+        served_ids: Iterable[str],
+        extra: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
+        """
+        Registra un pool y devuelve su cursor (None si no queda nada por servir).
+        """
+        pool = RecommendationPool(
+            user_id=user_id,
+            emotion=emotion,
+            tracks=tracks,
+            served_ids=served_ids,
+            extra=extra or {},
+            expires_at=time.monotonic() + self.ttl_seconds
+        )
+        if not pool.remaining():
+            return None
+
+        cursor = secrets.token_urlsafe(16)
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            self._pools[cursor] = pool
+            while len(self._pools) > self.max_pools:
+                self._pools.popitem(last=False)
+        return cursor
+
+    def get(self, cursor: str, user_id: Optional[str]) -> Optional[RecommendationPool]:
+        """Obtiene el pool del cursor si existe, no expiró y pertenece al usuario."""
+        with self._lock:
+            pool = self._pools.get(cursor)
+            if pool is None:
+                return None
+            if pool.expires_at <= time.monotonic() or pool.user_id != user_id:
+                if pool.expires_at <= time.monotonic():
+                    del self._pools[cursor]
+                return None
+            self._pools.move_to_end(cursor)
+            return pool
+
+    def discard(self, cursor: str):
+        with self._lock:
+            self._pools.pop(cursor, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'pools': len(self._pools),
+                'ttl_seconds': self.ttl_seconds
+            }
+
+
+class CandidatePoolCache:
+    """
+    Pools de candidatos compartidos por (emoción, mercado) con TTL.
+    Evitan repetir la recolección en Spotify para cada usuario del mismo mercado.
+    """
+
+    def __init__(self, ttl_seconds: int = 1800, snapshot_max_age: float = 24 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_max_age = snapshot_max_age
+        self._pools: Dict[Tuple[str, str], Tuple[float, List[Dict]]] = {}
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_excluded: Set[Tuple[Optional[str], Optional[str]]] = set()
+        # (emoción, mercado) -> candado de quien lo está materializando desde el snapshot
+        self._loading: Dict[Tuple[str, str], threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.snapshot_hits = 0
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Mapea en memoria un snapshot exportado por `app/cli/export_pool_snapshot.py`.
+        Los pools ausentes en memoria se sirven desde el snapshot mientras no supere
+        `snapshot_max_age`.
+
+        Returns:
+            Número de pools disponibles en el snapshot
+        """
+        from app.services.pool_snapshot import PoolSnapshot
+
+        snapshot = PoolSnapshot(path)
+        age = time.time() - snapshot.created_at
+        if age > self.snapshot_max_age:
+            logger.warning(f"Snapshot de pools ignorado: tiene {int(age)}s de antigüedad")
+            return 0
+        with self._lock:
+            self._snapshot = snapshot
+            self._snapshot_excluded = set()
+        logger.info(f"🗺️  Snapshot de pools mapeado: {snapshot.path} ({len(snapshot.keys())} pools)")
+        return len(snapshot.keys())
+
+    def _snapshot_for(self, key: Tuple[str, str]):
+        """Snapshot vigente que puede servir `key` (llamar con el candado tomado)."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        if time.time() - snapshot.created_at > self.snapshot_max_age:
+            self._snapshot = None
+            return None
+        emotion, market = key
+        for excluded_emotion, excluded_market in self._snapshot_excluded:
+            if excluded_emotion in (None, emotion) and excluded_market in (None, market):
+                return None
+        return snapshot
+
+    def _load_from_snapshot(self, key: Tuple[str, str], snapshot) -> Optional[List[Dict]]:
+        """
+        Materializa el pool desde el snapshot fuera del candado de la caché y
+        una sola vez por pool: los demás hilos que lo piden esperan ese resultado.
+        Los dicts quedan en la memoria de este worker como un pool recolectado
+        (`ttl_seconds`); entre workers sólo se comparten las páginas del archivo.
+        """
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            with self._lock:
+                entry = self._pools.get(key)
+                if entry and entry[0] > time.monotonic():
+                    return entry[1]
+            tracks = None
+            try:
+                tracks = snapshot.pool(*key)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+                    # Un invalidate() o un snapshot nuevo durante la lectura la descarta
+                    if not tracks or self._snapshot_for(key) is not snapshot:
+                        tracks = None
+                    else:
+                        snapshot_left = self.snapshot_max_age - (time.time() - snapshot.created_at)
+                        expires = time.monotonic() + min(self.ttl_seconds, snapshot_left)
+                        self._pools[key] = (expires, tracks)
+            return tracks
+
+    def get(self, emotion: str, market: str, min_size: int = 0) -> Optional[List[Dict]]:
+        """Pool vigente para (emoción, mercado) con al menos `min_size` tracks."""
+        key = (emotion, market)
+        with self._lock:
+            entry = self._pools.get(key)
+            if entry and entry[0] > time.monotonic() and len(entry[1]) >= min_size:
+                self.hits += 1
+                return entry[1]
+            if entry and entry[0] <= time.monotonic():
+                del self._pools[key]
+
+            # Pool ausente en memoria: se sirve desde el snapshot si tiene tracks suficientes
+            snapshot = None if entry else self._snapshot_for(key)
+            if snapshot is None or (snapshot.pool_size(emotion, market) or 0) < max(1, min_size):
+                self.misses += 1
+                return None
+
+        tracks = self._load_from_snapshot(key, snapshot)
+        with self._lock:
+            if tracks is None:
+                self.misses += 1
+            else:
+                self.snapshot_hits += 1
+        return tracks
+
+    def put(self, emotion: str, market: str, tracks: List[Dict]):
+        with self._lock:
+            self._pools[(emotion, market)] = (time.monotonic() + self.ttl_seconds, tracks)
+
+    def invalidate(self, emotion: Optional[str] = None, market: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Elimina los pools que coinciden con la emoción y/o el mercado dados
+        (también deja de servirlos desde el snapshot).
+
+        Returns:
+            Claves (emoción, mercado) eliminadas de memoria
+        """
+        with self._lock:
+            keys = [
+                key for key in self._pools
+                if (emotion is None or key[0] == emotion) and (market is None or key[1] == market)
+            ]
+            for key in keys:
+                del self._pools[key]
+            if self._snapshot is not None:
+                self._snapshot_excluded.add((emotion, market))
+            return keys
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.snapshot_hits + self.misses
+            return {
+                'pools': len(self._pools),
+                'markets': sorted({market for _, market in self._pools}),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.snapshot_hits) / lookups, 4) if lookups else 0.0,
+                'snapshot_hits': self.snapshot_hits,
+                'snapshot': self._snapshot.path if self._snapshot else None,
+                'ttl_seconds': self.ttl_seconds
+            }
+
+
+# Instancias globales
+recommendation_pool_store = RecommendationPoolStore(
+    ttl_seconds=int(os.getenv('RECOMMENDATION_POOL_TTL', '900'))
+)
+candidate_pool_cache = CandidatePoolCache(
+    ttl_seconds=int(os.getenv('CANDIDATE_POOL_TTL', '1800')),
+    snapshot_max_age=float(os.getenv('SPOTIFY_POOL_SNAPSHOT_MAX_AGE', str(24 * 3600)))
+)
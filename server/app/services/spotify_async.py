@@ -0,0 +1,643 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+import requests
+from spotipy.exceptions import SpotifyException
+from starlette.concurrency import run_in_threadpool
+
+from app.services.spotify_scheduler import spotify_scheduler
+from app.services.emotion_config import emotion_config, QueryPlan
+from app.services.artist_genre_cache import artist_genre_cache
+from app.services.recommendation_pool import recommendation_pool_store, candidate_pool_cache
+from app.services.recent_tracks_filter import recent_tracks_registry
+from app.services.taste_profile import taste_profile_store
+from app.services.spotify_service import spotify_service, SpotifyService
+from app.utils.track_rows import slim_track
+
+logger = logging.getLogger("spotify_async")
+
+
+class AsyncSpotifyClient:
+    """
+    Cliente asíncrono de la Web API de Spotify (Client Credentials) sobre un
+    único httpx.AsyncClient con HTTP/2: todas las corrutinas del worker
+    multiplexan sus peticiones en pocas conexiones.
+
+    - Cada petición pide turno al scheduler con `aslot()` (misma cuota que el cliente síncrono).
+    - Reintentos con backoff asíncrono: 429 respeta Retry-After, 5xx y errores
+      de red esperan `backoff_factor * 2^intento`; nunca más allá del deadline.
+    - El token se renueva una sola vez aunque lo pidan muchas corrutinas.
+    """
+
+    API_URL = "https://api.spotify.com/v1"
+    TOKEN_URL = "https://accounts.spotify.com/api/token"
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        max_connections: int = 20,
+        request_timeout: float = 15.0,
+        retries: int = 3,
+        backoff_factor: float = 0.3,
+        max_retry_after: float = 5.0
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
+        self._client: Optional[httpx.AsyncClient] = None
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.http_versions: Counter = Counter()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Se crea con el primer uso, dentro del event loop del worker
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=self.request_timeout
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _access_token(self, force: bool = False) -> str:
+        if not force and self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        async with self._token_lock:
+            # Otra corrutina pudo renovarlo mientras esperábamos el lock
+            if not force and self._token and time.monotonic() < self._token_expires_at:
+                return self._token
+            response = await self.client.post(
+                self.TOKEN_URL,
+                data={"grant_type": "client_credentials"},
+                auth=(self.client_id, self.client_secret)
+            )
+            response.raise_for_status()
+            data = response.json()
+            self._token = data["access_token"]
+            self._token_expires_at = time.monotonic() + data.get("expires_in", 3600) - 60
+            return self._token
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> float:
+        return float('inf') if deadline is None else deadline - time.monotonic()
+
+    async def _pause(self, seconds: float, deadline: Optional[float]) -> bool:
+        """Espera `seconds` si el deadline lo permite; retorna False si no."""
+        if seconds >= self._remaining(deadline):
+            return False
+        await asyncio.sleep(seconds)
+        return True
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None
+    ) -> Dict:
+        """
+        Petición a la API con turno del scheduler, timeout acotado por el
+        deadline y reintentos asíncronos.
+
+        Raises:
+            SpotifyException con el estado HTTP si la API responde con error
+            requests.exceptions.Timeout si se agota el presupuesto
+        """
+        refreshed = False
+        attempt = 0
+        while True:
+            remaining = self._remaining(deadline)
+            if remaining <= SpotifyService.MIN_CALL_TIMEOUT:
+                raise requests.exceptions.Timeout("Presupuesto de la petición agotado")
+            timeout = min(self.request_timeout, remaining)
+
+            token = await self._access_token()
+            try:
+                async with spotify_scheduler.aslot(timeout=timeout) as waited:
+                    response = await self.client.request(
+                        method,
+                        f"{self.API_URL}{path}",
+                        params=params,
+                        headers={"Authorization": f"Bearer {token}"},
+                        timeout=max(SpotifyService.MIN_CALL_TIMEOUT, timeout - waited)
+                    )
+            except httpx.TimeoutException:
+                raise requests.exceptions.Timeout(f"Timeout en {path}")
+            except httpx.TransportError as e:
+                if attempt >= self.retries or not await self._pause(self.backoff_factor * 2 ** attempt, deadline):
+                    raise requests.exceptions.ConnectionError(str(e))
+                attempt += 1
+                self.retried += 1
+                continue
+
+            self.requests += 1
+            self.http_versions[response.http_version] += 1
+
+            if response.status_code == 401 and not refreshed:
+                refreshed = True
+                await self._access_token(force=True)
+                continue
+
+            if response.status_code in self.RETRY_STATUSES and attempt < self.retries:
+                if response.status_code == 429:
+                    self.rate_limited += 1
+                    delay = min(float(response.headers.get('Retry-After', 1)), self.max_retry_after)
+                else:
+                    delay = self.backoff_factor * 2 ** attempt
+                if await self._pause(delay, deadline):
+                    attempt += 1
+                    self.retried += 1
+                    continue
+
+            if response.status_code >= 400:
+                try:
+                    message = response.json().get('error', {}).get('message', response.text)
+                except ValueError:
+                    message = response.text
+                raise SpotifyException(response.status_code, -1, f"{path}: {message}")
+
+            return response.json()
+
+    # ============ ENDPOINTS ============
+
+    async def search(self, q: str, type: str = 'track', limit: int = 10, market: Optional[str] = None,
+                     deadline: Optional[float] = None) -> Dict:
+        params = {'q': q, 'type': type, 'limit': limit}
+        if market:
+            params['market'] = market
+        return await self.request('GET', '/search', params, deadline)
+
+    async def playlist_items(self, playlist_id: str, limit: int = 100, market: Optional[str] = None,
+                             deadline: Optional[float] = None) -> Dict:
+        params = {'limit': limit, 'additional_types': 'track'}
+        if market:
+            params['market'] = market
+        return await self.request('GET', f'/playlists/{playlist_id}/tracks', params, deadline)
+
+    async def artists(self, artist_ids: List[str], deadline: Optional[float] = None) -> Dict:
+        return await self.request('GET', '/artists', {'ids': ','.join(artist_ids)}, deadline)
+
+    async def artist_top_tracks(self, artist_id: str, country: str = 'US',
+                                deadline: Optional[float] = None) -> Dict:
+        return await self.request('GET', f'/artists/{artist_id}/top-tracks', {'country': country}, deadline)
+
+    async def audio_features(self, track_ids: List[str], deadline: Optional[float] = None) -> List[Optional[Dict]]:
+        result = await self.request('GET', '/audio-features', {'ids': ','.join(track_ids)}, deadline)
+        return result.get('audio_features') or []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_connections': self.max_connections,
+            'requests': self.requests,
+            'retried': self.retried,
+            'rate_limited': self.rate_limited,
+            'http_versions': dict(self.http_versions)
+        }
+
+
+class AsyncSpotifyService:
+    """
+    Recomendaciones con E/S asíncrona: mismo contrato que
+    SpotifyService.get_recommendations, pero la recolección corre en el event
+    loop (consultas en paralelo acotadas por `max_parallel_queries`) y no ocupa
+    hilos mientras espera a Spotify. La selección, el diversificado y las
+    cachés son los del servicio síncrono; las partes que pueden tocar la base
+    de datos corren brevemente en el threadpool.
+    """
+
+    def __init__(self, service: SpotifyService, client: AsyncSpotifyClient, max_parallel_queries: int = 6):
+        self.service = service
+        self.client = client
+        self.max_parallel_queries = max_parallel_queries
+        # Construcciones en curso del pool compartido: una sola por (emoción, mercado)
+        self._building: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def get_recommendations(
+        self,
+        emotion: str,
+        limit: int = 20,
+        preferred_genres: Optional[List[str]] = None,
+        markets: Optional[List[str]] = None,
+        budget_seconds: Optional[float] = None,
+        user_id: Optional[str] = None,
+        market: Optional[str] = None,
+        extra_candidates: Optional[List[Dict]] = None
+    ) -> Dict[str, Any]:
+        """Ver SpotifyService.get_recommendations (mismos parámetros y respuesta)."""
+        service = self.service
+        start = time.time()
+        budget = budget_seconds if budget_seconds is not None else service.RECOMMENDATION_BUDGET_SECONDS
+        deadline = time.monotonic() + budget
+        emotion = emotion.upper()
+
+        config = emotion_config.current()
+        if emotion not in config.descriptors:
+            raise ValueError(f"Emoción desconocida: {emotion}")
+
+        descriptors = config.descriptors[emotion]
+        filters = config.filters.get(emotion, {})
+        markets_to_use = [market] if market else (markets or service.markets)
+        genres_to_use = preferred_genres or descriptors.get('genres', [])
+        shared_pool = market is not None and not preferred_genres
+
+        logger.info(f"🎵 [async] Buscando {limit} canciones para '{emotion}' (mercado: {market or 'aleatorio'})")
+
+        # 1) RECOLECCIÓN (o pool compartido del mercado)
+        complete = True
+        if shared_pool:
+            candidates, complete = await self._shared_pool(emotion, market, genres_to_use, limit, deadline)
+        else:
+            candidates, complete = await self.build_candidate_pool(
+                emotion, markets_to_use, genres=genres_to_use, target_count=limit * 15, deadline=deadline
+            )
+        if not complete:
+            logger.warning(f"⏱️  Presupuesto de {budget:.2f}s agotado, usando resultados parciales")
+
+        if extra_candidates:
+            known = {t['id'] for t in candidates}
+            candidates = candidates + [t for t in extra_candidates if t.get('id') and t['id'] not in known]
+
+        # 2) FILTRADO SUAVE (solo si audio_features está disponible)
+        filtered = candidates
+        if service._audio_features_available and len(candidates) > limit * 3:
+            filtered = await self._filter_tracks_by_features(candidates, filters, deadline)
+
+        # 3) DIVERSIFICACIÓN (CPU + cachés que pueden leer la base de datos)
+        pool_tracks = filtered if filtered else candidates
+
+        def select() -> List[Dict]:
+            final_tracks = service._diversify_tracks(
+                recent_tracks_registry.exclude_recent(user_id, pool_tracks, min_keep=limit),
+                limit=limit,
+                taste=taste_profile_store.get(user_id)
+            )
+            return service._process_tracks(final_tracks)
+
+        processed = await run_in_threadpool(select)
+
+        # 4) ANÁLISIS DE CARACTERÍSTICAS
+        avg_features = await self._analyze_track_features([t['id'] for t in processed], deadline)
+        music_params = {
+            'valence': f"{avg_features.get('valence', 0.5):.2f}",
+            'energy': f"{avg_features.get('energy', 0.5):.2f}",
+            'tempo': f"{int(avg_features.get('tempo', 100))} BPM",
+            'mode': avg_features.get('mode_text', 'Mixto')
+        }
+
+        recent_tracks_registry.record(user_id, [t['id'] for t in processed])
+        cursor = recommendation_pool_store.create(
+            user_id=user_id,
+            emotion=emotion,
+            tracks=pool_tracks,
+            served_ids=[t['id'] for t in processed],
+            extra={'genres_used': genres_to_use[:5], 'music_params': music_params}
+        )
+
+        logger.info(f"✓ [async] Completado en {time.time() - start:.2f}s")
+
+        return {
+            'success': True,
+            'emotion': emotion,
+            'tracks': processed,
+            'total': len(processed),
+            'complete': complete,
+            'cursor': cursor,
+            'genres_used': genres_to_use[:5],
+            'music_params': music_params
+        }
+
+    async def _shared_pool(
+        self,
+        emotion: str,
+        market: str,
+        genres: List[str],
+        limit: int,
+        deadline: float
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Pool compartido de (emoción, mercado). Si falta, lo construye una sola
+        corrutina y el resto de peticiones concurrentes esperan ese resultado.
+        """
+        candidates = candidate_pool_cache.get(emotion, market, min_size=limit * 2)
+        if candidates is not None:
+            logger.info(f"📦 Pool en caché para {emotion}/{market}: {len(candidates)} candidatos")
+            return candidates, True
+
+        key = (emotion, market)
+        building = self._building.get(key)
+        if building is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(building), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                return [], False
+            except asyncio.CancelledError:
+                if building.cancelled():
+                    return [], False
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._building[key] = future
+        try:
+            candidates, complete = await self.build_candidate_pool(
+                emotion, [market], genres=genres, target_count=limit * 15, deadline=deadline
+            )
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # evita el aviso de excepción no recuperada si nadie esperaba
+            raise
+        finally:
+            self._building.pop(key, None)
+
+        if complete or len(candidates) >= self.service.MIN_SHARED_POOL_SIZE:
+            candidate_pool_cache.put(emotion, market, candidates)
+        future.set_result((candidates, complete))
+        return candidates, complete
+
+    async def build_candidate_pool(
+        self,
+        emotion: str,
+        markets: List[str],
+        genres: Optional[List[str]] = None,
+        target_count: int = 300,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Dict], bool]:
+        """Ver SpotifyService.build_candidate_pool."""
+        candidates, complete = await self._collect_diverse_candidates(
+            self.service._query_plan(emotion, genres), markets, target_count, deadline
+        )
+        logger.info(f"📊 [async] Recolectados {len(candidates)} candidatos únicos")
+        await self._enrich_artist_genres(candidates, deadline)
+        return [slim_track(t) for t in candidates if t.get('id')], complete
+
+    async def _gather_within(self, coroutines: List, deadline: Optional[float]) -> Tuple[List, bool]:
+        """
+        Ejecuta las corrutinas en paralelo (como mucho `max_parallel_queries`)
+        hasta el deadline. Retorna (resultados terminados, terminaron todas).
+        """
+        semaphore = asyncio.Semaphore(self.max_parallel_queries)
+
+        async def bounded(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        tasks = [asyncio.ensure_future(bounded(c)) for c in coroutines]
+        if not tasks:
+            return [], True
+        remaining = AsyncSpotifyClient._remaining(deadline)
+        done, pending = await asyncio.wait(tasks, timeout=None if remaining == float('inf') else max(0.0, remaining))
+        for task in pending:
+            task.cancel()
+        results = [task.result() for task in done if not task.cancelled() and task.exception() is None]
+        return results, not pending
+
+    async def _collect_diverse_candidates(
+        self,
+        plan: QueryPlan,
+        markets: List[str],
+        target_count: int,
+        deadline: Optional[float]
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Mismas fuentes que la versión síncrona (género + mood, playlists y
+        artistas semilla), pero cada fuente lanza sus consultas en paralelo.
+        """
+        candidates: List[Dict] = []
+        seen_ids: Set[str] = set()
+        fingerprints: Dict[str, int] = {}
+
+        def add_all(results: List[List[Dict]]):
+            for tracks in results:
+                for track in tracks:
+                    SpotifyService._add_candidate(track, candidates, seen_ids, fingerprints)
+
+        # ESTRATEGIA 1: Búsqueda por género + mood
+        queries = plan.search_queries
+        sample = random.sample(queries, min(len(queries), self.service.SEARCH_QUERIES_PER_POOL))
+        results, complete = await self._gather_within(
+            [self._search_tracks(q, random.choice(markets), deadline) for q in sample], deadline
+        )
+        add_all(results)
+        if len(candidates) >= target_count or not complete:
+            return candidates, complete
+
+        # ESTRATEGIAS 2 y 3: Playlists curadas y artistas semilla, a la vez
+        results, complete = await self._gather_within(
+            [self._playlist_tracks(q, random.choice(markets), deadline) for q in plan.playlist_queries[:5]]
+            + [self._artist_top_tracks(name, random.choice(markets), deadline, plan.artist_ids)
+               for name in plan.artist_seeds[:4]],
+            deadline
+        )
+        add_all(results)
+        return candidates, complete and AsyncSpotifyClient._remaining(deadline) > SpotifyService.MIN_CALL_TIMEOUT
+
+    async def _hedged(
+        self,
+        kind: str,
+        deadline: Optional[float],
+        market: str,
+        fn: Callable[[str], Awaitable[Dict]]
+    ) -> Dict:
+        """
+        Igual que SpotifyService._hedged_call (mismo hedger: latencias, bucket y
+        métricas compartidos): si `fn(market)` tarda más que el p90 de `kind`, se
+        lanza `fn` en otro mercado y gana la primera respuesta.
+        """
+        alternatives = [m for m in self.service.markets if m != market] or [market]
+        alt_market = random.choice(alternatives)
+        remaining = AsyncSpotifyClient._remaining(deadline)
+        return await self.service.hedger.arun(
+            kind,
+            lambda: fn(market),
+            lambda: fn(alt_market),
+            timeout=None if remaining == float('inf') else remaining
+        )
+
+    async def _search_tracks(self, query: str, market: str, deadline: Optional[float]) -> List[Dict]:
+        try:
+            result = await self._hedged(
+                'search', deadline, market,
+                lambda m: self.client.search(query, type='track', limit=50, market=m, deadline=deadline)
+            )
+            return result.get('tracks', {}).get('items', [])
+        except SpotifyException as e:
+            logger.warning(f"Search error [{e.http_status}]: {query}")
+        except requests.exceptions.Timeout:
+            logger.info(f"⏱️  Search sin presupuesto: {query}")
+        except Exception as e:
+            logger.error(f"Unexpected search error: {e}")
+        return []
+
+    async def _playlist_tracks(self, query: str, market: str, deadline: Optional[float]) -> List[Dict]:
+        try:
+            result = await self._hedged(
+                'search', deadline, market,
+                lambda m: self.client.search(query, type='playlist', limit=3, market=m, deadline=deadline)
+            )
+        except Exception as e:
+            logger.warning(f"Error buscando playlists: {e}")
+            return []
+
+        async def items(playlist_id: str) -> List[Dict]:
+            page = await self._hedged(
+                'playlist_items', deadline, market,
+                lambda m: self.client.playlist_items(playlist_id, limit=30, market=m, deadline=deadline)
+            )
+            return [
+                item['track'] for item in page.get('items', [])
+                if item.get('track') and item['track'].get('id')
+            ]
+
+        playlists = [p for p in result.get('playlists', {}).get('items', []) if p and p.get('id')]
+        pages = await asyncio.gather(*(items(p['id']) for p in playlists), return_exceptions=True)
+        return [track for page in pages if not isinstance(page, BaseException) for track in page]
+
+    async def _artist_top_tracks(
+        self,
+        artist_name: str,
+        market: str,
+        deadline: Optional[float],
+        resolved: Dict[str, Optional[str]]
+    ) -> List[Dict]:
+        try:
+            if artist_name in resolved:
+                artist_id = resolved[artist_name]
+            else:
+                result = await self.client.search(f"artist:{artist_name}", type='artist', limit=1, deadline=deadline)
+                artists = result.get('artists', {}).get('items', [])
+                artist_id = artists[0]['id'] if artists else None
+                resolved[artist_name] = artist_id
+            if not artist_id:
+                return []
+            tops = await self.client.artist_top_tracks(artist_id, country=market, deadline=deadline)
+            return tops.get('tracks', [])
+        except Exception as e:
+            logger.debug(f"Error obteniendo tracks de artista {artist_name}: {e}")
+            return []
+
+    async def _enrich_artist_genres(self, tracks: List[Dict], deadline: Optional[float]) -> None:
+        """Ver SpotifyService._enrich_artist_genres; los lotes de /artists van en paralelo."""
+        artist_ids = list(dict.fromkeys(
+            (track.get('artists') or [{}])[0].get('id') for track in tracks
+        ))
+        artist_ids = [a for a in artist_ids if a]
+        if not artist_ids:
+            return
+
+        genres_by_artist = await run_in_threadpool(artist_genre_cache.get_many, artist_ids)
+        missing = [a for a in artist_ids if a not in genres_by_artist]
+
+        async def fetch(batch: List[str]) -> Dict[str, List[str]]:
+            result = await self.client.artists(batch, deadline=deadline)
+            return {a['id']: a.get('genres', []) for a in result.get('artists', []) if a and a.get('id')}
+
+        batches, _ = await self._gather_within(
+            [fetch(missing[i:i + 50]) for i in range(0, len(missing), 50)], deadline
+        )
+        fetched = {artist_id: genres for batch in batches for artist_id, genres in batch.items()}
+        if fetched:
+            await run_in_threadpool(artist_genre_cache.put_many, fetched)
+            genres_by_artist.update(fetched)
+
+        for track in tracks:
+            track['_genres'] = genres_by_artist.get((track.get('artists') or [{}])[0].get('id'), [])
+
+        logger.info(f"🏷️  [async] Géneros: {len(genres_by_artist)}/{len(artist_ids)} artistas ({len(fetched)} nuevos)")
+
+    async def _audio_features(self, track_ids: List[str], deadline: Optional[float]) -> Optional[List[Dict]]:
+        """Features de los tracks en lotes paralelos de 50; None si no están disponibles."""
+        try:
+            batches = await asyncio.gather(*(
+                self.client.audio_features(track_ids[i:i + 50], deadline=deadline)
+                for i in range(0, len(track_ids), 50)
+            ))
+        except SpotifyException as e:
+            if e.http_status == 403:
+                self.service._audio_features_available = False
+                logger.warning("⚠ Audio features 403 - deshabilitando filtros")
+            return None
+        except Exception as e:
+            logger.debug(f"Error en audio features: {e}")
+            return None
+        return [features for batch in batches for features in batch if features]
+
+    async def _filter_tracks_by_features(self, tracks: List[Dict], filters: Dict, deadline: Optional[float]) -> List[Dict]:
+        if not tracks or not filters:
+            return tracks
+        id_to_track = {t['id']: t for t in tracks if t.get('id')}
+        features_list = await self._audio_features(list(id_to_track), deadline)
+        if features_list is None:
+            return tracks
+
+        filtered = []
+        for features in features_list:
+            track = id_to_track.get(features.get('id'))
+            if track and self.service._passes_filters(features, filters):
+                track_copy = track.copy()
+                track_copy['_features'] = features
+                filtered.append(track_copy)
+
+        if len(filtered) < len(tracks) * 0.3:
+            logger.warning(f"Filtros muy estrictos ({len(filtered)}/{len(tracks)}), usando todos")
+            return tracks
+        return filtered
+
+    async def _analyze_track_features(self, track_ids: List[str], deadline: Optional[float]) -> Dict[str, Any]:
+        default_features = {'valence': 0.5, 'energy': 0.5, 'tempo': 120.0, 'mode_text': 'N/A'}
+        if not track_ids or self.service._audio_features_available is False:
+            return default_features
+
+        all_features = await self._audio_features(track_ids, deadline)
+        if not all_features:
+            return default_features
+
+        count = len(all_features)
+        mode_avg = sum(f.get('mode', 0) for f in all_features) / count
+        return {
+            'valence': sum(f.get('valence', 0.5) for f in all_features) / count,
+            'energy': sum(f.get('energy', 0.5) for f in all_features) / count,
+            'tempo': sum(f.get('tempo', 120) for f in all_features) / count,
+            'mode_text': "Mayor (alegre)" if mode_avg > 0.6 else "Menor (triste)" if mode_avg < 0.4 else "Mixto"
+        }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {**self.client.stats(), 'pools_building': len(self._building)}
+
+
+# Instancia global
+async_spotify_service = AsyncSpotifyService(
+    spotify_service,
+    AsyncSpotifyClient(
+        client_id=os.getenv('SPOTIFY_CLIENT_ID'),
+        client_secret=os.getenv('SPOTIFY_CLIENT_SECRET'),
+        max_connections=int(os.getenv('SPOTIFY_ASYNC_MAX_CONNECTIONS', '20'))
+    ),
+    max_parallel_queries=int(os.getenv('SPOTIFY_ASYNC_PARALLEL_QUERIES', '6'))
+)
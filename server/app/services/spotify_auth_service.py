@@ -10,6 +10,7 @@ from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 
 from app.models.user import User
+from app.services.spotify_http import spotify_user_session
 from app.utils.security import create_access_token
 from dotenv import load_dotenv
 
@@ -98,7 +99,7 @@ class SpotifyAuthService:
         }
 
         try:
-            response = requests.post(self.SPOTIFY_TOKEN_URL, data=data, timeout=10)
+            response = spotify_user_session.post(self.SPOTIFY_TOKEN_URL, data=data, timeout=10)
             response.raise_for_status()
             token_data = response.json()
 
@@ -130,7 +131,7 @@ class SpotifyAuthService:
         }
 
         try:
-            response = requests.post(self.SPOTIFY_TOKEN_URL, data=data, timeout=10)
+            response = spotify_user_session.post(self.SPOTIFY_TOKEN_URL, data=data, timeout=10)
             response.raise_for_status()
             token_data = response.json()
 
@@ -157,7 +158,7 @@ class SpotifyAuthService:
         headers = {"Authorization": f"Bearer {access_token}"}
 
         try:
-            response = requests.get(
+            response = spotify_user_session.get(
                 f"{self.SPOTIFY_API_URL}/me",
                 headers=headers,
                 timeout=10
@@ -210,6 +211,7 @@ class SpotifyAuthService:
             existing_user.spotify_token_expires_at = expires_at
             existing_user.spotify_email = spotify_email
             existing_user.spotify_display_name = spotify_display_name
+            existing_user.spotify_country = spotify_user_data.get("country")
             existing_user.spotify_connected = True
             existing_user.last_login = datetime.now(timezone.utc)
 
@@ -248,6 +250,7 @@ class SpotifyAuthService:
             spotify_id=spotify_id,
             spotify_email=spotify_email,
             spotify_display_name=spotify_display_name,
+            spotify_country=spotify_user_data.get("country"),
             spotify_access_token=token_data.get("access_token"),
             spotify_refresh_token=token_data.get("refresh_token"),
             spotify_token_expires_at=expires_at,
@@ -305,6 +308,7 @@ class SpotifyAuthService:
         user.spotify_id = spotify_id
         user.spotify_email = spotify_user_data.get("email")
         user.spotify_display_name = spotify_user_data.get("display_name")
+        user.spotify_country = spotify_user_data.get("country")
         user.spotify_access_token = token_data.get("access_token")
         user.spotify_refresh_token = token_data.get("refresh_token")
         user.spotify_token_expires_at = expires_at
@@ -351,6 +355,7 @@ class SpotifyAuthService:
         user.spotify_id = None
         user.spotify_email = None
         user.spotify_display_name = None
+        user.spotify_country = None
         user.spotify_access_token = None
         user.spotify_refresh_token = None
         user.spotify_token_expires_at = None
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import requests
+
+logger = logging.getLogger("spotify_hedger")
+
+
+class _KindStats:
+    """Latencias y contadores de un tipo de llamada (search, playlist_items...)."""
+
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def p90(self) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+
+class SpotifyHedger:
+    """
+    Peticiones "hedged" para recortar la latencia de cola.
+
+    Si una llamada no respondió cuando se alcanza el p90 observado para su tipo,
+    se lanza un duplicado y gana la primera respuesta correcta. El número de
+    duplicados se limita con un bucket que gana `max_hedge_ratio` tokens por
+    llamada, de modo que nunca se duplica más de ese porcentaje del tráfico.
+
+    El executor debe poder correr a la vez todas las llamadas que admite el
+    scheduler más sus duplicados (ver `max_workers`): si se queda corto, la
+    cola del executor limita la concurrencia. Las latencias y la espera del
+    hedge se cuentan desde que la llamada empieza a correr, no desde que se encola.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        max_hedge_ratio: float = 0.1,
+        min_samples: int = 20,
+        window: int = 200,
+        max_workers: int = 8
+    ):
+        self.enabled = enabled
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self._window = window
+        self._stats: Dict[str, _KindStats] = defaultdict(lambda: _KindStats(self._window))
+        self._tokens = 0.0
+        self._max_tokens = 5.0
+        self._lock = threading.Lock()
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="spotify-hedge") if enabled else None
+
+    def _record(self, kind: str, started: float):
+        with self._lock:
+            self._stats[kind].latencies.append(time.monotonic() - started)
+
+    def _hedge_delay(self, kind: str) -> Optional[float]:
+        with self._lock:
+            stats = self._stats[kind]
+            stats.calls += 1
+            self._tokens = min(self._max_tokens, self._tokens + self.max_hedge_ratio)
+            if len(stats.latencies) < self.min_samples:
+                return None
+            return stats.p90()
+
+    def _take_token(self, kind: str) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            self._stats[kind].hedges += 1
+            return True
+
+    def run(
+        self,
+        kind: str,
+        primary: Callable[[], Any],
+        hedge: Optional[Callable[[], Any]] = None,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Ejecuta `primary` y, si tarda más que el p90 de `kind`, también `hedge`.
+
+        Args:
+            kind: Tipo de llamada para agrupar latencias
+            primary: Llamada original
+            hedge: Llamada duplicada (p. ej. en otro mercado); None desactiva el hedge
+            timeout: Segundos máximos de espera total
+
+        Returns:
+            El resultado de la primera llamada que termine sin error
+        """
+        delay = self._hedge_delay(kind)
+        started = time.monotonic()
+
+        if not self.enabled or hedge is None or delay is None:
+            try:
+                return primary()
+            finally:
+                self._record(kind, started)
+
+        running = threading.Event()
+        run_started = [started]
+
+        def timed_primary():
+            run_started[0] = time.monotonic()
+            running.set()
+            try:
+                return primary()
+            finally:
+                self._record(kind, run_started[0])
+
+        primary_future = self._executor.submit(timed_primary)
+
+        # El p90 se mide desde que la llamada corre: la espera en cola no cuenta
+        running.wait(timeout=self._left(started, timeout))
+        first_wait = delay - (time.monotonic() - run_started[0])
+        if timeout is not None:
+            first_wait = min(first_wait, self._left(started, timeout))
+        done, _ = wait([primary_future], timeout=max(0.0, first_wait))
+        if done or not running.is_set() or not self._take_token(kind):
+            try:
+                return primary_future.result(timeout=self._left(started, timeout))
+            except FutureTimeout:
+                raise requests.exceptions.Timeout(f"Sin respuesta para {kind} dentro del presupuesto")
+
+        hedge_future = self._executor.submit(hedge)
+        pending = {primary_future, hedge_future}
+        error = None
+
+        while pending:
+            done, pending = wait(pending, timeout=self._left(started, timeout), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge_future:
+                        with self._lock:
+                            self._stats[kind].hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+
+        if error is not None:
+            raise error
+        raise requests.exceptions.Timeout(f"Sin respuesta para {kind} dentro del presupuesto")
+
+    async def arun(
+        self,
+        kind: str,
+        primary: Callable[[], Awaitable[Any]],
+        hedge: Optional[Callable[[], Awaitable[Any]]] = None,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Versión asíncrona de run() con las mismas latencias y el mismo bucket de
+        duplicados: la llamada y su duplicado son tareas del event loop (no usan
+        el executor) y la que pierde se cancela.
+        """
+        delay = self._hedge_delay(kind)
+        started = time.monotonic()
+
+        if not self.enabled or hedge is None or delay is None:
+            try:
+                return await primary()
+            finally:
+                self._record(kind, started)
+
+        primary_task = asyncio.ensure_future(primary())
+        primary_task.add_done_callback(lambda _: self._record(kind, started))
+        tasks = [primary_task]
+        try:
+            first_wait = delay if timeout is None else min(delay, timeout)
+            done, _ = await asyncio.wait(tasks, timeout=first_wait)
+            if done or not self._take_token(kind):
+                done, _ = await asyncio.wait(tasks, timeout=self._left(started, timeout))
+                if not done:
+                    raise requests.exceptions.Timeout(f"Sin respuesta para {kind} dentro del presupuesto")
+                return primary_task.result()
+
+            hedge_task = asyncio.ensure_future(hedge())
+            tasks.append(hedge_task)
+            pending = set(tasks)
+            error = None
+
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=self._left(started, timeout), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            with self._lock:
+                                self._stats[kind].hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+
+            if error is not None:
+                raise error
+            raise requests.exceptions.Timeout(f"Sin respuesta para {kind} dentro del presupuesto")
+        finally:
+            # La que perdió (o todas, si se canceló quien espera) no sigue ocupando turno
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _left(started: float, timeout: Optional[float]) -> Optional[float]:
+        if timeout is None:
+            return None
+        return max(0.0, timeout - (time.monotonic() - started))
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de hedging por tipo de llamada."""
+        with self._lock:
+            result = {}
+            for kind, stats in self._stats.items():
+                p90 = stats.p90()
+                result[kind] = {
+                    'calls': stats.calls,
+                    'hedges': stats.hedges,
+                    'hedge_wins': stats.hedge_wins,
+                    'hedge_rate': round(stats.hedges / stats.calls, 4) if stats.calls else 0.0,
+                    'win_rate': round(stats.hedge_wins / stats.hedges, 4) if stats.hedges else 0.0,
+                    'p90_ms': round(p90 * 1000, 1) if p90 is not None else None
+                }
+            return {
+                'enabled': self.enabled,
+                'max_hedge_ratio': self.max_hedge_ratio,
+                'max_workers': self.max_workers,
+                'kinds': result
+            }
@@ -0,0 +1,254 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import requests
+import spotipy
+import urllib3
+from requests.adapters import HTTPAdapter
+from spotipy.oauth2 import SpotifyClientCredentials
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError, MaxRetryError, ResponseError
+
+logger = logging.getLogger("spotify_http")
+
+
+class PoolMetrics:
+    """Esperas por conexión y reutilización de los pools de un adapter."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: List[HTTPConnectionPool] = []
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.exhausted = 0
+
+    def register(self, pool: HTTPConnectionPool):
+        with self._lock:
+            self._pools.append(pool)
+
+    def record_checkout(self, waited: float, blocked: bool):
+        with self._lock:
+            self.checkouts += 1
+            if blocked:
+                self.waits += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def record_exhausted(self):
+        with self._lock:
+            self.exhausted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hosts = {}
+            for pool in self._pools:
+                # num_connections: conexiones abiertas; num_requests: peticiones servidas
+                stats = hosts.setdefault(pool.host, {'connections_opened': 0, 'requests': 0, 'idle': 0})
+                stats['connections_opened'] += pool.num_connections
+                stats['requests'] += pool.num_requests
+                stats['idle'] += pool.pool.qsize() if pool.pool is not None else 0
+            for stats in hosts.values():
+                reused = stats['requests'] - stats['connections_opened']
+                stats['reuse_rate'] = round(reused / stats['requests'], 4) if stats['requests'] else 0.0
+            return {
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'avg_wait_ms': round(self.wait_total / self.waits * 1000, 1) if self.waits else 0.0,
+                'max_wait_ms': round(self.wait_max * 1000, 1),
+                'exhausted': self.exhausted,
+                'hosts': hosts
+            }
+
+
+def _metered_pool_class(base, metrics: PoolMetrics, pool_timeout: float):
+    """Subclase de un pool de urllib3 que mide cuánto espera cada checkout."""
+
+    class MeteredPool(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            metrics.register(self)
+
+        def _get_conn(self, timeout=None):
+            # Sin conexiones libres no se crea otra: se espera (pool_block) hasta pool_timeout
+            blocked = self.pool is not None and self.pool.empty()
+            started = time.monotonic()
+            try:
+                conn = super()._get_conn(timeout=pool_timeout if timeout is None else timeout)
+            except EmptyPoolError:
+                metrics.record_exhausted()
+                raise
+            metrics.record_checkout(time.monotonic() - started, blocked)
+            return conn
+
+    MeteredPool.__name__ = f"Metered{base.__name__}"
+    return MeteredPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter con pool por host acotado (`pool_block`): bajo concurrencia los
+    hilos esperan una conexión keep-alive libre en lugar de abrir y descartar
+    conexiones nuevas. Las esperas quedan en `metrics`.
+    """
+
+    def __init__(self, pool_size: int, pool_timeout: float, max_retries, **kwargs):
+        self.metrics = PoolMetrics()
+        self._pool_timeout = pool_timeout
+        super().__init__(
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=max_retries,
+            **kwargs
+        )
+
+    def send(self, request, *args, **kwargs):
+        try:
+            return super().send(request, *args, **kwargs)
+        except EmptyPoolError:
+            raise requests.exceptions.ConnectTimeout(
+                f"Sin conexiones libres tras {self._pool_timeout}s", request=request
+            )
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _metered_pool_class(HTTPConnectionPool, self.metrics, self._pool_timeout),
+            'https': _metered_pool_class(HTTPSConnectionPool, self.metrics, self._pool_timeout)
+        }
+
+
+class DeadlineRetry(urllib3.Retry):
+    """
+    Retry de urllib3 que no duerme más allá del presupuesto de la llamada.
+
+    La espera entre intentos (Retry-After o backoff) se acota a `max_retry_after`
+    y, si no cabe en el deadline fijado con `retry_deadline()` en el hilo, se deja
+    de reintentar y se devuelve la respuesta de error (429/5xx) al llamador.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, *args, max_retry_after: float = 5.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kw):
+        kw.setdefault('max_retry_after', self.max_retry_after)
+        return super().new(**kw)
+
+    def _next_wait(self, response) -> float:
+        retry_after = self.get_retry_after(response) if self.respect_retry_after_header else None
+        if retry_after:
+            return min(retry_after, self.max_retry_after)
+        return self.get_backoff_time()
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        deadline = getattr(self._local, 'deadline', None)
+        if response is not None and deadline is not None:
+            if new_retry._next_wait(response) >= deadline - time.monotonic():
+                # Con raise_on_status=False urllib3 devuelve la respuesta tal cual
+                raise MaxRetryError(_pool, url, ResponseError(f"Sin presupuesto para reintentar ({response.status})"))
+        return new_retry
+
+    def sleep_for_retry(self, response) -> bool:
+        retry_after = self.get_retry_after(response)
+        if retry_after:
+            time.sleep(min(retry_after, self.max_retry_after))
+            return True
+        return False
+
+
+@contextmanager
+def retry_deadline(seconds: Optional[float]):
+    """Acota los reintentos de DeadlineRetry del hilo actual a los próximos `seconds`."""
+    previous = getattr(DeadlineRetry._local, 'deadline', None)
+    DeadlineRetry._local.deadline = None if seconds is None else time.monotonic() + seconds
+    try:
+        yield
+    finally:
+        DeadlineRetry._local.deadline = previous
+
+
+def build_session(
+    pool_size: int = 40,
+    pool_timeout: float = 10.0,
+    retries: int = 3,
+    retry: Optional[urllib3.Retry] = None
+) -> requests.Session:
+    """
+    Sesión de requests compartible entre hilos para la API de Spotify.
+
+    Reproduce la política de reintentos de spotipy (que no la monta cuando se le
+    pasa una sesión propia) sobre un PooledHTTPAdapter, salvo que se pase `retry`;
+    las esperas por 429/5xx respetan el deadline de `retry_deadline()`.
+    """
+    retry = retry or DeadlineRetry(
+        total=retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=retries,
+        backoff_factor=0.3,
+        status_forcelist=spotipy.Spotify.default_retry_codes,
+        respect_retry_after_header=True,
+        # Agotados los reintentos se devuelve el último 429/5xx (spotipy lo convierte en SpotifyException)
+        raise_on_status=False,
+        max_retry_after=float(os.getenv('SPOTIFY_MAX_RETRY_AFTER', '5'))
+    )
+    adapter = PooledHTTPAdapter(pool_size=pool_size, pool_timeout=pool_timeout, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def session_metrics(session: requests.Session) -> Dict[str, Any]:
+    adapter = session.get_adapter('https://')
+    if isinstance(adapter, PooledHTTPAdapter):
+        return {'pool_size': adapter._pool_maxsize, **adapter.metrics.stats()}
+    return {}
+
+
+class ThreadSafeClientCredentials(SpotifyClientCredentials):
+    """
+    Client Credentials con refresco de token serializado: cuando el token vence
+    sólo un hilo lo pide y el resto reutiliza el resultado.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = threading.Lock()
+
+    def get_access_token(self, as_dict=True, check_cache=True):
+        if check_cache:
+            token_info = self.cache_handler.get_cached_token()
+            if token_info and not self.is_token_expired(token_info):
+                return token_info if as_dict else token_info["access_token"]
+        with self._token_lock:
+            return super().get_access_token(as_dict=as_dict, check_cache=check_cache)
+
+
+# Sesión compartida por los clientes de Client Credentials
+spotify_session = build_session(
+    pool_size=int(os.getenv('SPOTIFY_HTTP_POOL_SIZE', '40')),
+    pool_timeout=float(os.getenv('SPOTIFY_HTTP_POOL_TIMEOUT', '10'))
+)
+
+# Sesión compartida por las operaciones con token de usuario (api.spotify.com
+# y accounts.spotify.com, con pool por host). Sin reintentos de lectura ni por
+# estado: crear playlists, agregar canciones o canjear un código no son idempotentes.
+spotify_user_session = build_session(
+    pool_size=int(os.getenv('SPOTIFY_USER_HTTP_POOL_SIZE', '20')),
+    pool_timeout=float(os.getenv('SPOTIFY_HTTP_POOL_TIMEOUT', '10')),
+    # Sólo reintentar la conexión (p. ej. una keep-alive que el servidor cerró
+    # mientras esperaba en el pool): nunca se reenvía el cuerpo de un POST
+    retry=urllib3.Retry(total=1, connect=1, read=False, status=0, redirect=0)
+)
@@ -0,0 +1,321 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+logger = logging.getLogger("spotify_scheduler")
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+LANES = (INTERACTIVE, BACKGROUND)
+
+
+class _LaneStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.waiting = 0
+        self.granted = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class SpotifyScheduler:
+    """
+    Reparte la cuota de Spotify (conexiones simultáneas y peticiones por segundo)
+    entre dos carriles de prioridad.
+
+    - interactive: peticiones de usuarios; siempre se atienden primero.
+    - background: precargas, enriquecimiento, snapshots... Solo usan el sobrante:
+      no entran mientras haya peticiones interactivas esperando, ocupan como mucho
+      `background_share` de las conexiones y no bajan los tokens del bucket por
+      debajo de la reserva interactiva.
+
+    El carril se define por hilo con `lane()`; por defecto es interactive.
+    Las corrutinas piden turno con `aslot()` sin bloquear el event loop; hilos y
+    corrutinas en espera se despiertan igual con cada release().
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        rate_per_second: float = 20.0,
+        background_share: float = 0.5,
+        preempt_queue: int = 1
+    ):
+        self.max_concurrency = max_concurrency
+        self.rate_per_second = rate_per_second
+        self.background_share = background_share
+        self.preempt_queue = preempt_queue
+        self._background_slots = max(1, int(max_concurrency * background_share))
+        self._cond = threading.Condition()
+        # Corrutinas en espera: future -> su event loop (release() las resuelve desde cualquier hilo)
+        self._async_waiters: Dict[asyncio.Future, asyncio.AbstractEventLoop] = {}
+        self.set_rate(rate_per_second)
+        self._local = threading.local()
+        self._lanes: Dict[str, _LaneStats] = {lane: _LaneStats() for lane in LANES}
+        self.preemptions = 0
+
+    def set_rate(self, rate_per_second: float):
+        """Cambia el límite de peticiones por segundo (p. ej. para un lote nocturno)."""
+        with self._cond:
+            self.rate_per_second = rate_per_second
+            self._burst = max(1.0, rate_per_second)
+            self._reserve = self._burst * (1 - self.background_share)
+            self._tokens = self._burst
+            self._refilled_at = time.monotonic()
+            self._notify()
+
+    # ============ CARRIL POR HILO ============
+
+    def current_lane(self) -> str:
+        return getattr(self._local, 'lane', None) or INTERACTIVE
+
+    @contextmanager
+    def lane(self, name: str):
+        """Ejecuta el bloque en el carril indicado."""
+        if name not in LANES:
+            raise ValueError(f"Carril desconocido: {name}")
+        previous = getattr(self._local, 'lane', None)
+        self._local.lane = name
+        try:
+            yield
+        finally:
+            self._local.lane = previous
+
+    def bind(self, fn: Callable[[], Any]) -> Callable[[], Any]:
+        """Envuelve `fn` para que corra en el carril actual aunque la ejecute otro hilo."""
+        name = self.current_lane()
+
+        def run():
+            with self.lane(name):
+                return fn()
+        return run
+
+    # ============ ADMISIÓN ============
+
+    def _refill(self, now: float):
+        if self.rate_per_second <= 0:
+            return
+        self._tokens = min(self._burst, self._tokens + (now - self._refilled_at) * self.rate_per_second)
+        self._refilled_at = now
+
+    def _admissible(self, name: str) -> bool:
+        in_flight = sum(stats.in_flight for stats in self._lanes.values())
+        has_tokens = self.rate_per_second <= 0 or self._tokens >= 1.0
+        if name == INTERACTIVE:
+            return in_flight < self.max_concurrency and has_tokens
+        return (
+            self._lanes[INTERACTIVE].waiting == 0
+            and self._lanes[BACKGROUND].in_flight < self._background_slots
+            and in_flight < self.max_concurrency
+            and (self.rate_per_second <= 0 or self._tokens >= self._reserve + 1.0)
+        )
+
+    def _next_check(self, name: str) -> Optional[float]:
+        """
+        Segundos hasta que el bucket pueda admitir al carril, o None si lo que
+        falta es una conexión libre (sólo un release() puede cambiarlo).
+        """
+        if self.rate_per_second <= 0:
+            return None
+        needed = 1.0 if name == INTERACTIVE else self._reserve + 1.0
+        if self._tokens >= needed:
+            return None
+        return max(0.005, (needed - self._tokens) / self.rate_per_second)
+
+    def _wait_time(self, name: str, now: float, deadline: Optional[float]) -> Optional[float]:
+        wait = self._next_check(name)
+        if deadline is not None:
+            wait = deadline - now if wait is None else min(wait, deadline - now)
+        return wait
+
+    def _notify(self):
+        """Despierta a todos los que esperan turno, hilos y corrutinas (con el lock tomado)."""
+        self._cond.notify_all()
+        for future, loop in self._async_waiters.items():
+            try:
+                loop.call_soon_threadsafe(self._wake, future)
+            except RuntimeError:
+                pass  # event loop cerrado
+
+    @staticmethod
+    def _wake(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """
+        Espera un turno en el carril actual.
+
+        Returns:
+            Segundos esperados
+
+        Raises:
+            requests.exceptions.Timeout si no hubo turno dentro de `timeout`
+        """
+        name = self.current_lane()
+        stats = self._lanes[name]
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+
+        with self._cond:
+            stats.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._admissible(name):
+                        break
+                    if deadline is not None and now >= deadline:
+                        stats.timeouts += 1
+                        raise requests.exceptions.Timeout(f"Sin turno para Spotify ({name})")
+                    self._cond.wait(self._wait_time(name, now, deadline))
+            finally:
+                self._leave_queue(name, stats)
+
+            return self._grant(stats, started)
+
+    def _grant(self, stats: _LaneStats, started: float) -> float:
+        """Registra el turno concedido (con el lock tomado); retorna los segundos esperados."""
+        if self.rate_per_second > 0:
+            self._tokens -= 1.0
+        stats.in_flight += 1
+        stats.granted += 1
+        waited = time.monotonic() - started
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+        return waited
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> float:
+        """
+        Igual que acquire() pero sin bloquear el event loop: la corrutina espera
+        un future que release() resuelve con loop.call_soon_threadsafe, así que
+        compite por el turno igual que los hilos.
+        """
+        loop = asyncio.get_running_loop()
+        name = self.current_lane()
+        stats = self._lanes[name]
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+
+        with self._cond:
+            stats.waiting += 1
+        granted = False
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._admissible(name):
+                        self._leave_queue(name, stats)
+                        granted = True
+                        return self._grant(stats, started)
+                    if deadline is not None and now >= deadline:
+                        stats.timeouts += 1
+                        raise requests.exceptions.Timeout(f"Sin turno para Spotify ({name})")
+                    wait = self._wait_time(name, now, deadline)
+                    # Registrado con el lock tomado: un release() posterior lo resuelve
+                    future = loop.create_future()
+                    self._async_waiters[future] = loop
+                try:
+                    await asyncio.wait_for(future, timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._cond:
+                        self._async_waiters.pop(future, None)
+        finally:
+            if not granted:
+                with self._cond:
+                    self._leave_queue(name, stats)
+
+    def _leave_queue(self, name: str, stats: _LaneStats):
+        stats.waiting -= 1
+        if name == INTERACTIVE and stats.waiting == 0:
+            # Despierta al trabajo en segundo plano que estaba cediendo
+            self._notify()
+
+    def release(self, name: Optional[str] = None):
+        with self._cond:
+            self._lanes[name or self.current_lane()].in_flight -= 1
+            self._notify()
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None):
+        """Turno para una petición a Spotify; entrega los segundos esperados."""
+        name = self.current_lane()
+        waited = self.acquire(timeout)
+        try:
+            yield waited
+        finally:
+            self.release(name)
+
+    @asynccontextmanager
+    async def aslot(self, timeout: Optional[float] = None):
+        """Versión asíncrona de slot()."""
+        name = self.current_lane()
+        waited = await self.acquire_async(timeout)
+        try:
+            yield waited
+        finally:
+            self.release(name)
+
+    # ============ PREEMPCIÓN ============
+
+    def should_yield(self) -> bool:
+        """True si el trabajo en segundo plano debe ceder ante la cola interactiva."""
+        if self.current_lane() != BACKGROUND:
+            return False
+        with self._cond:
+            return self._lanes[INTERACTIVE].waiting >= self.preempt_queue
+
+    def yield_to_interactive(self, max_wait: float = 30.0) -> bool:
+        """
+        Bloquea el trabajo en segundo plano hasta que se vacíe la cola interactiva.
+
+        Returns:
+            True si tuvo que ceder
+        """
+        if not self.should_yield():
+            return False
+        with self._cond:
+            self.preemptions += 1
+            self._cond.wait_for(lambda: self._lanes[INTERACTIVE].waiting == 0, timeout=max_wait)
+        logger.info("⏸️  Trabajo en segundo plano pausado por cola interactiva")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            self._refill(time.monotonic())
+            lanes = {}
+            for name, stats in self._lanes.items():
+                lanes[name] = {
+                    'in_flight': stats.in_flight,
+                    'waiting': stats.waiting,
+                    'granted': stats.granted,
+                    'timeouts': stats.timeouts,
+                    'avg_wait_ms': round(stats.wait_total / stats.granted * 1000, 1) if stats.granted else 0.0,
+                    'max_wait_ms': round(stats.wait_max * 1000, 1)
+                }
+            return {
+                'max_concurrency': self.max_concurrency,
+                'background_slots': self._background_slots,
+                'rate_per_second': self.rate_per_second,
+                'tokens': round(self._tokens, 2) if self.rate_per_second > 0 else None,
+                'preemptions': self.preemptions,
+                'lanes': lanes
+            }
+
+
+# Instancia global
+spotify_scheduler = SpotifyScheduler(
+    max_concurrency=int(os.getenv('SPOTIFY_MAX_CONCURRENCY', '16')),
+    rate_per_second=float(os.getenv('SPOTIFY_RATE_LIMIT', '20')),
+    background_share=float(os.getenv('SPOTIFY_BACKGROUND_SHARE', '0.5'))
+)
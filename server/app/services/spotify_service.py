@@ -2,80 +2,89 @@ import os
 import random
 import logging
 import time
-from typing import Dict, List, Optional, Any, Set
+import threading
+from typing import Dict, List, Optional, Any, Set, Tuple
 from collections import defaultdict
 
+import requests
 import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
 from spotipy.exceptions import SpotifyException
 from dotenv import load_dotenv
 
+from app.services.spotify_hedger import SpotifyHedger
+from app.services.spotify_http import spotify_session, session_metrics, retry_deadline, ThreadSafeClientCredentials
+from app.services.spotify_scheduler import spotify_scheduler, BACKGROUND
+from app.services.emotion_config import emotion_config, QueryPlan
+from app.services.artist_genre_cache import artist_genre_cache
+from app.services.recommendation_pool import recommendation_pool_store, candidate_pool_cache
+from app.services.recent_tracks_filter import recent_tracks_registry
+from app.services.taste_profile import taste_profile_store, TasteProfile
+from app.utils.track_rows import slim_track, track_fingerprint
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("spotify_service")
 
+
+class _BudgetedSpotify(spotipy.Spotify):
+    """
+    Cliente spotipy cuyo timeout puede acotarse por hilo.
+    spotipy usa `self.requests_timeout` en cada llamada, así que lo exponemos
+    como propiedad para que cada petición use el presupuesto que le queda.
+    Cada petición pide turno al scheduler según el carril del hilo, y los
+    reintentos por 429/5xx de la sesión no duermen más allá de ese timeout.
+    """
+
+    _local = threading.local()
+
+    @property
+    def requests_timeout(self):
+        override = getattr(self._local, 'timeout', None)
+        return override if override is not None else self._default_timeout
+
+    @requests_timeout.setter
+    def requests_timeout(self, value):
+        self._default_timeout = value
+
+    def set_call_timeout(self, timeout: Optional[float]):
+        self._local.timeout = timeout
+
+    def _internal_call(self, method, url, payload, params):
+        timeout = self.requests_timeout
+        with spotify_scheduler.slot(timeout=timeout) as waited:
+            if not waited:
+                with retry_deadline(timeout):
+                    return super()._internal_call(method, url, payload, params)
+            # La espera por turno se descuenta del timeout de la petición
+            previous = getattr(self._local, 'timeout', None)
+            self._local.timeout = max(0.1, timeout - waited)
+            try:
+                with retry_deadline(self._local.timeout):
+                    return super()._internal_call(method, url, payload, params)
+            finally:
+                self._local.timeout = previous
+
+
 class SpotifyService:
     """
     Servicio mejorado para obtener recomendaciones musicales diversificadas por emoción.
     """
 
-    EMOTION_DESCRIPTORS = {
-        'HAPPY': {
-            'moods': ['happy', 'upbeat', 'cheerful', 'joyful', 'energetic', 'fun', 'party', 'celebration', 'summer', 'feel good'],
-            'genres': ['pop', 'dance', 'disco', 'funk', 'indie pop', 'electropop', 'reggaeton', 'latin', 'house', 'tropical'],
-            'artists': ['Dua Lipa', 'The Weeknd', 'Bruno Mars', 'Daft Punk', 'Lizzo', 'Mark Ronson']
-        },
-        'SAD': {
-            'moods': ['sad', 'melancholic', 'emotional', 'heartbreak', 'lonely', 'nostalgic', 'somber', 'blue', 'rainy'],
-            'genres': ['indie', 'acoustic', 'singer-songwriter', 'alternative', 'folk', 'soul', 'blues'],
-            'artists': ['Billie Eilish', 'Lana Del Rey', 'Bon Iver', 'Adele', 'Sam Smith']
-        },
-        'ANGRY': {
-            'moods': ['angry', 'aggressive', 'intense', 'powerful', 'fierce', 'raw', 'rebellious'],
-            'genres': ['rock', 'metal', 'punk', 'hard rock', 'rap', 'electronic', 'nu metal'],
-            'artists': ['Rage Against The Machine', 'Linkin Park', 'Metallica', 'Eminem']
-        },
-        'CALM': {
-            'moods': ['calm', 'peaceful', 'relaxing', 'chill', 'tranquil', 'ambient', 'lofi', 'meditation'],
-            'genres': ['ambient', 'acoustic', 'chillout', 'lo-fi', 'instrumental', 'jazz', 'classical'],
-            'artists': ['Nils Frahm', 'Ólafur Arnalds', 'Bonobo', 'Tycho']
-        },
-        'SURPRISED': {
-            'moods': ['surprising', 'exciting', 'dynamic', 'electric', 'vibrant', 'unexpected'],
-            'genres': ['electronic', 'edm', 'pop', 'dance', 'synthpop', 'electro'],
-            'artists': ['Daft Punk', 'Justice', 'Calvin Harris', 'Disclosure']
-        },
-        'FEAR': {
-            'moods': ['dark', 'mysterious', 'haunting', 'eerie', 'dramatic', 'suspense'],
-            'genres': ['alternative', 'indie', 'electronic', 'ambient', 'experimental', 'darkwave'],
-            'artists': ['Radiohead', 'Nine Inch Nails', 'Massive Attack']
-        },
-        'DISGUSTED': {
-            'moods': ['gritty', 'raw', 'intense', 'harsh', 'aggressive', 'edgy'],
-            'genres': ['grunge', 'alternative', 'punk', 'industrial', 'noise rock'],
-            'artists': ['Nirvana', 'Nine Inch Nails', 'Soundgarden']
-        },
-        'CONFUSED': {
-            'moods': ['experimental', 'unusual', 'eclectic', 'psychedelic', 'abstract', 'weird'],
-            'genres': ['alternative', 'indie', 'experimental', 'psychedelic', 'art rock', 'progressive'],
-            'artists': ['Radiohead', 'Tame Impala', 'Pink Floyd', 'Björk']
-        }
-    }
-
-    # Filtros MÁS RELAJADOS
-    EMOTION_FEATURE_FILTERS = {
-        'HAPPY': {'min_valence': 0.45, 'min_energy': 0.40, 'tempo_range': (80, 160)},
-        'SAD':   {'max_valence': 0.60, 'max_energy': 0.65, 'tempo_range': (40, 110)},
-        'ANGRY': {'min_energy': 0.60, 'tempo_range': (90, 190)},
-        'CALM':  {'max_energy': 0.55, 'max_tempo': 120},
-        'SURPRISED': {'min_valence': 0.45, 'min_energy': 0.50, 'tempo_range': (90, 170)},
-        'FEAR': {'min_energy': 0.35, 'max_valence': 0.55, 'tempo_range': (50, 130)},
-        'DISGUSTED': {'min_energy': 0.50, 'tempo_range': (70, 150)},
-        'CONFUSED': {'tempo_range': (60, 150)}
-    }
+    # Descriptores, filtros y mercados por defecto viven en app/config/emotions.json
+    # (ver emotion_config); se recargan en caliente sin reiniciar el servidor.
 
-    DEFAULT_MARKETS = ['US', 'GB', 'ES', 'MX', 'AR', 'CO', 'BR', 'FR', 'DE']
+    # Presupuesto total (segundos) para una llamada a get_recommendations
+    RECOMMENDATION_BUDGET_SECONDS = float(os.getenv('SPOTIFY_RECOMMENDATION_BUDGET', '1.5'))
+    REQUEST_TIMEOUT = 15
+    # Por debajo de este margen no vale la pena lanzar otra llamada
+    MIN_CALL_TIMEOUT = 0.1
+    # Tamaño mínimo para compartir un pool parcial (recortado por el presupuesto)
+    MIN_SHARED_POOL_SIZE = 100
+    # Búsquedas género + mood del plan que se lanzan por pool
+    SEARCH_QUERIES_PER_POOL = 24
+    # Peso del perfil de gustos del usuario en el orden final
+    TASTE_WEIGHT = 0.4
 
     def __init__(self, markets: Optional[List[str]] = None):
         client_id = os.getenv('SPOTIFY_CLIENT_ID')
@@ -84,18 +93,28 @@ class SpotifyService:
             raise ValueError("SPOTIFY_CLIENT_ID / SPOTIFY_CLIENT_SECRET no definidos")
 
         # Client Credentials (sin audio_features pero más simple)
-        self.auth_manager = SpotifyClientCredentials(
+        self.auth_manager = ThreadSafeClientCredentials(
             client_id=client_id, 
-            client_secret=client_secret
+            client_secret=client_secret,
+            requests_session=spotify_session
         )
         
-        self.sp = spotipy.Spotify(
+        # Sesión compartida entre los hilos del threadpool (pool keep-alive dimensionado)
+        self.sp = _BudgetedSpotify(
             auth_manager=self.auth_manager, 
-            requests_timeout=15, 
+            requests_session=spotify_session,
+            requests_timeout=self.REQUEST_TIMEOUT, 
             retries=3
         )
-        self.markets = markets or self.DEFAULT_MARKETS
+        self._markets = markets
+        self.hedger = SpotifyHedger(
+            enabled=os.getenv('SPOTIFY_HEDGING', 'false').lower() == 'true',
+            max_hedge_ratio=float(os.getenv('SPOTIFY_HEDGE_MAX_RATIO', '0.1')),
+            # Cada turno del scheduler puede tener su llamada y su duplicado en curso
+            max_workers=spotify_scheduler.max_concurrency * 2
+        )
         self._audio_features_available = False  # Marcado como False para Client Credentials
+        emotion_config.add_listener(self._on_config_change)
         
         # Test de conexión
         try:
@@ -130,44 +149,188 @@ class SpotifyService:
             self._audio_features_available = False
             logger.warning(f"⚠ Audio features no disponible: {e}")
 
+    # ============ CONFIGURACIÓN POR EMOCIÓN ============
+
+    @property
+    def EMOTION_DESCRIPTORS(self) -> Dict[str, Dict]:
+        return emotion_config.current().descriptors
+
+    @property
+    def EMOTION_FEATURE_FILTERS(self) -> Dict[str, Dict]:
+        return emotion_config.current().filters
+
+    @property
+    def markets(self) -> List[str]:
+        return self._markets or emotion_config.current().default_markets
+
+    def _query_plan(self, emotion: str, genres: Optional[List[str]] = None) -> QueryPlan:
+        """Plan precompilado de la emoción; con géneros propios se compila al vuelo."""
+        state = emotion_config.current()
+        plan = state.plans[emotion]
+        if not genres or genres == plan.genres:
+            return plan
+        descriptors = state.descriptors[emotion]
+        return QueryPlan(emotion, genres, descriptors['moods'], descriptors['artists'])
+
+    def _on_config_change(self, changed: Set[str]):
+        """
+        Invalida sólo los pools de las emociones cuyo plan cambió y los vuelve a
+        calentar en segundo plano para los mercados que estaban en caché.
+        """
+        if not changed:
+            return
+        markets: Set[str] = set()
+        for emotion in changed:
+            markets.update(market for _, market in candidate_pool_cache.invalidate(emotion=emotion))
+        logger.info(f"🧹 Pools invalidados por cambio de configuración: {sorted(changed)}")
+
+        emotions = [e for e in changed if e in emotion_config.current().plans]
+        if markets and emotions:
+            threading.Thread(
+                target=self.preload_pools,
+                args=(sorted(markets), emotions),
+                name="pool-rewarm",
+                daemon=True
+            ).start()
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> float:
+        """Segundos que quedan hasta el deadline (infinito si no hay)."""
+        if deadline is None:
+            return float('inf')
+        return deadline - time.monotonic()
+
+    def _has_budget(self, deadline: Optional[float]) -> bool:
+        return self._remaining(deadline) > self.MIN_CALL_TIMEOUT
+
+    def _call(self, deadline: Optional[float], fn, *args, **kwargs):
+        """
+        Ejecuta una llamada de spotipy con el timeout derivado del presupuesto restante.
+        Lanza requests.exceptions.Timeout si ya no queda presupuesto.
+        """
+        remaining = self._remaining(deadline)
+        if remaining <= self.MIN_CALL_TIMEOUT:
+            raise requests.exceptions.Timeout("Presupuesto de la petición agotado")
+
+        self.sp.set_call_timeout(min(self.REQUEST_TIMEOUT, remaining))
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.sp.set_call_timeout(None)
+
+    def _hedged_call(
+        self,
+        kind: str,
+        deadline: Optional[float],
+        market: str,
+        fn,
+        hedge_markets: Optional[List[str]] = None
+    ):
+        """
+        Ejecuta `fn(market)` con hedging: si tarda más que el p90 de `kind`,
+        lanza un duplicado (en otro de `hedge_markets` si hay) y gana el primero.
+        """
+        alternatives = [m for m in (hedge_markets or self.markets) if m != market] or [market]
+        alt_market = random.choice(alternatives)
+        # Los hilos del hedger heredan el carril del que hace la llamada
+        hedge = spotify_scheduler.bind(lambda: self._call(deadline, fn, alt_market))
+
+        remaining = self._remaining(deadline)
+        return self.hedger.run(
+            kind,
+            spotify_scheduler.bind(lambda: self._call(deadline, fn, market)),
+            hedge,
+            timeout=None if remaining == float('inf') else remaining
+        )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Métricas del cliente de Spotify."""
+        return {
+            'hedging': self.hedger.stats(),
+            'scheduler': spotify_scheduler.stats(),
+            'http_pool': session_metrics(spotify_session),
+            'emotion_config': emotion_config.stats(),
+            'recommendation_pools': recommendation_pool_store.stats(),
+            'candidate_pools': candidate_pool_cache.stats(),
+            'recent_tracks': recent_tracks_registry.stats()
+        }
+
+    def _pause(self, seconds: float, deadline: Optional[float]):
+        """Pausa entre llamadas sin consumir más presupuesto del que queda."""
+        time.sleep(max(0.0, min(seconds, self._remaining(deadline))))
+
     def get_recommendations(
         self,
         emotion: str,
         limit: int = 20,
         preferred_genres: Optional[List[str]] = None,
-        markets: Optional[List[str]] = None
+        markets: Optional[List[str]] = None,
+        budget_seconds: Optional[float] = None,
+        user_id: Optional[str] = None,
+        market: Optional[str] = None,
+        extra_candidates: Optional[List[Dict]] = None
     ) -> Dict[str, Any]:
         """
         Obtiene recomendaciones diversificadas para una emoción.
+
+        La recolección se corta al agotar `budget_seconds` y se diversifica con los
+        candidatos obtenidos hasta ese momento; `complete` indica si hubo recorte.
+        Con `market` todas las búsquedas van a ese mercado y el pool de candidatos
+        se comparte (con TTL) entre usuarios del mismo mercado y emoción.
+        Los candidatos no servidos quedan en un pool accesible con el `cursor`
+        de la respuesta (ver get_more_recommendations).
+        `extra_candidates` (p. ej. de la biblioteca del usuario) se suman al pool
+        del usuario sin entrar en el pool compartido.
         """
         start = time.time()
+        budget = budget_seconds if budget_seconds is not None else self.RECOMMENDATION_BUDGET_SECONDS
+        deadline = time.monotonic() + budget
         emotion = emotion.upper()
         
-        if emotion not in self.EMOTION_DESCRIPTORS:
+        config = emotion_config.current()
+        if emotion not in config.descriptors:
             raise ValueError(f"Emoción desconocida: {emotion}")
 
-        descriptors = self.EMOTION_DESCRIPTORS[emotion]
-        filters = self.EMOTION_FEATURE_FILTERS.get(emotion, {})
-        markets_to_use = markets or self.markets
+        descriptors = config.descriptors[emotion]
+        filters = config.filters.get(emotion, {})
+        markets_to_use = [market] if market else (markets or self.markets)
         genres_to_use = preferred_genres or descriptors.get('genres', [])
+        # Sólo los pools con los géneros por defecto se comparten entre usuarios
+        shared_pool = market is not None and not preferred_genres
 
-        logger.info(f"🎵 Buscando {limit} canciones para '{emotion}'")
+        logger.info(f"🎵 Buscando {limit} canciones para '{emotion}' (mercado: {market or 'aleatorio'})")
         logger.info(f"Géneros: {genres_to_use[:5]}...")
 
-        # 1) RECOLECCIÓN MASIVA Y DIVERSIFICADA
-        candidates = self._collect_diverse_candidates(
-            emotion=emotion,
-            genres=genres_to_use,
-            descriptors=descriptors,
-            markets=markets_to_use,
-            target_count=limit * 15  # Recolectar 15x más para diversificar
-        )
+        # 1) RECOLECCIÓN MASIVA Y DIVERSIFICADA (o pool compartido del mercado)
+        candidates = None
+        complete = True
+        if shared_pool:
+            candidates = candidate_pool_cache.get(emotion, market, min_size=limit * 2)
+            if candidates is not None:
+                logger.info(f"📦 Pool en caché para {emotion}/{market}: {len(candidates)} candidatos")
 
-        logger.info(f"📊 Recolectados {len(candidates)} candidatos únicos")
+        if candidates is None:
+            candidates, complete = self.build_candidate_pool(
+                emotion=emotion,
+                genres=genres_to_use,
+                markets=markets_to_use,
+                target_count=limit * 15,  # Recolectar 15x más para diversificar
+                deadline=deadline
+            )
+            if not complete:
+                logger.warning(f"⏱️  Presupuesto de {budget:.2f}s agotado, usando resultados parciales")
+            if shared_pool and (complete or len(candidates) >= self.MIN_SHARED_POOL_SIZE):
+                candidate_pool_cache.put(emotion, market, candidates)
+
+        if extra_candidates:
+            known = {t['id'] for t in candidates}
+            extra = [t for t in extra_candidates if t.get('id') and t['id'] not in known]
+            candidates = candidates + extra
+            logger.info(f"📚 {len(extra)} candidatos propios del usuario")
 
         # 2) FILTRADO SUAVE (solo si audio_features está disponible)
         if self._audio_features_available and len(candidates) > limit * 3:
-            filtered = self._filter_tracks_by_features(candidates, filters)
+            filtered = self._filter_tracks_by_features(candidates, filters, deadline=deadline)
             logger.info(f"✓ {len(filtered)} pasaron filtros de audio")
         elif not self._audio_features_available:
             filtered = candidates
@@ -177,22 +340,37 @@ class SpotifyService:
             logger.info(f"⏭️  Omitiendo filtros (pocos candidatos)")
 
         # 3) DIVERSIFICACIÓN INTELIGENTE
+        pool_tracks = filtered if filtered else candidates
         final_tracks = self._diversify_tracks(
-            filtered if filtered else candidates,
-            limit=limit
+            recent_tracks_registry.exclude_recent(user_id, pool_tracks, min_keep=limit),
+            limit=limit,
+            taste=taste_profile_store.get(user_id)
         )
 
         logger.info(f"🎯 Seleccionadas {len(final_tracks)} canciones diversificadas")
 
         # 4) PROCESAR Y ENRIQUECER
-        processed = []
-        for track in final_tracks:
-            proc = self._process_track(track)
-            if proc:
-                processed.append(proc)
+        processed = self._process_tracks(final_tracks)
 
         # 5) ANÁLISIS DE CARACTERÍSTICAS
-        avg_features = self._analyze_track_features([t['id'] for t in processed])
+        avg_features = self._analyze_track_features([t['id'] for t in processed], deadline=deadline)
+        music_params = {
+            'valence': f"{avg_features.get('valence', 0.5):.2f}",
+            'energy': f"{avg_features.get('energy', 0.5):.2f}",
+            'tempo': f"{int(avg_features.get('tempo', 100))} BPM",
+            'mode': avg_features.get('mode_text', 'Mixto')
+        }
+
+        recent_tracks_registry.record(user_id, [t['id'] for t in processed])
+
+        # 6) POOL PARA PÁGINAS SIGUIENTES
+        cursor = recommendation_pool_store.create(
+            user_id=user_id,
+            emotion=emotion,
+            tracks=pool_tracks,
+            served_ids=[t['id'] for t in processed],
+            extra={'genres_used': genres_to_use[:5], 'music_params': music_params}
+        )
 
         elapsed = time.time() - start
         logger.info(f"✓ Completado en {elapsed:.2f}s")
@@ -202,107 +380,380 @@ class SpotifyService:
             'emotion': emotion,
             'tracks': processed,
             'total': len(processed),
+            'complete': complete,
+            'cursor': cursor,
             'genres_used': genres_to_use[:5],
-            'music_params': {
-                'valence': f"{avg_features.get('valence', 0.5):.2f}",
-                'energy': f"{avg_features.get('energy', 0.5):.2f}",
-                'tempo': f"{int(avg_features.get('tempo', 100))} BPM",
-                'mode': avg_features.get('mode_text', 'Mixto')
-            }
+            'music_params': music_params
         }
 
-    def _collect_diverse_candidates(
+    def build_candidate_pool(
         self,
         emotion: str,
-        genres: List[str],
-        descriptors: Dict,
         markets: List[str],
-        target_count: int = 300
+        genres: Optional[List[str]] = None,
+        target_count: int = 300,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Recolecta candidatos, les agrega géneros y los reduce a los campos necesarios.
+        Sin `genres` usa el plan precompilado de la emoción. Retorna (tracks, completo).
+        """
+        candidates, complete = self._collect_diverse_candidates(
+            plan=self._query_plan(emotion, genres),
+            markets=markets,
+            target_count=target_count,
+            deadline=deadline
+        )
+
+        logger.info(f"📊 Recolectados {len(candidates)} candidatos únicos")
+
+        # Géneros reales por artista (la búsqueda de tracks no los incluye)
+        self._enrich_artist_genres(candidates, deadline=deadline)
+
+        return [slim_track(t) for t in candidates if t.get('id')], complete
+
+    def preload_pools(
+        self,
+        markets: List[str],
+        emotions: Optional[List[str]] = None,
+        budget_seconds: float = 15.0
+    ) -> int:
+        """
+        Precalienta los pools compartidos de los mercados indicados.
+        Corre en el carril background: cede ante la cola interactiva entre pools.
+
+        Returns:
+            Número de pools cargados
+        """
+        loaded = 0
+        with spotify_scheduler.lane(BACKGROUND):
+            for market in markets:
+                for emotion in emotions or list(self.EMOTION_DESCRIPTORS.keys()):
+                    if candidate_pool_cache.get(emotion, market) is not None:
+                        continue
+                    spotify_scheduler.yield_to_interactive()
+                    try:
+                        tracks, _ = self.build_candidate_pool(
+                            emotion=emotion,
+                            markets=[market],
+                            deadline=time.monotonic() + budget_seconds
+                        )
+                    except Exception as e:
+                        logger.warning(f"No se pudo precargar {emotion}/{market}: {e}")
+                        continue
+                    if tracks:
+                        candidate_pool_cache.put(emotion, market, tracks)
+                        loaded += 1
+
+        logger.info(f"🔥 Pools precargados: {loaded} ({', '.join(markets)})")
+        return loaded
+
+    def get_more_recommendations(
+        self,
+        cursor: str,
+        limit: int = 20,
+        user_id: Optional[str] = None,
+        emotion: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Sirve la siguiente página de un pool de candidatos sin llamar a Spotify.
+
+        Returns:
+            Dict con el mismo formato que get_recommendations, o None si el
+            cursor no existe, expiró, pertenece a otro usuario o es de otra
+            emoción (en ese caso el pool no avanza)
+        """
+        pool = recommendation_pool_store.get(cursor, user_id)
+        if pool is None or (emotion is not None and pool.emotion != emotion):
+            return None
+
+        with pool.lock:
+            remaining = pool.remaining()
+            final_tracks = self._diversify_tracks(
+                recent_tracks_registry.exclude_recent(user_id, remaining, min_keep=limit),
+                limit=limit,
+                taste=taste_profile_store.get(user_id)
+            )
+            processed = self._process_tracks(final_tracks)
+            pool.served_ids.update(t['id'] for t in processed)
+            exhausted = not pool.remaining()
+
+        recent_tracks_registry.record(user_id, [t['id'] for t in processed])
+
+        if exhausted:
+            recommendation_pool_store.discard(cursor)
+
+        logger.info(f"📄 Página de {len(processed)} canciones desde pool ({pool.emotion})")
+
+        return {
+            'success': True,
+            'emotion': pool.emotion,
+            'tracks': processed,
+            'total': len(processed),
+            'complete': True,
+            'cursor': None if exhausted else cursor,
+            'genres_used': pool.extra.get('genres_used', []),
+            'music_params': pool.extra.get('music_params')
+        }
+
+    def get_shared_pool(
+        self,
+        emotion: str,
+        market: str,
+        budget_seconds: Optional[float] = None,
+        target_count: int = 300,
+        min_size: int = 0
+    ) -> Tuple[List[Dict], bool]:
+        """
+        Pool compartido de (emoción, mercado): el de la caché (con al menos
+        `min_size` tracks) o, si no hay, uno recolectado ahora con `target_count`
+        candidatos (que queda en caché). Retorna (tracks, desde_caché).
+        """
+        candidates = candidate_pool_cache.get(emotion, market, min_size=min_size)
+        if candidates is not None:
+            return candidates, True
+
+        budget = budget_seconds if budget_seconds is not None else self.RECOMMENDATION_BUDGET_SECONDS
+        candidates, complete = self.build_candidate_pool(
+            emotion=emotion,
+            markets=[market],
+            target_count=target_count,
+            deadline=time.monotonic() + budget
+        )
+        if complete or len(candidates) >= self.MIN_SHARED_POOL_SIZE:
+            candidate_pool_cache.put(emotion, market, candidates)
+        return candidates, False
+
+    def select_tracks(
+        self,
+        candidates: List[Dict],
+        limit: int,
+        user_id: Optional[str] = None,
+        taste: Optional[TasteProfile] = None
     ) -> List[Dict]:
+        """
+        Elige `limit` canciones diversificadas de un pool ya recolectado, sin
+        repetir las recientes del usuario. No llama a Spotify.
+        """
+        final_tracks = self._diversify_tracks(
+            recent_tracks_registry.exclude_recent(user_id, candidates, min_keep=limit),
+            limit=limit,
+            taste=taste
+        )
+        processed = self._process_tracks(final_tracks)
+        recent_tracks_registry.record(user_id, [t['id'] for t in processed])
+        return processed
+
+    def extend_tracks(
+        self,
+        emotion: str,
+        existing_tracks: List[Dict],
+        limit: int = 20,
+        market: Optional[str] = None,
+        user_id: Optional[str] = None,
+        extra_candidates: Optional[List[Dict]] = None,
+        budget_seconds: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Canciones nuevas para ampliar una playlist guardada.
+
+        Se sacan del pool compartido de (emoción, mercado) excluyendo las que ya
+        tiene la playlist (por ID y por huella título + artista), y se ordenan
+        con el perfil de la propia playlist. Sólo si el pool no está en caché se
+        recolecta uno, con el presupuesto normal de recomendaciones.
+
+        Returns:
+            Dict con `tracks` (formato del schema) y `from_cache`
+        """
+        emotion = emotion.upper()
+        if emotion not in emotion_config.current().descriptors:
+            raise ValueError(f"Emoción desconocida: {emotion}")
+        market = market or self.markets[0]
+
+        candidates, from_cache = self.get_shared_pool(
+            emotion,
+            market,
+            budget_seconds,
+            target_count=limit * 15,  # Recolectar 15x más para diversificar
+            min_size=limit * 2
+        )
+
+        existing = [t for t in existing_tracks if isinstance(t, dict)]
+        known_ids = {t.get('id') for t in existing}
+        known_fps = {
+            track_fingerprint({
+                'id': t.get('id'),
+                'name': t.get('name'),
+                'artists': [{'name': n} for n in t.get('artists') or []]
+            })
+            for t in existing
+        }
+        seen = set()
+        fresh = []
+        for track in candidates + (extra_candidates or []):
+            if not track.get('id') or track['id'] in known_ids or track['id'] in seen:
+                continue
+            if track_fingerprint(track) in known_fps:
+                continue
+            seen.add(track['id'])
+            fresh.append(track)
+
+        processed = self.select_tracks(
+            fresh,
+            limit,
+            user_id=user_id,
+            taste=TasteProfile.from_tracks(existing) if existing else None
+        )
+
+        logger.info(
+            f"➕ {len(processed)} canciones para ampliar playlist de {emotion}/{market} "
+            f"({'pool en caché' if from_cache else 'pool nuevo'})"
+        )
+        return {'tracks': processed, 'from_cache': from_cache}
+
+    def _collect_diverse_candidates(
+        self,
+        plan: QueryPlan,
+        markets: List[str],
+        target_count: int = 300,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Dict], bool]:
         """
         Recolecta candidatos de múltiples fuentes con diversificación.
+        Retorna (candidatos, completo); completo es False si se agotó el presupuesto.
         """
         candidates = []
         seen_ids = set()
+        fingerprints = {}
         
-        moods = descriptors.get('moods', [])
-        artists = descriptors.get('artists', [])
-        
-        # ESTRATEGIA 1: Búsqueda por género + mood
-        for genre in random.sample(genres, min(len(genres), 6)):
-            for mood in random.sample(moods, min(len(moods), 4)):
-                if len(candidates) >= target_count:
-                    break
-                    
-                market = random.choice(markets)
-                query = f"{genre} {mood}"
-                
-                # Búsqueda de tracks
-                tracks = self._safe_search_tracks(query, limit=50, market=market)
-                for track in tracks:
-                    if track.get('id') and track['id'] not in seen_ids:
-                        candidates.append(track)
-                        seen_ids.add(track['id'])
+        # ESTRATEGIA 1: Búsqueda por género + mood (muestra de las consultas del plan)
+        queries = plan.search_queries
+        for query in random.sample(queries, min(len(queries), self.SEARCH_QUERIES_PER_POOL)):
+            if len(candidates) >= target_count:
+                break
+            if not self._has_budget(deadline):
+                return candidates, False
                 
-                time.sleep(0.05)
+            market = random.choice(markets)
+            
+            # Búsqueda de tracks
+            tracks = self._safe_search_tracks(
+                query, limit=50, market=market, deadline=deadline, hedge_markets=markets
+            )
+            for track in tracks:
+                self._add_candidate(track, candidates, seen_ids, fingerprints)
+            
+            self._pause(0.05, deadline)
 
         # ESTRATEGIA 2: Playlists curadas
-        playlist_queries = [f"{emotion.lower()} vibes"]
-        playlist_queries.extend([f"best {genre}" for genre in genres[:3]])
-        
-        for query in playlist_queries[:5]:
+        for query in plan.playlist_queries[:5]:
             if len(candidates) >= target_count:
                 break
+            if not self._has_budget(deadline):
+                return candidates, False
                 
             market = random.choice(markets)
-            pl_tracks = self._get_playlist_tracks(query, market=market, limit=30)
+            pl_tracks = self._get_playlist_tracks(
+                query, market=market, limit=30, deadline=deadline, hedge_markets=markets
+            )
             
             for track in pl_tracks:
-                if track.get('id') and track['id'] not in seen_ids:
-                    candidates.append(track)
-                    seen_ids.add(track['id'])
+                self._add_candidate(track, candidates, seen_ids, fingerprints)
             
-            time.sleep(0.05)
+            self._pause(0.05, deadline)
 
         # ESTRATEGIA 3: Por artistas semilla
-        for artist_name in artists[:4]:
+        for artist_name in plan.artist_seeds[:4]:
             if len(candidates) >= target_count:
                 break
+            if not self._has_budget(deadline):
+                return candidates, False
                 
-            artist_tracks = self._get_artist_top_tracks(artist_name)
+            artist_tracks = self._get_artist_top_tracks(
+                artist_name, market=random.choice(markets), deadline=deadline, resolved=plan.artist_ids
+            )
             for track in artist_tracks:
-                if track.get('id') and track['id'] not in seen_ids:
-                    candidates.append(track)
-                    seen_ids.add(track['id'])
+                self._add_candidate(track, candidates, seen_ids, fingerprints)
+
+        return candidates, self._has_budget(deadline)
 
-        return candidates
+    @staticmethod
+    def _add_candidate(
+        track: Dict,
+        candidates: List[Dict],
+        seen_ids: Set[str],
+        fingerprints: Dict[str, int]
+    ) -> None:
+        """
+        Agrega un track a los candidatos colapsando casi-duplicados (remasters,
+        single vs. álbum, "feat.") a la versión más popular. O(1) por track.
+        """
+        track_id = track.get('id')
+        if not track_id or track_id in seen_ids:
+            return
+        seen_ids.add(track_id)
 
-    def _safe_search_tracks(self, query: str, limit: int = 50, market: str = 'US') -> List[Dict]:
+        fp = track_fingerprint(track)
+        index = fingerprints.get(fp)
+        if index is None:
+            fingerprints[fp] = len(candidates)
+            candidates.append(track)
+        elif track.get('popularity', 0) > candidates[index].get('popularity', 0):
+            candidates[index] = track
+
+    def _safe_search_tracks(
+        self,
+        query: str,
+        limit: int = 50,
+        market: str = 'US',
+        deadline: Optional[float] = None,
+        hedge_markets: Optional[List[str]] = None
+    ) -> List[Dict]:
         """Búsqueda de tracks con manejo robusto de errores."""
         try:
-            result = self.sp.search(q=query, type='track', limit=limit, market=market)
+            result = self._hedged_call(
+                'search', deadline, market,
+                lambda m: self.sp.search(q=query, type='track', limit=limit, market=m),
+                hedge_markets=hedge_markets
+            )
             return result.get('tracks', {}).get('items', [])
         except SpotifyException as e:
             logger.warning(f"Search error [{e.http_status}]: {query}")
             return []
+        except requests.exceptions.Timeout:
+            logger.info(f"⏱️  Search sin presupuesto: {query}")
+            return []
         except Exception as e:
             logger.error(f"Unexpected search error: {e}")
             return []
 
-    def _get_playlist_tracks(self, query: str, market: str = 'US', limit: int = 30) -> List[Dict]:
+    def _get_playlist_tracks(
+        self,
+        query: str,
+        market: str = 'US',
+        limit: int = 30,
+        deadline: Optional[float] = None,
+        hedge_markets: Optional[List[str]] = None
+    ) -> List[Dict]:
         """Obtiene tracks de playlists con la query."""
         tracks = []
         try:
             # Buscar playlists
-            result = self.sp.search(q=query, type='playlist', limit=3, market=market)
+            result = self._hedged_call(
+                'search', deadline, market,
+                lambda m: self.sp.search(q=query, type='playlist', limit=3, market=m),
+                hedge_markets=hedge_markets
+            )
             playlists = result.get('playlists', {}).get('items', [])
             
             for playlist in playlists:
+                if not self._has_budget(deadline):
+                    break
                 try:
-                    items = self.sp.playlist_items(
-                        playlist['id'], 
-                        limit=limit, 
-                        market=market
+                    items = self._hedged_call(
+                        'playlist_items', deadline, market,
+                        lambda m, pid=playlist['id']: self.sp.playlist_items(pid, limit=limit, market=m),
+                        hedge_markets=hedge_markets
                     )
                     for item in items.get('items', []):
                         track = item.get('track')
@@ -316,27 +767,94 @@ class SpotifyService:
             
         return tracks
 
-    def _get_artist_top_tracks(self, artist_name: str, market: str = 'US') -> List[Dict]:
-        """Obtiene top tracks de un artista."""
+    def _get_artist_top_tracks(
+        self,
+        artist_name: str,
+        market: str = 'US',
+        deadline: Optional[float] = None,
+        resolved: Optional[Dict[str, Optional[str]]] = None
+    ) -> List[Dict]:
+        """
+        Obtiene top tracks de un artista.
+        `resolved` guarda nombre -> ID para no repetir la búsqueda del artista.
+        """
         try:
-            # Buscar artista
-            result = self.sp.search(q=f"artist:{artist_name}", type='artist', limit=1)
-            artists = result.get('artists', {}).get('items', [])
-            
-            if not artists:
+            if resolved is not None and artist_name in resolved:
+                artist_id = resolved[artist_name]
+            else:
+                # Buscar artista
+                result = self._call(deadline, self.sp.search, q=f"artist:{artist_name}", type='artist', limit=1)
+                artists = result.get('artists', {}).get('items', [])
+                artist_id = artists[0]['id'] if artists else None
+                if resolved is not None:
+                    resolved[artist_name] = artist_id
+
+            if not artist_id:
                 return []
             
-            artist_id = artists[0]['id']
-            
             # Obtener top tracks
-            tops = self.sp.artist_top_tracks(artist_id, country=market)
+            tops = self._call(deadline, self.sp.artist_top_tracks, artist_id, country=market)
             return tops.get('tracks', [])
             
         except Exception as e:
             logger.debug(f"Error obteniendo tracks de artista {artist_name}: {e}")
             return []
 
-    def _filter_tracks_by_features(self, tracks: List[Dict], filters: Dict) -> List[Dict]:
+    def enrich_artist_genres(self, tracks: List[Dict]) -> None:
+        """Agrega `_genres` a tracks completos de Spotify (sin presupuesto; para trabajos en segundo plano)."""
+        self._enrich_artist_genres(tracks)
+
+    def _enrich_artist_genres(self, tracks: List[Dict], deadline: Optional[float] = None) -> None:
+        """
+        Agrega `_genres` a cada track según los géneros de su artista principal.
+        Usa la caché persistente y pide los faltantes a /artists en lotes de 50.
+        """
+        artist_ids = []
+        seen = set()
+        for track in tracks:
+            artists = track.get('artists') or [{}]
+            artist_id = artists[0].get('id')
+            if artist_id and artist_id not in seen:
+                seen.add(artist_id)
+                artist_ids.append(artist_id)
+
+        if not artist_ids:
+            return
+
+        genres_by_artist = artist_genre_cache.get_many(artist_ids)
+        missing = [a for a in artist_ids if a not in genres_by_artist]
+
+        fetched = {}
+        batch_size = 50
+        for i in range(0, len(missing), batch_size):
+            if not self._has_budget(deadline):
+                logger.info(f"⏱️  Sin presupuesto para géneros de {len(missing) - i} artistas")
+                break
+            try:
+                result = self._call(deadline, self.sp.artists, missing[i:i + batch_size])
+                for artist in result.get('artists', []):
+                    if artist and artist.get('id'):
+                        fetched[artist['id']] = artist.get('genres', [])
+            except Exception as e:
+                logger.debug(f"Error obteniendo géneros de artistas: {e}")
+                break
+
+        if fetched:
+            artist_genre_cache.put_many(fetched)
+            genres_by_artist.update(fetched)
+
+        for track in tracks:
+            artists = track.get('artists') or [{}]
+            track['_genres'] = genres_by_artist.get(artists[0].get('id'), [])
+
+        logger.info(f"🏷️  Géneros: {len(genres_by_artist)}/{len(artist_ids)} artistas ({len(fetched)} nuevos)")
+
+    def _filter_tracks_by_features(
+        self,
+        tracks: List[Dict],
+        filters: Dict,
+        deadline: Optional[float] = None
+    ) -> List[Dict]:
         """Filtra tracks por audio features con criterios más permisivos."""
         if not tracks or not filters:
             return tracks
@@ -354,9 +872,12 @@ class SpotifyService:
         batch_size = 50
         for i in range(0, len(track_ids), batch_size):
             batch = track_ids[i:i+batch_size]
+            if not self._has_budget(deadline):
+                logger.info("⏱️  Sin presupuesto para filtrar por audio features")
+                return tracks
             
             try:
-                features_list = self.sp.audio_features(batch)
+                features_list = self._call(deadline, self.sp.audio_features, batch)
                 
                 for features in features_list:
                     if not features or not features.get('id'):
@@ -376,7 +897,7 @@ class SpotifyService:
                 
                 # Delay entre batches para evitar rate limits
                 if i + batch_size < len(track_ids):
-                    time.sleep(0.2)
+                    self._pause(0.2, deadline)
                         
             except SpotifyException as e:
                 if e.http_status == 403:
@@ -448,10 +969,16 @@ class SpotifyService:
         
         return True
 
-    def _diversify_tracks(self, tracks: List[Dict], limit: int) -> List[Dict]:
+    def _diversify_tracks(
+        self,
+        tracks: List[Dict],
+        limit: int,
+        taste: Optional[TasteProfile] = None
+    ) -> List[Dict]:
         """
         Diversifica tracks INTELIGENTEMENTE sin audio_features.
-        Criterios: artistas, álbumes, popularidad, año de lanzamiento.
+        Criterios: artistas, álbumes, géneros, popularidad, año de lanzamiento
+        y, si el usuario tiene perfil de gustos, afinidad con sus playlists guardadas.
         """
         if len(tracks) <= limit:
             return tracks
@@ -459,6 +986,7 @@ class SpotifyService:
         # Análisis de metadata
         artist_count = defaultdict(int)
         album_count = defaultdict(int)
+        genre_count = defaultdict(int)
         genre_presence = defaultdict(list)
         
         # Extraer año de lanzamiento si está disponible
@@ -469,12 +997,43 @@ class SpotifyService:
                 track['_year'] = int(year) if year.isdigit() else 2020
             else:
                 track['_year'] = 2020
-        
+            genre_presence[self._primary_genre(track)].append(track)
+
+        # Afinidad con el perfil del usuario (con ruido para no repetir siempre lo mismo)
+        affinity = None
+        if taste is not None:
+            scores = {id(track): taste.score(track) for track in tracks}
+            affinity = lambda t: scores[id(t)] + random.random() * 0.5
+
+        # Sin géneros conocidos no hay nada que repartir: orden aleatorio
+        if len(genre_presence) > 1:
+            remaining = self._interleave_by_genre(genre_presence, affinity)
+        else:
+            remaining = tracks.copy()
+            random.shuffle(remaining)
+            if affinity is not None:
+                remaining.sort(key=affinity, reverse=True)
+
+        # Máximo de canciones por género (los tracks sin género no cuentan)
+        max_per_genre = max(2, limit // 4)
+
+        def genre_allows(track) -> bool:
+            genre = self._primary_genre(track)
+            return genre is None or genre_count[genre] < max_per_genre
+
         selected = []
-        remaining = tracks.copy()
-        random.shuffle(remaining)
+        selected_ids = set()
+
+        def take(track, artist_name, album_name):
+            selected.append(track)
+            selected_ids.add(id(track))
+            artist_count[artist_name] += 1
+            album_count[album_name] += 1
+            genre = self._primary_genre(track)
+            if genre is not None:
+                genre_count[genre] += 1
         
-        # FASE 1: Diversidad estricta (máximo 1 por artista)
+        # FASE 1: Diversidad estricta (máximo 1 por artista, repartido por géneros)
         for track in remaining:
             if len(selected) >= limit // 2:  # Primera mitad
                 break
@@ -482,33 +1041,30 @@ class SpotifyService:
             artist_name = track.get('artists', [{}])[0].get('name', 'Unknown')
             album_name = track.get('album', {}).get('name', 'Unknown')
             
-            if artist_count[artist_name] == 0:
-                selected.append(track)
-                artist_count[artist_name] += 1
-                album_count[album_name] += 1
+            if artist_count[artist_name] == 0 and genre_allows(track):
+                take(track, artist_name, album_name)
         
         # FASE 2: Completar con diversidad relajada (máximo 2 por artista)
         for track in remaining:
             if len(selected) >= limit:
                 break
             
-            if track in selected:
+            if id(track) in selected_ids:
                 continue
                 
             artist_name = track.get('artists', [{}])[0].get('name', 'Unknown')
             album_name = track.get('album', {}).get('name', 'Unknown')
             
-            if artist_count[artist_name] < 2 and album_count[album_name] < 2:
-                selected.append(track)
-                artist_count[artist_name] += 1
-                album_count[album_name] += 1
+            if artist_count[artist_name] < 2 and album_count[album_name] < 2 and genre_allows(track):
+                take(track, artist_name, album_name)
         
         # FASE 3: Si aún faltan, agregar lo que sea
         for track in remaining:
             if len(selected) >= limit:
                 break
-            if track not in selected:
+            if id(track) not in selected_ids:
                 selected.append(track)
+                selected_ids.add(id(track))
         
         # Ordenar por: 50% popularidad + 30% año + 20% aleatorio
         def score_track(t):
@@ -517,7 +1073,10 @@ class SpotifyService:
             year_score = (year - 1950) / 75 * 100  # Normalizar años 1950-2025 a 0-100
             random_factor = random.randint(0, 100)
             
-            return (popularity * 0.5) + (year_score * 0.3) + (random_factor * 0.2)
+            score = (popularity * 0.5) + (year_score * 0.3) + (random_factor * 0.2)
+            if taste is not None:
+                score = score * (1 - self.TASTE_WEIGHT) + scores[id(t)] * 100 * self.TASTE_WEIGHT
+            return score
         
         selected.sort(key=score_track, reverse=True)
         
@@ -529,6 +1088,43 @@ class SpotifyService:
         
         return selected[:limit]
 
+    @staticmethod
+    def _primary_genre(track: Dict) -> Optional[str]:
+        """Primer género del artista principal (None si no se conoce)."""
+        genres = track.get('_genres')
+        return genres[0] if genres else None
+
+    @staticmethod
+    def _interleave_by_genre(
+        genre_presence: Dict[Optional[str], List[Dict]],
+        affinity=None
+    ) -> List[Dict]:
+        """
+        Ordena los tracks tomando uno de cada género por turnos.
+        Con `affinity`, dentro de cada género salen primero los de mayor afinidad.
+        """
+        buckets = [bucket.copy() for bucket in genre_presence.values()]
+        for bucket in buckets:
+            random.shuffle(bucket)
+            if affinity is not None:
+                bucket.sort(key=affinity)  # pop() toma el último
+        random.shuffle(buckets)
+
+        ordered = []
+        while buckets:
+            for bucket in buckets:
+                ordered.append(bucket.pop())
+            buckets = [bucket for bucket in buckets if bucket]
+        return ordered
+
+    def _process_tracks(self, tracks: List[Dict]) -> List[Dict]:
+        processed = []
+        for track in tracks:
+            proc = self._process_track(track)
+            if proc:
+                processed.append(proc)
+        return processed
+
     def _process_track(self, track: Dict) -> Optional[Dict]:
         """Transforma track al formato del schema."""
         if not track or not track.get('id'):
@@ -538,6 +1134,7 @@ class SpotifyService:
             artists = [a.get('name', 'Unknown') for a in track.get('artists', [])]
             album_obj = track.get('album', {})
             album_images = album_obj.get('images', [])
+            year = (album_obj.get('release_date') or '').split('-')[0]
             
             return {
                 'id': track['id'],
@@ -548,13 +1145,20 @@ class SpotifyService:
                 'preview_url': track.get('preview_url'),
                 'external_url': track.get('external_urls', {}).get('spotify', ''),
                 'duration_ms': track.get('duration_ms', 0),
-                'popularity': track.get('popularity', 0)
+                'popularity': track.get('popularity', 0),
+                'artist_ids': [a['id'] for a in track.get('artists', []) if a.get('id')],
+                'genres': track.get('_genres', []),
+                'release_year': int(year) if year.isdigit() else None
             }
         except Exception as e:
             logger.error(f"Error procesando track: {e}")
             return None
 
-    def _analyze_track_features(self, track_ids: List[str]) -> Dict[str, Any]:
+    def _analyze_track_features(
+        self,
+        track_ids: List[str],
+        deadline: Optional[float] = None
+    ) -> Dict[str, Any]:
         """Analiza características promedio de las pistas."""
         default_features = {
             'valence': 0.5,
@@ -572,14 +1176,16 @@ class SpotifyService:
         batch_size = 50
         for i in range(0, len(track_ids), batch_size):
             batch = track_ids[i:i+batch_size]
+            if not self._has_budget(deadline):
+                break
             try:
-                features = self.sp.audio_features(batch)
+                features = self._call(deadline, self.sp.audio_features, batch)
                 if features:
                     all_features.extend([f for f in features if f])
                 
                 # Delay entre batches
                 if i + batch_size < len(track_ids):
-                    time.sleep(0.2)
+                    self._pause(0.2, deadline)
                     
             except SpotifyException as e:
                 if e.http_status == 403:
@@ -613,7 +1219,10 @@ class SpotifyService:
 
 
 def create_playlist_description(emotion: str) -> str:
-    """Genera descripción de playlist por emoción."""
+    """Genera descripción de playlist por emoción (configurable en emotions.json)."""
+    configured = emotion_config.current().descriptions.get(emotion)
+    if configured:
+        return configured
     descriptions = {
         'HAPPY': '¡Música alegre y energética para celebrar tu felicidad! 🎉',
         'SAD': 'Canciones emotivas que acompañan tus momentos de reflexión 💙',
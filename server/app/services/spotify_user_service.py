@@ -1,17 +1,35 @@
+import os
+import time
 import logging
-from typing import Dict, List, Optional, Any
-from datetime import datetime, timezone
-
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Any, Tuple
+from datetime import datetime, timedelta, timezone
+
+import httpx
 import requests
+from sqlalchemy import text
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from fastapi import HTTPException, status
 
+from app.config.database import SessionLocal
 from app.models.user import User
 from app.services.spotify_auth_service import spotify_auth_service
+from app.services.spotify_scheduler import spotify_scheduler
+from app.services.spotify_http import spotify_user_session
+from app.services.idempotency import record_progress, arecord_progress
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("spotify_user_service")
 
+# Errores de las versiones async que equivalen a RequestException en las sync:
+# los de httpx y el Timeout del scheduler cuando no hay turno (aslot)
+ASYNC_REQUEST_ERRORS = (httpx.HTTPError, requests.exceptions.Timeout)
+
 
 class SpotifyUserService:
     """
@@ -20,10 +38,178 @@ class SpotifyUserService:
     """
 
     SPOTIFY_API_URL = "https://api.spotify.com/v1"
+    ASYNC_MAX_CONNECTIONS = int(os.getenv('SPOTIFY_USER_ASYNC_MAX_CONNECTIONS', '20'))
+
+    # Refresco de tokens: en línea sólo si caducó (o está por caducar durante la
+    # petición); el refrescador los renueva REFRESH_MARGIN antes para los usuarios
+    # con actividad en los últimos ACTIVITY_WINDOW segundos
+    INLINE_SKEW = timedelta(seconds=30)
+    REFRESH_MARGIN = timedelta(seconds=int(os.getenv('SPOTIFY_TOKEN_REFRESH_MARGIN', '300')))
+    ACTIVITY_WINDOW = int(os.getenv('SPOTIFY_TOKEN_ACTIVITY_WINDOW', '1800'))
+    REFRESH_INTERVAL = int(os.getenv('SPOTIFY_TOKEN_REFRESH_INTERVAL', '60'))
+    # Espera máxima por la fila mientras otro proceso refresca el token
+    ROW_LOCK_TIMEOUT_MS = int(os.getenv('SPOTIFY_TOKEN_LOCK_TIMEOUT_MS', '15000'))
+    TOKEN_FIELDS = ['spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at']
+
+    # Caché de /me/playlists: fresca PLAYLISTS_TTL segundos; después se revalida
+    # con la primera página (snapshot_id) hasta PLAYLISTS_MAX_AGE, cuando se
+    # vuelve a pedir completa. La revalidación sólo ve la primera página: un
+    # cambio en una playlist más allá de las primeras PLAYLISTS_PAGE_SIZE que no
+    # altere el total ni el orden (p. ej. renombrarla desde otra app) puede
+    # tardar hasta PLAYLISTS_MAX_AGE en verse. Los cambios hechos desde aquí
+    # invalidan la caché al momento.
+    PLAYLISTS_PAGE_SIZE = 50
+    PLAYLISTS_TTL = int(os.getenv('SPOTIFY_USER_PLAYLISTS_TTL', '60'))
+    PLAYLISTS_MAX_AGE = int(os.getenv('SPOTIFY_USER_PLAYLISTS_MAX_AGE', '300'))
+    PLAYLISTS_MAX = int(os.getenv('SPOTIFY_USER_PLAYLISTS_MAX', '1000'))
+    PLAYLISTS_CACHE_USERS = 2000
+    PLAYLISTS_PAGE_WORKERS = 4
+
+    # Perfil (/me) por usuario con TTL corto; el dueño de una playlist no cambia,
+    # así que se recuerda sin TTL (acotado por tamaño)
+    PROFILE_TTL = int(os.getenv('SPOTIFY_USER_PROFILE_TTL', '300'))
+    PROFILE_CACHE_USERS = 2000
+    OWNER_CACHE_SIZE = int(os.getenv('SPOTIFY_PLAYLIST_OWNER_CACHE_SIZE', '50000'))
 
     def __init__(self):
+        self._async_client: Optional[httpx.AsyncClient] = None
+        # Candados por franja de usuarios: acotados y suficientes para el single-flight
+        self._refresh_locks = [threading.Lock() for _ in range(64)]
+        self._active: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._refresh_stats = {'inline': 0, 'proactive': 0, 'coalesced': 0, 'failures': 0}
+        # user_id -> (pedida en, validada en, playlists)
+        self._playlists: "OrderedDict[str, Tuple[float, float, List[Dict]]]" = OrderedDict()
+        self._playlist_stats = {'hits': 0, 'revalidated': 0, 'fetched': 0, 'invalidated': 0, 'discarded': 0}
+        # user_id -> generación (cada invalidación toma un valor nuevo del contador global);
+        # los usuarios expulsados del LRU comparten el suelo para no repetir valores
+        self._playlist_generations: "OrderedDict[str, int]" = OrderedDict()
+        self._generation_counter = 0
+        self._generation_floor = 0
+        # user_id -> (expira en, spotify_id, perfil)
+        self._profiles: "OrderedDict[str, Tuple[float, str, Dict]]" = OrderedDict()
+        # playlist_id -> spotify_id del dueño
+        self._owners: "OrderedDict[str, str]" = OrderedDict()
+        self._lookup_stats = {'profile_hits': 0, 'profile_misses': 0, 'owner_hits': 0, 'owner_misses': 0}
+        self._pages = ThreadPoolExecutor(max_workers=self.PLAYLISTS_PAGE_WORKERS, thread_name_prefix="playlist-page")
         logger.info("✅ SpotifyUserService inicializado")
 
+    def _request(self, method: str, url: str, timeout: float = 10, **kwargs) -> requests.Response:
+        """
+        Petición a la API de Spotify con turno del scheduler (carril del hilo actual)
+        sobre la sesión keep-alive compartida.
+        """
+        with spotify_scheduler.slot(timeout=timeout) as waited:
+            return spotify_user_session.request(method, url, timeout=max(0.1, timeout - waited), **kwargs)
+
+    @staticmethod
+    def _track_uris(tracks: List[str]) -> List[str]:
+        """IDs de Spotify -> URIs (las URIs se dejan como están)."""
+        return [t if t.startswith("spotify:") else f"spotify:track:{t}" for t in tracks]
+
+    @staticmethod
+    def _created_playlist(playlist_data: Dict, tracks_total: int) -> Dict:
+        return {
+            "id": playlist_data.get("id"),
+            "name": playlist_data.get("name"),
+            "description": playlist_data.get("description"),
+            "external_url": playlist_data.get("external_urls", {}).get("spotify"),
+            "uri": playlist_data.get("uri"),
+            "tracks_total": tracks_total,
+            "public": playlist_data.get("public"),
+            "collaborative": playlist_data.get("collaborative"),
+            "images": playlist_data.get("images", [])
+        }
+
+    @staticmethod
+    def _playlist_summary(item: Dict) -> Dict:
+        return {
+            "id": item.get("id"),
+            "name": item.get("name"),
+            "description": item.get("description"),
+            "external_url": item.get("external_urls", {}).get("spotify"),
+            "images": item.get("images", []),
+            "tracks_total": item.get("tracks", {}).get("total", 0),
+            "public": item.get("public"),
+            "collaborative": item.get("collaborative"),
+            "snapshot_id": item.get("snapshot_id")
+        }
+
+    @staticmethod
+    def _error_message(response, default: str) -> str:
+        """Mensaje de error de la respuesta de Spotify (o `default`)."""
+        if response is None:
+            return default
+        try:
+            return response.json().get("error", {}).get("message", default)
+        except Exception:
+            return default
+
+    # ============ TOKENS ============
+
+    @staticmethod
+    def _needs_refresh(user: User, margin: timedelta) -> bool:
+        expires_at = user.spotify_token_expires_at
+        return bool(expires_at) and expires_at <= datetime.now(timezone.utc) + margin
+
+    def _touch(self, user_id) -> None:
+        with self._lock:
+            self._active[str(user_id)] = time.monotonic()
+
+    def _lock_token_row(self, user: User, db: Session, skip_locked: bool) -> bool:
+        """
+        Bloquea la fila del usuario (SELECT ... FOR UPDATE) y relee su token, para
+        que un solo proceso (worker o nodo) lo refresque. Con `skip_locked` no
+        espera: False si otro proceso ya lo está refrescando.
+        """
+        if skip_locked:
+            locked = db.query(User.id).filter(User.id == user.id).with_for_update(skip_locked=True).first()
+            if locked is None:
+                return False
+            db.refresh(user, attribute_names=self.TOKEN_FIELDS)
+            return True
+
+        # Quien espera detrás de otro refresco recibe el token que éste escriba
+        db.execute(text(f"SET LOCAL lock_timeout = '{self.ROW_LOCK_TIMEOUT_MS}ms'"))
+        db.refresh(user, attribute_names=self.TOKEN_FIELDS, with_for_update=True)
+        return True
+
+    def _refresh_token(
+        self,
+        user: User,
+        db: Session,
+        margin: timedelta,
+        kind: str,
+        skip_locked: bool = False
+    ) -> None:
+        """
+        Refresca el token del usuario una sola vez aunque lo pidan varios hilos o
+        procesos: el candado local agrupa los hilos y el de la fila los procesos;
+        quien lo obtiene después relee el token y, si otro ya lo renovó, no vuelve
+        a llamar a Spotify.
+        """
+        with self._refresh_locks[hash(str(user.id)) % len(self._refresh_locks)]:
+            if not self._lock_token_row(user, db, skip_locked) or not self._needs_refresh(user, margin):
+                # Liberar el bloqueo de la fila
+                db.commit()
+                with self._lock:
+                    self._refresh_stats['coalesced'] += 1
+                return
+
+            now = datetime.now(timezone.utc)
+            token_data = spotify_auth_service.refresh_access_token(user.spotify_refresh_token)
+            user.spotify_access_token = token_data.get("access_token")
+            # Spotify puede rotar el refresh token
+            if token_data.get("refresh_token"):
+                user.spotify_refresh_token = token_data["refresh_token"]
+            user.spotify_token_expires_at = now + timedelta(seconds=token_data.get("expires_in", 3600))
+            db.commit()
+
+            with self._lock:
+                self._refresh_stats[kind] += 1
+
     def _ensure_valid_token(self, user: User, db: Session) -> str:
         """
         Asegura que el usuario tenga un token válido, refrescándolo si es necesario.
@@ -41,29 +227,27 @@ class SpotifyUserService:
                 detail="Debes conectar tu cuenta de Spotify primero"
             )
 
-        # Verificar si el token ha expirado
-        now = datetime.now(timezone.utc)
-        if user.spotify_token_expires_at and user.spotify_token_expires_at <= now:
+        self._touch(user.id)
+
+        # Verificar si el token ha expirado (o expira durante esta petición)
+        if self._needs_refresh(user, self.INLINE_SKEW):
             logger.info(f"🔄 Token expirado para usuario {user.username}, refrescando...")
 
             try:
-                # Refrescar el token
-                token_data = spotify_auth_service.refresh_access_token(
-                    user.spotify_refresh_token
-                )
-
-                # Actualizar el usuario con el nuevo token
-                from datetime import timedelta
-                user.spotify_access_token = token_data.get("access_token")
-                expires_in = token_data.get("expires_in", 3600)
-                user.spotify_token_expires_at = now + timedelta(seconds=expires_in)
-
-                db.commit()
-                db.refresh(user)
-
+                self._refresh_token(user, db, self.INLINE_SKEW, 'inline')
                 logger.info(f"✅ Token refrescado exitosamente para {user.username}")
 
             except Exception as e:
+                db.rollback()
+                # Si otro proceso completó el refresco (p. ej. se agotó lock_timeout esperándolo), usar su token
+                try:
+                    db.refresh(user, attribute_names=self.TOKEN_FIELDS)
+                    if not self._needs_refresh(user, self.INLINE_SKEW):
+                        return user.spotify_access_token
+                except Exception:
+                    db.rollback()
+                with self._lock:
+                    self._refresh_stats['failures'] += 1
                 logger.error(f"❌ Error refrescando token: {e}")
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -72,6 +256,221 @@ class SpotifyUserService:
 
         return user.spotify_access_token
 
+    def refresh_expiring_tokens(self) -> int:
+        """
+        Renueva los tokens que vencen dentro de REFRESH_MARGIN de los usuarios
+        activos recientemente, para que sus peticiones no esperen el refresco.
+
+        Returns:
+            Número de tokens renovados
+        """
+        cutoff = time.monotonic() - self.ACTIVITY_WINDOW
+        with self._lock:
+            self._active = {user_id: seen for user_id, seen in self._active.items() if seen >= cutoff}
+            user_ids = list(self._active)
+        if not user_ids:
+            return 0
+
+        refreshed = 0
+        db = SessionLocal()
+        try:
+            users = db.query(User).filter(
+                User.id.in_(user_ids),
+                User.spotify_connected.is_(True),
+                User.spotify_token_expires_at <= datetime.now(timezone.utc) + self.REFRESH_MARGIN
+            ).all()
+            for user in users:
+                try:
+                    before = user.spotify_token_expires_at
+                    # SKIP LOCKED: si otro worker ya lo está renovando, se salta
+                    self._refresh_token(user, db, self.REFRESH_MARGIN, 'proactive', skip_locked=True)
+                    refreshed += user.spotify_token_expires_at != before
+                except Exception as e:
+                    db.rollback()
+                    with self._lock:
+                        self._refresh_stats['failures'] += 1
+                    logger.warning(f"⚠️ No se pudo renovar el token de {user.username}: {getattr(e, 'detail', e)}")
+        finally:
+            db.close()
+
+        if refreshed:
+            logger.info(f"🔄 {refreshed} tokens de Spotify renovados antes de expirar")
+        return refreshed
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.REFRESH_INTERVAL):
+            try:
+                self.refresh_expiring_tokens()
+            except Exception as e:
+                logger.warning(f"⚠️ Error en el refrescador de tokens: {e}")
+
+    def start_token_refresher(self):
+        if self._refresher and self._refresher.is_alive():
+            return
+        self._stop.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True)
+        self._refresher.start()
+
+    def stop_token_refresher(self):
+        self._stop.set()
+
+    def token_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._refresh_stats, 'active_users': len(self._active)}
+
+    def playlist_cache_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._playlist_stats, 'users': len(self._playlists)}
+
+    # ============ CACHÉ DE PLAYLISTS DEL USUARIO ============
+
+    def _cached_playlists(self, user_id: str) -> Optional[Tuple[float, float, List[Dict]]]:
+        with self._lock:
+            entry = self._playlists.get(user_id)
+            if entry:
+                self._playlists.move_to_end(user_id)
+            return entry
+
+    def _playlist_generation(self, user_id: str) -> int:
+        with self._lock:
+            return self._playlist_generations.get(user_id, self._generation_floor)
+
+    def _store_playlists(self, user_id: str, playlists: List[Dict], generation: int, fetched_at: Optional[float] = None):
+        """
+        Guarda la lista sólo si nadie la invalidó desde que empezó la petición
+        (`generation`): si no, una respuesta en vuelo reviviría la lista vieja.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._playlist_generations.get(user_id, self._generation_floor) != generation:
+                self._playlist_stats['discarded'] += 1
+                return
+            self._playlists[user_id] = (fetched_at or now, now, playlists)
+            self._playlists.move_to_end(user_id)
+            while len(self._playlists) > self.PLAYLISTS_CACHE_USERS:
+                self._playlists.popitem(last=False)
+
+    def invalidate_playlists(self, user_id) -> None:
+        """Descarta la lista cacheada (tras crear o modificar playlists)."""
+        user_id = str(user_id)
+        with self._lock:
+            self._generation_counter += 1
+            self._playlist_generations[user_id] = self._generation_counter
+            self._playlist_generations.move_to_end(user_id)
+            while len(self._playlist_generations) > self.PLAYLISTS_CACHE_USERS:
+                _, self._generation_floor = self._playlist_generations.popitem(last=False)
+            if self._playlists.pop(user_id, None) is not None:
+                self._playlist_stats['invalidated'] += 1
+
+    def _count_playlists(self, stat: str):
+        with self._lock:
+            self._playlist_stats[stat] += 1
+
+    def _playlist_offsets(self, first_page: Dict) -> List[int]:
+        total = min(first_page.get("total", 0), self.PLAYLISTS_MAX)
+        return list(range(self.PLAYLISTS_PAGE_SIZE, total, self.PLAYLISTS_PAGE_SIZE))
+
+    def _first_page_matches(self, playlists: List[Dict], first_page: Dict) -> bool:
+        """
+        True si la primera página coincide con la caché: mismo total y mismos
+        (id, snapshot_id). snapshot_id cambia con cada modificación de la playlist.
+        Las páginas siguientes no se comprueban (comprobarlas costaría lo mismo
+        que pedirlas); por eso la entrada caduca a los PLAYLISTS_MAX_AGE.
+        """
+        items = first_page.get("items", [])
+        if first_page.get("total") != len(playlists) and len(playlists) < self.PLAYLISTS_MAX:
+            return False
+        return [(item.get("id"), item.get("snapshot_id")) for item in items] == [
+            (p["id"], p.get("snapshot_id")) for p in playlists[:len(items)]
+        ]
+
+    def _cached_or_revalidate(self, user_id: str) -> Tuple[Optional[List[Dict]], Optional[Tuple]]:
+        """
+        (playlists, None) si la caché está fresca; si no, (None, entrada) con la
+        entrada que todavía puede revalidarse (o None si hay que pedir todo).
+        """
+        entry = self._cached_playlists(user_id)
+        if not entry:
+            return None, None
+        fetched_at, validated_at, playlists = entry
+        now = time.monotonic()
+        if now - validated_at < self.PLAYLISTS_TTL:
+            self._count_playlists('hits')
+            return playlists, None
+        return None, entry if now - fetched_at < self.PLAYLISTS_MAX_AGE else None
+
+    def _fetch_playlists_page(self, headers: Dict, offset: int) -> Dict:
+        response = self._request(
+            "GET",
+            f"{self.SPOTIFY_API_URL}/me/playlists",
+            headers=headers,
+            params={"limit": self.PLAYLISTS_PAGE_SIZE, "offset": offset}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def _afetch_playlists_page(self, headers: Dict, offset: int) -> Dict:
+        response = await self._arequest(
+            "GET",
+            f"{self.SPOTIFY_API_URL}/me/playlists",
+            headers=headers,
+            params={"limit": self.PLAYLISTS_PAGE_SIZE, "offset": offset}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    # ============ CACHÉ DE PERFIL Y PROPIETARIOS ============
+
+    def _cached_profile(self, user: User) -> Optional[Dict]:
+        key = str(user.id)
+        with self._lock:
+            entry = self._profiles.get(key)
+            # La cuenta de Spotify vinculada pudo cambiar
+            if entry and entry[0] > time.monotonic() and entry[1] == user.spotify_id:
+                self._profiles.move_to_end(key)
+                self._lookup_stats['profile_hits'] += 1
+                return entry[2]
+            self._lookup_stats['profile_misses'] += 1
+            return None
+
+    def _store_profile(self, user: User, profile: Dict):
+        key = str(user.id)
+        with self._lock:
+            self._profiles[key] = (time.monotonic() + self.PROFILE_TTL, user.spotify_id, profile)
+            self._profiles.move_to_end(key)
+            while len(self._profiles) > self.PROFILE_CACHE_USERS:
+                self._profiles.popitem(last=False)
+
+    def _cached_owner(self, playlist_id: str) -> Optional[str]:
+        with self._lock:
+            owner_id = self._owners.get(playlist_id)
+            if owner_id is not None:
+                self._owners.move_to_end(playlist_id)
+                self._lookup_stats['owner_hits'] += 1
+            else:
+                self._lookup_stats['owner_misses'] += 1
+            return owner_id
+
+    def remember_owner(self, playlist_id: Optional[str], owner_id: Optional[str]):
+        """Registra el dueño de una playlist (p. ej. al crearla nosotros)."""
+        if not playlist_id or not owner_id:
+            return
+        with self._lock:
+            self._owners[playlist_id] = owner_id
+            self._owners.move_to_end(playlist_id)
+            while len(self._owners) > self.OWNER_CACHE_SIZE:
+                self._owners.popitem(last=False)
+
+    def _remember_owners(self, pages: List[Dict]):
+        for page in pages:
+            for item in page.get("items", []):
+                if item:
+                    self.remember_owner(item.get("id"), (item.get("owner") or {}).get("id"))
+
+    def lookup_cache_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._lookup_stats, 'profiles': len(self._profiles), 'owners': len(self._owners)}
+
     def get_user_spotify_profile(self, user: User, db: Session) -> Dict:
         """
         Obtiene el perfil del usuario desde Spotify.
@@ -81,19 +480,25 @@ class SpotifyUserService:
             db: Sesión de base de datos
 
         Returns:
-            Dict con información del perfil
+            Dict con información del perfil (cacheado PROFILE_TTL segundos)
         """
+        profile = self._cached_profile(user)
+        if profile is not None:
+            return profile
+
         access_token = self._ensure_valid_token(user, db)
         headers = {"Authorization": f"Bearer {access_token}"}
 
         try:
-            response = requests.get(
+            response = self._request(
+                "GET",
                 f"{self.SPOTIFY_API_URL}/me",
-                headers=headers,
-                timeout=10
+                headers=headers
             )
             response.raise_for_status()
-            return response.json()
+            profile = response.json()
+            self._store_profile(user, profile)
+            return profile
 
         except requests.exceptions.RequestException as e:
             logger.error(f"❌ Error obteniendo perfil de Spotify: {e}")
@@ -139,27 +544,24 @@ class SpotifyUserService:
                 "public": public
             }
 
-            create_response = requests.post(
+            # Desde aquí la playlist puede existir aunque falle la respuesta
+            record_progress()
+            create_response = self._request(
+                "POST",
                 f"{self.SPOTIFY_API_URL}/users/{user.spotify_id}/playlists",
                 json=create_payload,
-                headers=headers,
-                timeout=10
+                headers=headers
             )
             create_response.raise_for_status()
             playlist_data = create_response.json()
 
             playlist_id = playlist_data.get("id")
+            self.remember_owner(playlist_id, user.spotify_id)
             logger.info(f"✅ Playlist creada: {playlist_id}")
 
             # 2. Agregar canciones a la playlist
             if tracks:
-                # Convertir track IDs a URIs si es necesario
-                track_uris = []
-                for track in tracks:
-                    if track.startswith("spotify:track:"):
-                        track_uris.append(track)
-                    else:
-                        track_uris.append(f"spotify:track:{track}")
+                track_uris = self._track_uris(tracks)
 
                 # Spotify permite agregar máximo 100 canciones por request
                 for i in range(0, len(track_uris), 100):
@@ -167,43 +569,28 @@ class SpotifyUserService:
 
                     add_payload = {"uris": batch}
 
-                    add_response = requests.post(
+                    add_response = self._request(
+                        "POST",
                         f"{self.SPOTIFY_API_URL}/playlists/{playlist_id}/tracks",
                         json=add_payload,
-                        headers=headers,
-                        timeout=10
+                        headers=headers
                     )
                     add_response.raise_for_status()
+                    record_progress()
 
                 logger.info(f"✅ {len(track_uris)} canciones agregadas a la playlist")
 
-            return {
-                "id": playlist_id,
-                "name": playlist_data.get("name"),
-                "description": playlist_data.get("description"),
-                "external_url": playlist_data.get("external_urls", {}).get("spotify"),
-                "uri": playlist_data.get("uri"),
-                "tracks_total": len(tracks),
-                "public": playlist_data.get("public"),
-                "collaborative": playlist_data.get("collaborative"),
-                "images": playlist_data.get("images", [])
-            }
+            return self._created_playlist(playlist_data, len(tracks))
 
         except requests.exceptions.RequestException as e:
             logger.error(f"❌ Error creando playlist: {e}")
-            error_detail = "Error al crear la playlist en Spotify"
-
-            if hasattr(e, 'response') and e.response is not None:
-                try:
-                    error_data = e.response.json()
-                    error_detail = error_data.get("error", {}).get("message", error_detail)
-                except:
-                    pass
-
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=error_detail
+                detail=self._error_message(getattr(e, 'response', None), "Error al crear la playlist en Spotify")
             )
+        finally:
+            # Aunque falle a mitad, la lista de playlists pudo cambiar
+            self.invalidate_playlists(user.id)
 
     def add_tracks_to_playlist(
         self,
@@ -231,8 +618,7 @@ class SpotifyUserService:
         }
 
         try:
-            # Convertir IDs a URIs
-            track_uris = [f"spotify:track:{tid}" if not tid.startswith("spotify:") else tid for tid in track_ids]
+            track_uris = self._track_uris(track_ids)
 
             # Agregar en batches de 100
             added_count = 0
@@ -241,14 +627,15 @@ class SpotifyUserService:
 
                 payload = {"uris": batch}
 
-                response = requests.post(
+                response = self._request(
+                    "POST",
                     f"{self.SPOTIFY_API_URL}/playlists/{playlist_id}/tracks",
                     json=payload,
-                    headers=headers,
-                    timeout=10
+                    headers=headers
                 )
                 response.raise_for_status()
                 added_count += len(batch)
+                record_progress()
 
             logger.info(f"✅ {added_count} canciones agregadas a playlist {playlist_id}")
 
@@ -264,46 +651,52 @@ class SpotifyUserService:
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Error al agregar canciones a la playlist"
             )
+        finally:
+            # Aunque falle a mitad, la lista de playlists pudo cambiar
+            self.invalidate_playlists(user.id)
 
-    def get_user_playlists(self, user: User, db: Session, limit: int = 50) -> List[Dict]:
+    def get_user_playlists(self, user: User, db: Session) -> List[Dict]:
         """
-        Obtiene las playlists del usuario desde Spotify.
+        Obtiene todas las playlists del usuario desde Spotify (hasta PLAYLISTS_MAX).
+
+        Las páginas se piden en paralelo y la lista queda cacheada por usuario;
+        pasado PLAYLISTS_TTL se revalida con la primera página (snapshot_id).
 
         Args:
             user: Usuario actual
             db: Sesión de base de datos
-            limit: Número máximo de playlists a obtener
 
         Returns:
             Lista de playlists del usuario
         """
+        user_id = str(user.id)
+        playlists, stale = self._cached_or_revalidate(user_id)
+        if playlists is not None:
+            return playlists
+        generation = self._playlist_generation(user_id)
+
         access_token = self._ensure_valid_token(user, db)
         headers = {"Authorization": f"Bearer {access_token}"}
 
         try:
-            response = requests.get(
-                f"{self.SPOTIFY_API_URL}/me/playlists",
-                headers=headers,
-                params={"limit": limit},
-                timeout=10
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            playlists = []
-            for item in data.get("items", []):
-                playlists.append({
-                    "id": item.get("id"),
-                    "name": item.get("name"),
-                    "description": item.get("description"),
-                    "external_url": item.get("external_urls", {}).get("spotify"),
-                    "images": item.get("images", []),
-                    "tracks_total": item.get("tracks", {}).get("total", 0),
-                    "public": item.get("public"),
-                    "collaborative": item.get("collaborative")
-                })
-
-            logger.info(f"✅ {len(playlists)} playlists obtenidas para {user.username}")
+            first = self._fetch_playlists_page(headers, 0)
+            if stale and self._first_page_matches(stale[2], first):
+                self._store_playlists(user_id, stale[2], generation, fetched_at=stale[0])
+                self._count_playlists('revalidated')
+                return stale[2]
+
+            # bind() fija el carril de este hilo en los hilos que piden las páginas
+            futures = [
+                self._pages.submit(spotify_scheduler.bind(partial(self._fetch_playlists_page, headers, offset)))
+                for offset in self._playlist_offsets(first)
+            ]
+            pages = [first] + [future.result() for future in futures]
+            playlists = [self._playlist_summary(item) for page in pages for item in page.get("items", []) if item]
+            self._remember_owners(pages)
+            self._store_playlists(user_id, playlists, generation)
+            self._count_playlists('fetched')
+
+            logger.info(f"✅ {len(playlists)} playlists obtenidas para {user.username} ({len(pages)} páginas)")
             return playlists
 
         except requests.exceptions.RequestException as e:
@@ -325,19 +718,24 @@ class SpotifyUserService:
         Returns:
             True si el usuario es dueño de la playlist
         """
+        owner_id = self._cached_owner(playlist_id)
+        if owner_id is not None:
+            return owner_id == user.spotify_id
+
         access_token = self._ensure_valid_token(user, db)
         headers = {"Authorization": f"Bearer {access_token}"}
 
         try:
-            response = requests.get(
+            response = self._request(
+                "GET",
                 f"{self.SPOTIFY_API_URL}/playlists/{playlist_id}",
                 headers=headers,
-                timeout=10
+                params={"fields": "owner.id"}
             )
             response.raise_for_status()
-            playlist = response.json()
 
-            owner_id = playlist.get("owner", {}).get("id")
+            owner_id = response.json().get("owner", {}).get("id")
+            self.remember_owner(playlist_id, owner_id)
             return owner_id == user.spotify_id
 
         except requests.exceptions.RequestException as e:
@@ -345,5 +743,193 @@ class SpotifyUserService:
             return False
 
 
+    # ============ VERSIONES ASÍNCRONAS (rutas async def) ============
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        # HTTP/2 compartido; se crea con el primer uso, dentro del event loop
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=self.ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=self.ASYNC_MAX_CONNECTIONS
+                )
+            )
+        return self._async_client
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    async def _arequest(self, method: str, url: str, timeout: float = 10, **kwargs) -> httpx.Response:
+        """Versión asíncrona de _request (turno del scheduler sin bloquear el event loop)."""
+        async with spotify_scheduler.aslot(timeout=timeout) as waited:
+            return await self.async_client.request(method, url, timeout=max(0.1, timeout - waited), **kwargs)
+
+    async def _aensure_valid_token(self, user: User, db: Session) -> str:
+        """
+        Token vigente. Si no hace falta refrescarlo se resuelve en el event loop;
+        el refresco (HTTP + commit) se delega al threadpool para no bloquearlo.
+        """
+        if user.spotify_connected and user.spotify_access_token and not self._needs_refresh(user, self.INLINE_SKEW):
+            self._touch(user.id)
+            return user.spotify_access_token
+        return await run_in_threadpool(self._ensure_valid_token, user, db)
+
+    async def create_playlist_async(
+        self,
+        user: User,
+        name: str,
+        description: str,
+        tracks: List[str],
+        public: bool = False,
+        db: Session = None
+    ) -> Dict:
+        """
+        Versión asíncrona de create_playlist.
+        Los lotes de 100 canciones se agregan en orden (uno tras otro) para
+        conservar el orden de la playlist.
+        """
+        access_token = await self._aensure_valid_token(user, db)
+        headers = {"Authorization": f"Bearer {access_token}"}
+
+        try:
+            # Desde aquí la playlist puede existir aunque falle la respuesta
+            await arecord_progress()
+            create_response = await self._arequest(
+                "POST",
+                f"{self.SPOTIFY_API_URL}/users/{user.spotify_id}/playlists",
+                json={"name": name, "description": description, "public": public},
+                headers=headers
+            )
+            create_response.raise_for_status()
+            playlist_data = create_response.json()
+            playlist_id = playlist_data.get("id")
+            self.remember_owner(playlist_id, user.spotify_id)
+            logger.info(f"✅ Playlist creada: {playlist_id}")
+
+            if tracks:
+                await self._aadd_batches(playlist_id, self._track_uris(tracks), headers)
+                logger.info(f"✅ {len(tracks)} canciones agregadas a la playlist")
+
+            return self._created_playlist(playlist_data, len(tracks))
+
+        except ASYNC_REQUEST_ERRORS as e:
+            logger.error(f"❌ Error creando playlist: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=self._error_message(getattr(e, 'response', None), "Error al crear la playlist en Spotify")
+            )
+        finally:
+            # Aunque falle a mitad, la lista de playlists pudo cambiar
+            self.invalidate_playlists(user.id)
+
+    async def _aadd_batches(self, playlist_id: str, track_uris: List[str], headers: Dict) -> int:
+        added_count = 0
+        for i in range(0, len(track_uris), 100):
+            batch = track_uris[i:i + 100]
+            response = await self._arequest(
+                "POST",
+                f"{self.SPOTIFY_API_URL}/playlists/{playlist_id}/tracks",
+                json={"uris": batch},
+                headers=headers
+            )
+            response.raise_for_status()
+            added_count += len(batch)
+            await arecord_progress()
+        return added_count
+
+    async def add_tracks_to_playlist_async(
+        self,
+        user: User,
+        playlist_id: str,
+        track_ids: List[str],
+        db: Session = None
+    ) -> Dict:
+        """Versión asíncrona de add_tracks_to_playlist."""
+        access_token = await self._aensure_valid_token(user, db)
+        headers = {"Authorization": f"Bearer {access_token}"}
+
+        try:
+            added_count = await self._aadd_batches(playlist_id, self._track_uris(track_ids), headers)
+            logger.info(f"✅ {added_count} canciones agregadas a playlist {playlist_id}")
+            return {
+                "success": True,
+                "tracks_added": added_count,
+                "playlist_id": playlist_id
+            }
+
+        except ASYNC_REQUEST_ERRORS as e:
+            logger.error(f"❌ Error agregando canciones: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Error al agregar canciones a la playlist"
+            )
+        finally:
+            # Aunque falle a mitad, la lista de playlists pudo cambiar
+            self.invalidate_playlists(user.id)
+
+    async def get_user_playlists_async(self, user: User, db: Session) -> List[Dict]:
+        """Versión asíncrona de get_user_playlists (comparte la caché)."""
+        user_id = str(user.id)
+        playlists, stale = self._cached_or_revalidate(user_id)
+        if playlists is not None:
+            return playlists
+        generation = self._playlist_generation(user_id)
+
+        access_token = await self._aensure_valid_token(user, db)
+        headers = {"Authorization": f"Bearer {access_token}"}
+
+        try:
+            first = await self._afetch_playlists_page(headers, 0)
+            if stale and self._first_page_matches(stale[2], first):
+                self._store_playlists(user_id, stale[2], generation, fetched_at=stale[0])
+                self._count_playlists('revalidated')
+                return stale[2]
+
+            pages = [first] + list(await asyncio.gather(*(
+                self._afetch_playlists_page(headers, offset) for offset in self._playlist_offsets(first)
+            )))
+            playlists = [self._playlist_summary(item) for page in pages for item in page.get("items", []) if item]
+            self._remember_owners(pages)
+            self._store_playlists(user_id, playlists, generation)
+            self._count_playlists('fetched')
+
+            logger.info(f"✅ {len(playlists)} playlists obtenidas para {user.username} ({len(pages)} páginas)")
+            return playlists
+
+        except ASYNC_REQUEST_ERRORS as e:
+            logger.error(f"❌ Error obteniendo playlists: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Error al obtener tus playlists de Spotify"
+            )
+
+    async def check_playlist_ownership_async(self, user: User, playlist_id: str, db: Session) -> bool:
+        """Versión asíncrona de check_playlist_ownership."""
+        owner_id = self._cached_owner(playlist_id)
+        if owner_id is not None:
+            return owner_id == user.spotify_id
+
+        access_token = await self._aensure_valid_token(user, db)
+
+        try:
+            response = await self._arequest(
+                "GET",
+                f"{self.SPOTIFY_API_URL}/playlists/{playlist_id}",
+                headers={"Authorization": f"Bearer {access_token}"},
+                params={"fields": "owner.id"}
+            )
+            response.raise_for_status()
+            owner_id = response.json().get("owner", {}).get("id")
+            self.remember_owner(playlist_id, owner_id)
+            return owner_id == user.spotify_id
+
+        except ASYNC_REQUEST_ERRORS as e:
+            logger.error(f"❌ Error verificando propiedad de playlist: {e}")
+            return False
+
 # Instancia global
 spotify_user_service = SpotifyUserService()
@@ -0,0 +1,249 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.config.database import SessionLocal
+from app.models.emotion_analysis import SavedPlaylist
+from app.models.user_taste_profile import UserTasteProfile
+
+logger = logging.getLogger("taste_profile")
+
+# Máximo de claves que se guardan por perfil (se descartan las menos frecuentes)
+MAX_ARTISTS = 500
+MAX_GENRES = 200
+
+
+def _artist_keys(track: Dict) -> List[str]:
+    """Claves de artista de un track guardado (IDs; nombres en playlists antiguas)."""
+    if track.get('artist_ids'):
+        return [artist_id for artist_id in track['artist_ids'] if artist_id]
+    return [f"name:{name.lower()}" for name in track.get('artists') or [] if isinstance(name, str)]
+
+
+def _trim(counts: Dict[str, int], limit: int) -> Dict[str, int]:
+    counts = {key: value for key, value in counts.items() if value > 0}
+    if len(counts) <= limit:
+        return counts
+    return dict(sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit])
+
+
+def _accumulate(tracks: Iterable[Dict], sign: int, artists: Dict[str, int], genres: Dict[str, int]) -> Tuple[int, int, int]:
+    """Suma (o resta) los tracks a los contadores; retorna (popularidad, años, tracks con año)."""
+    popularity_sum = year_sum = year_count = 0
+    for track in tracks:
+        for key in set(_artist_keys(track)):
+            artists[key] = artists.get(key, 0) + sign
+        for genre in set(track.get('genres') or []):
+            genres[genre] = genres.get(genre, 0) + sign
+        popularity_sum += sign * int(track.get('popularity') or 0)
+        if track.get('release_year'):
+            year_sum += sign * int(track['release_year'])
+            year_count += sign
+    return popularity_sum, year_sum, year_count
+
+
+class TasteProfile:
+    """Vector de gustos listo para puntuar candidatos en O(artistas + géneros del track)."""
+
+    def __init__(
+        self,
+        artists: Dict[str, int],
+        genres: Dict[str, int],
+        track_count: int,
+        popularity_sum: int,
+        year_sum: int,
+        year_count: int
+    ):
+        self.artists = artists
+        self.genres = genres
+        self.track_count = track_count
+        self.avg_popularity = popularity_sum / track_count if track_count else None
+        self.avg_year = year_sum / year_count if year_count else None
+        self._max_artist = max(self.artists.values(), default=0)
+        self._max_genre = max(self.genres.values(), default=0)
+
+    @classmethod
+    def from_row(cls, row: UserTasteProfile) -> "TasteProfile":
+        return cls(
+            dict(row.artists or {}), dict(row.genres or {}), row.track_count,
+            row.popularity_sum, row.year_sum, row.year_count
+        )
+
+    @classmethod
+    def from_tracks(cls, tracks: Iterable[Dict]) -> "TasteProfile":
+        """Perfil de un conjunto de tracks guardados (p. ej. una sola playlist)."""
+        tracks = [t for t in tracks if isinstance(t, dict)]
+        artists: Dict[str, int] = {}
+        genres: Dict[str, int] = {}
+        popularity_sum, year_sum, year_count = _accumulate(tracks, 1, artists, genres)
+        return cls(artists, genres, len(tracks), popularity_sum, year_sum, year_count)
+
+    def score(self, track: Dict) -> float:
+        """
+        Afinidad 0..1 de un candidato (formato de Spotify reducido) con el perfil:
+        50% artistas, 30% géneros, 10% popularidad y 10% época.
+        """
+        artist_affinity = 0.0
+        if self._max_artist:
+            for artist in track.get('artists') or []:
+                count = self.artists.get(artist.get('id')) or self.artists.get(f"name:{(artist.get('name') or '').lower()}")
+                if count:
+                    artist_affinity = max(artist_affinity, count / self._max_artist)
+
+        genre_affinity = 0.0
+        if self._max_genre:
+            for genre in track.get('_genres') or []:
+                genre_affinity = max(genre_affinity, self.genres.get(genre, 0) / self._max_genre)
+
+        popularity_affinity = 0.5
+        if self.avg_popularity is not None:
+            popularity_affinity = 1 - abs(track.get('popularity', 50) - self.avg_popularity) / 100
+
+        era_affinity = 0.5
+        year = track.get('_year')
+        if self.avg_year is not None and year:
+            era_affinity = max(0.0, 1 - abs(year - self.avg_year) / 30)
+
+        return artist_affinity * 0.5 + genre_affinity * 0.3 + popularity_affinity * 0.1 + era_affinity * 0.1
+
+
+class TasteProfileStore:
+    """
+    Perfiles de gustos por usuario en `user_taste_profiles`.
+
+    Se actualizan de forma incremental al guardar o eliminar playlists (sumando o
+    restando sus tracks), así que leerlos es una consulta por clave primaria que
+    además se cachea en memoria `ttl_seconds`.
+
+    La primera vez que se usa el perfil de un usuario (o si es anterior al
+    backfill) se reconstruye con todas sus playlists guardadas; desde ahí todas
+    cuentan, así que restar una al eliminarla no descuadra los contadores.
+    """
+
+    def __init__(self, ttl_seconds: int = 300, max_users: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._cache: "OrderedDict[str, Tuple[float, Optional[TasteProfile]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _locked_profile(self, user_id: str, db: Session) -> Tuple[UserTasteProfile, bool]:
+        """
+        Fila del perfil bloqueada (FOR UPDATE), creada si falta. Si no tiene
+        backfill se reconstruye con las playlists guardadas visibles en `db`.
+
+        Returns:
+            (fila, True si se acaba de reconstruir)
+        """
+        db.execute(insert(UserTasteProfile).values(
+            user_id=user_id, artists={}, genres={}, track_count=0,
+            popularity_sum=0, year_sum=0, year_count=0
+        ).on_conflict_do_nothing(index_elements=[UserTasteProfile.user_id]))
+        profile = db.query(UserTasteProfile).filter(
+            UserTasteProfile.user_id == user_id
+        ).with_for_update().one()
+        if profile.backfilled_at is not None:
+            return profile, False
+
+        artists: Dict[str, int] = {}
+        genres: Dict[str, int] = {}
+        track_count = popularity_sum = year_sum = year_count = 0
+        rows = db.query(SavedPlaylist.tracks).filter(SavedPlaylist.user_id == user_id).yield_per(100)
+        for (playlist_tracks,) in rows:
+            playlist_tracks = [t for t in playlist_tracks or [] if isinstance(t, dict)]
+            popularity_delta, year_delta, year_count_delta = _accumulate(playlist_tracks, 1, artists, genres)
+            track_count += len(playlist_tracks)
+            popularity_sum += popularity_delta
+            year_sum += year_delta
+            year_count += year_count_delta
+
+        profile.artists = _trim(artists, MAX_ARTISTS)
+        profile.genres = _trim(genres, MAX_GENRES)
+        profile.track_count = track_count
+        profile.popularity_sum = popularity_sum
+        profile.year_sum = year_sum
+        profile.year_count = year_count
+        profile.backfilled_at = datetime.now(timezone.utc)
+        logger.info(f"🧮 Perfil de gustos de {user_id} reconstruido ({track_count} tracks)")
+        return profile, True
+
+    def apply(self, user_id: str, tracks: Iterable[Dict], db: Session, sign: int = 1) -> None:
+        """
+        Suma (sign=1) o resta (sign=-1) los tracks de una playlist al perfil.
+        Usa la sesión del llamador: el cambio se confirma junto con la playlist.
+        El cambio de la playlist (alta, ampliación o baja) debe estar ya en la
+        sesión con flush: si el perfil se reconstruye, ya lo incluye.
+        """
+        tracks = [t for t in tracks if isinstance(t, dict)]
+        if not tracks:
+            return
+
+        profile, rebuilt = self._locked_profile(user_id, db)
+        if rebuilt:
+            return
+
+        artists = dict(profile.artists or {})
+        genres = dict(profile.genres or {})
+        popularity_delta, year_delta, year_count_delta = _accumulate(tracks, sign, artists, genres)
+        popularity_sum = profile.popularity_sum + popularity_delta
+        year_sum = profile.year_sum + year_delta
+        year_count = profile.year_count + year_count_delta
+
+        # Reasignar los dicts para que SQLAlchemy detecte el cambio en JSONB
+        profile.artists = _trim(artists, MAX_ARTISTS)
+        profile.genres = _trim(genres, MAX_GENRES)
+        profile.track_count = max(0, profile.track_count + sign * len(tracks))
+        profile.popularity_sum = max(0, popularity_sum)
+        profile.year_sum = max(0, year_sum)
+        profile.year_count = max(0, year_count)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._cache.pop(str(user_id), None)
+
+    def get(self, user_id: Optional[str]) -> Optional[TasteProfile]:
+        """Perfil del usuario (None si no tiene playlists guardadas)."""
+        if not user_id:
+            return None
+        key = str(user_id)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return entry[1]
+
+        profile = None
+        db = SessionLocal()
+        try:
+            row = db.query(UserTasteProfile).filter(UserTasteProfile.user_id == key).first()
+            if row is None or row.backfilled_at is None:
+                # Usuario con historial previo al perfil: se construye una sola vez
+                row, _ = self._locked_profile(key, db)
+                db.commit()
+            if row.track_count > 0:
+                profile = TasteProfile.from_row(row)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"No se pudo leer user_taste_profiles: {e}")
+            return None
+        finally:
+            db.close()
+
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl_seconds, profile)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_users:
+                self._cache.popitem(last=False)
+        return profile
+
+
+# Instancia global
+taste_profile_store = TasteProfileStore(
+    ttl_seconds=int(os.getenv('TASTE_PROFILE_TTL', '300'))
+)
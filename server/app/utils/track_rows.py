@@ -0,0 +1,104 @@
+import re
+import hashlib
+import unicodedata
+from typing import Dict, List, Optional
+
+# Sufijos de reedición que no cambian la grabación (remaster, deluxe, etc.);
+# live, remix, acoustic, feat., etc. son canciones distintas y se conservan
+_REISSUE = r"(remaster(ed)?|deluxe|expanded|anniversary|edition|bonus\s+track|explicit|clean|mono|stereo|(single|album)\s+version)"
+_DISTINCT = re.compile(r"\b(live|remix|mix|acoustic|acustic[oa]|demo|instrumental|edit|feat|ft|featuring|with|version\s+\w+)\b")
+_BRACKETED = re.compile(r"[\(\[]([^\)\]]*)[\)\]]")
+_DASH_SUFFIX = re.compile(r"\s-\s(.*)$")
+_REISSUE_WORD = re.compile(r"\b" + _REISSUE + r"\b")
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def slim_track(track: Dict) -> Dict:
+    """
+    Reduce un track de la API de Spotify a los campos que usan la diversificación
+    y `_process_track`, para poder guardarlo en pools sin el payload completo.
+    """
+    album = track.get('album') or {}
+    images = album.get('images') or []
+    slim = {
+        'id': track.get('id'),
+        'name': track.get('name'),
+        'artists': [
+            {'id': a.get('id'), 'name': a.get('name')}
+            for a in track.get('artists') or []
+        ],
+        'album': {
+            'name': album.get('name'),
+            'release_date': album.get('release_date'),
+            'images': images[:1]
+        },
+        'preview_url': track.get('preview_url'),
+        'external_urls': {'spotify': (track.get('external_urls') or {}).get('spotify', '')},
+        'duration_ms': track.get('duration_ms', 0),
+        'popularity': track.get('popularity', 0)
+    }
+    if track.get('_genres'):
+        slim['_genres'] = track['_genres']
+    return slim
+
+
+# Columnas de un track procesado (ver TrackResponse)
+TRACK_FIELDS = [
+    'id', 'name', 'artists', 'album', 'album_image', 'preview_url',
+    'external_url', 'duration_ms', 'popularity', 'artist_ids', 'genres', 'release_year'
+]
+
+
+def pack_tracks(tracks: List[Dict], fields: Optional[List[str]] = None) -> Dict:
+    """
+    Empaqueta tracks procesados como filas sin repetir las claves en cada track.
+    Las columnas se guardan junto a las filas para poder agregar campos después.
+    """
+    fields = fields or TRACK_FIELDS
+    return {
+        'v': 1,
+        'fields': fields,
+        'rows': [[track.get(field) for field in fields] for track in tracks]
+    }
+
+
+def unpack_tracks(data: Optional[Dict]) -> List[Dict]:
+    """Inverso de pack_tracks."""
+    if not data or not data.get('rows'):
+        return []
+    fields = data.get('fields') or TRACK_FIELDS
+    return [dict(zip(fields, row)) for row in data['rows']]
+
+
+def _normalize(text: str) -> str:
+    """Minúsculas sin acentos, conservando letras de cualquier alfabeto."""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def _strip_reissue(title: str) -> str:
+    def drop(match: re.Match) -> str:
+        content = match.group(1)
+        if _REISSUE_WORD.search(content) and not _DISTINCT.search(_REISSUE_WORD.sub(' ', content)):
+            return ' '
+        return match.group(0)
+
+    title = _BRACKETED.sub(drop, title)
+    return _DASH_SUFFIX.sub(drop, title)
+
+
+def track_fingerprint(track: Dict) -> str:
+    """
+    Huella de título + artista principal normalizados. Remasters y reediciones
+    (deluxe, versión single/álbum) de una misma canción comparten huella; las
+    versiones en vivo, remixes, acústicas o con otros artistas no.
+    """
+    title = _NON_WORD.sub(' ', _strip_reissue(_normalize(track.get('name')))).strip()
+    if not title:
+        # Sin título comparable: no agrupar con otras canciones
+        return f"id:{track.get('id')}"
+
+    artists = track.get('artists') or [{}]
+    artist = _NON_WORD.sub(' ', _normalize(artists[0].get('name'))).strip()
+
+    return hashlib.blake2b(f"{title}|{artist}".encode('utf-8'), digest_size=8).hexdigest()
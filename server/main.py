@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import auth_routes, emotion_routes, music_routes, history_routes
 import os
+import threading
 from dotenv import load_dotenv
 from app.config.database import Base, engine
 import logging
@@ -109,10 +110,13 @@ def on_startup():
                 ADD COLUMN IF NOT EXISTS spotify_refresh_token TEXT,
                 ADD COLUMN IF NOT EXISTS spotify_token_expires_at TIMESTAMP WITH TIME ZONE,
                 ADD COLUMN IF NOT EXISTS spotify_connected BOOLEAN DEFAULT FALSE,
-                ADD COLUMN IF NOT EXISTS spotify_connected_at TIMESTAMP WITH TIME ZONE;
+                ADD COLUMN IF NOT EXISTS spotify_connected_at TIMESTAMP WITH TIME ZONE,
+                ADD COLUMN IF NOT EXISTS spotify_country VARCHAR(2),
+                ADD COLUMN IF NOT EXISTS daily_mix_enabled BOOLEAN DEFAULT FALSE;
                 """)
             except Exception:
                 # Algunos drivers/PG versions no permiten múltiples ADD COLUMN en una sola sentencia
+                conn.rollback()  # la transacción quedó abortada por el error
                 try:
                     conn.exec_driver_sql("ALTER TABLE users ADD COLUMN IF NOT EXISTS spotify_id VARCHAR(255) UNIQUE;")
                 except Exception:
@@ -145,6 +149,22 @@ def on_startup():
                     conn.exec_driver_sql("ALTER TABLE users ADD COLUMN IF NOT EXISTS spotify_connected_at TIMESTAMP WITH TIME ZONE;")
                 except Exception:
                     pass
+                try:
+                    conn.exec_driver_sql("ALTER TABLE users ADD COLUMN IF NOT EXISTS spotify_country VARCHAR(2);")
+                except Exception:
+                    pass
+                try:
+                    conn.exec_driver_sql("ALTER TABLE users ADD COLUMN IF NOT EXISTS daily_mix_enabled BOOLEAN DEFAULT FALSE;")
+                except Exception:
+                    pass
+            # Perfiles de gustos creados antes del backfill (se reconstruyen al usarse)
+            conn.exec_driver_sql(
+                "ALTER TABLE IF EXISTS user_taste_profiles ADD COLUMN IF NOT EXISTS backfilled_at TIMESTAMP WITH TIME ZONE;"
+            )
+            # Código HTTP de los errores guardados por Idempotency-Key
+            conn.exec_driver_sql("ALTER TABLE IF EXISTS idempotency_keys ADD COLUMN IF NOT EXISTS status_code INTEGER;")
+            # SQLAlchemy 2 no hace autocommit: sin esto los ALTER se descartan al cerrar
+            conn.commit()
         
         logger.info("📊 Para verificar la conexión a la base de datos, visita /health/db")
 
@@ -152,12 +172,55 @@ def on_startup():
         Base.metadata.create_all(bind=engine)
         logger.info("✅ Base de datos inicializada correctamente")
         
+        # Mapear el snapshot de pools exportado offline: los workers comparten las páginas
+        # del archivo y cada uno decodifica (con el TTL de la caché) sólo los pools que sirve
+        snapshot_path = os.getenv("SPOTIFY_POOL_SNAPSHOT")
+        if snapshot_path:
+            from app.services.recommendation_pool import candidate_pool_cache
+            try:
+                candidate_pool_cache.load_snapshot(snapshot_path)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo cargar el snapshot de pools: {e}")
+
+        # Renovar los tokens de Spotify de los usuarios activos antes de que expiren
+        from app.services.spotify_user_service import spotify_user_service
+        spotify_user_service.start_token_refresher()
+
+        # Purgar claves de idempotencia vencidas
+        from app.services.idempotency import idempotency_service
+        idempotency_service.prune()
+
+        # Retomar las playlists encoladas que quedaron pendientes
+        from app.services.playlist_jobs import playlist_job_service
+        playlist_job_service.resume_pending()
+
+        # Precargar pools de recomendaciones de los mercados principales en segundo plano
+        from app.controllers.music_controller import MusicController
+        threading.Thread(target=MusicController.preload_top_markets, name="pool-preload", daemon=True).start()
+        
         logger.info(f"✅ Servidor iniciado correctamente en http://0.0.0.0:8000")
         logger.info(f"📚 Documentación disponible en http://0.0.0.0:8000/api/docs")
         
     except Exception as e:
         logger.exception("❌ Error creando tablas en el arranque: %s", e)
 
+@app.on_event("shutdown")
+def on_shutdown():
+    # Persistir filtros de canciones recientes pendientes
+    from app.services.recent_tracks_filter import recent_tracks_registry
+    recent_tracks_registry.flush()
+
+    from app.services.spotify_user_service import spotify_user_service
+    spotify_user_service.stop_token_refresher()
+
+@app.on_event("shutdown")
+async def close_async_clients():
+    # Cerrar las conexiones HTTP/2 de los clientes asíncronos de Spotify
+    from app.services.spotify_async import async_spotify_service
+    from app.services.spotify_user_service import spotify_user_service
+    await async_spotify_service.client.aclose()
+    await spotify_user_service.aclose()
+
 # Health DB endpoint
 @app.get("/health/db")
 def health_db():